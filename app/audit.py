@@ -0,0 +1,173 @@
+# audit.py
+# Audit events are queued in memory and written by a background thread in
+# batched inserts, so an API call no longer pays its own commit for the audit row.
+# A batch is written once AUDIT_FLUSH_ROWS events are waiting or the oldest has
+# waited AUDIT_FLUSH_SECONDS. Each event keeps the time it was recorded, not the
+# time it was written. stop() (app shutdown, or interpreter exit) writes whatever
+# is still queued; flush() does the same on demand, e.g. before reading the log.
+# Events are numbered as they are recorded, and flush() waits only for those
+# recorded before it was called, so it returns promptly under steady traffic.
+
+import os
+import heapq
+import atexit
+import queue
+import logging
+import datetime
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from app import database, services
+
+AUDIT_FLUSH_ROWS = int(os.getenv("AUDIT_FLUSH_ROWS", "200"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "1.0"))
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "100000"))
+
+
+class AuditWriter:
+    def __init__(self, flush_rows: int = AUDIT_FLUSH_ROWS, flush_seconds: float = AUDIT_FLUSH_SECONDS,
+                 queue_size: int = AUDIT_QUEUE_SIZE):
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        # A full queue blocks record() rather than dropping events.
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._write_lock = threading.Lock()
+        # Sequence numbers of events recorded but not yet committed or dropped, including a batch the
+        # writer thread is still collecting. The heap gives the oldest; entries leave it lazily.
+        self._recorded = 0
+        self._unsettled: Set[int] = set()
+        self._unsettled_heap: List[int] = []
+        self._written_cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0
+
+    def record(self, username: str, action: str) -> None:
+        with self._written_cond:
+            self._recorded += 1
+            seq = self._recorded
+            self._unsettled.add(seq)
+            heapq.heappush(self._unsettled_heap, seq)
+        self._queue.put((seq, {"username": username, "action": action, "timestamp": datetime.datetime.utcnow()}))
+
+    # --- Lifecycle ---
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Writes everything queued so far, and waits for a batch the writer thread is holding.
+
+        Only events recorded before the call are waited for; later ones are left to the writer thread.
+        """
+        with self._written_cond:
+            target = self._recorded
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._write(batch)
+        with self._written_cond:
+            self._written_cond.wait_for(lambda: self._oldest_unsettled() > target, timeout)
+
+    def _oldest_unsettled(self) -> float:
+        """The lowest sequence number not yet written or dropped (inf if none). Caller holds _written_cond."""
+        heap = self._unsettled_heap
+        while heap and heap[0] not in self._unsettled:
+            heapq.heappop(heap)
+        return heap[0] if heap else float("inf")
+
+    def _settle(self, seqs: List[int]) -> None:
+        with self._written_cond:
+            self._unsettled.difference_update(seqs)
+            self._written_cond.notify_all()
+
+    # --- Writer ---
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                batch = [self._queue.get(timeout=self.flush_seconds)]
+            except queue.Empty:
+                continue
+            deadline = batch[0][1]["timestamp"] + datetime.timedelta(seconds=self.flush_seconds)
+            while len(batch) < self.flush_rows:
+                remaining = (deadline - datetime.datetime.utcnow()).total_seconds()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: List[Tuple[int, Dict[str, Any]]]) -> None:
+        if not batch:
+            return
+        with self._write_lock:
+            try:
+                with database.engine.begin() as conn:
+                    conn.execute(database.AuditLog.__table__.insert(), [event for _, event in batch])
+                self.written += len(batch)
+                self._settle([seq for seq, _ in batch])
+            except Exception as e:
+                logging.error(f"❌ Failed to write {len(batch)} audit events: {e}")
+                # Kept for the next attempt rather than lost; put_nowait so a full queue cannot deadlock the writer.
+                dropped = []
+                for item in batch:
+                    try:
+                        self._queue.put_nowait(item)
+                    except queue.Full:
+                        logging.error(f"❌ Dropped audit event: {item[1]}")
+                        dropped.append(item[0])
+                self._settle(dropped)
+
+
+writer = AuditWriter()
+atexit.register(writer.flush)
+
+
+def record(username: str, action: str) -> None:
+    writer.record(username, action)
+
+
+def query_log(db: Session, limit: int, cursor: Optional[str] = None, username: Optional[str] = None,
+              action: Optional[str] = None, since: Optional[datetime.datetime] = None,
+              until: Optional[datetime.datetime] = None) -> Dict[str, Any]:
+    """A page of audit events, newest first, seeking on the (timestamp, id) index.
+
+    `action` matches as a case-insensitive substring. Raises ValueError for a malformed cursor.
+    """
+    t = database.AuditLog.__table__
+    stmt = sqlalchemy.select(t.c.id, t.c.username, t.c.timestamp, t.c.action)
+    if cursor:
+        after_ts, after_id = services.decode_cursor(cursor)
+        stmt = stmt.where(sqlalchemy.tuple_(t.c.timestamp, t.c.id) < sqlalchemy.tuple_(after_ts, after_id))
+    if username:
+        stmt = stmt.where(t.c.username == username)
+    if action:
+        stmt = stmt.where(t.c.action.ilike(f"%{action}%"))
+    if since:
+        stmt = stmt.where(t.c.timestamp >= since)
+    if until:
+        stmt = stmt.where(t.c.timestamp < until)
+    rows = db.execute(stmt.order_by(t.c.timestamp.desc(), t.c.id.desc()).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "entries": [dict(row._mapping) for row in rows],
+        "next_cursor": services.encode_cursor(rows[-1].timestamp, rows[-1].id) if has_more else None,
+    }
@@ -0,0 +1,263 @@
+# auto_detection.py
+# Opt-in streaming detection. While a model is selected (AUTO_DETECT_MODEL, or
+# POST /detection/auto), /ingest_batch/ hands the ids it has just committed to
+# AutoDetector. Its background thread labels them in micro-batches of up to
+# AUTO_DETECT_BATCH_ROWS rows, collected for at most AUTO_DETECT_MAX_WAIT_MS:
+# the rules, then the promoted version of the selected model, written with the
+# counters in one commit. ingest_to_label_seconds measures each row from its
+# ingest commit to its label commit.
+#
+# Backpressure: at most AUTO_DETECT_QUEUE_ROWS rows are admitted at a time. An
+# ingest reserves room for its rows before inserting them and waits up to
+# AUTO_DETECT_ADMIT_SECONDS for it. If no room frees up, it is turned away (503)
+# with nothing inserted, so ingest cannot run further ahead of scoring than the queue.
+#
+# Rows a running detection run will reach (id <= its last shard) are left to it.
+# The queue is held in memory only: rows still queued at shutdown, or when the
+# mode is switched off, stay unprocessed for the next detection run.
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import sqlalchemy
+
+from app import counters, database, detection_runs, explanations, metrics, scoring
+from ml import features, model
+
+AUTO_DETECT_MODEL = os.getenv("AUTO_DETECT_MODEL", "")  # empty: off until POST /detection/auto selects a model
+AUTO_DETECT_BATCH_ROWS = int(os.getenv("AUTO_DETECT_BATCH_ROWS", "2000"))
+AUTO_DETECT_MAX_WAIT_MS = float(os.getenv("AUTO_DETECT_MAX_WAIT_MS", "250"))
+AUTO_DETECT_QUEUE_ROWS = int(os.getenv("AUTO_DETECT_QUEUE_ROWS", "50000"))
+AUTO_DETECT_ADMIT_SECONDS = float(os.getenv("AUTO_DETECT_ADMIT_SECONDS", "10"))
+
+Enqueue = Callable[[List[int]], None]
+
+
+class Backpressure(Exception):
+    """The queue stayed full for the whole admission wait."""
+
+
+class AutoDetector:
+    def __init__(self, model_name: Optional[str] = AUTO_DETECT_MODEL or None, batch_rows: int = AUTO_DETECT_BATCH_ROWS,
+                 max_wait_ms: float = AUTO_DETECT_MAX_WAIT_MS, queue_rows: int = AUTO_DETECT_QUEUE_ROWS,
+                 admit_seconds: float = AUTO_DETECT_ADMIT_SECONDS):
+        self.model_name = model_name
+        self.batch_rows = max(1, batch_rows)
+        self.max_wait = max_wait_ms / 1000
+        self.queue_rows = max(1, queue_rows)
+        self.admit_seconds = admit_seconds
+        self.stats = {"labeled": 0, "batches": 0, "skipped": 0, "rejected": 0, "errors": 0}
+        self.last_error: Optional[str] = None
+        self._cond = threading.Condition()
+        self._pending: Deque[Tuple[List[int], float]] = deque()  # (ids, monotonic time they were committed)
+        self._admitted = 0  # rows queued, being labeled, or reserved by an ingest still inserting
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.model_name is not None
+
+    def select(self, model_name: Optional[str]) -> None:
+        """Labels with `model_name` from the next batch on; None switches the mode off and drops the queue."""
+        with self._cond:
+            self.model_name = model_name
+            if model_name is None:
+                dropped = sum(len(ids) for ids, _ in self._pending)
+                self._pending.clear()
+                self._admitted -= dropped
+                self.stats["skipped"] += dropped
+                self._cond.notify_all()
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            queued = sum(len(ids) for ids, _ in self._pending)
+        return {"enabled": self.enabled, "model_name": self.model_name, "queued": queued,
+                "queue_rows": self.queue_rows, **self.stats, "last_error": self.last_error}
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until every admitted row has been labeled or skipped (benchmarks and scripts)."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._admitted == 0, timeout)
+
+    # --- Lifecycle ---
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="auto-detection", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # --- Ingest side ---
+    @contextmanager
+    def admit(self, rows: int) -> Iterator[Enqueue]:
+        """Reserves queue room for an ingest of `rows` rows, waiting while the queue is full.
+
+        Yields enqueue(ids), to be called with ids once they are committed. Room
+        left unused when the block exits is given back. Raises Backpressure if
+        no room frees up within admit_seconds. While the mode is off, admits
+        everything and enqueue does nothing.
+        """
+        if not self.enabled or rows <= 0:
+            yield lambda ids: None
+            return
+        started = time.perf_counter()
+        with self._cond:
+            # An ingest larger than the whole queue gets in once the queue has drained.
+            room = self._cond.wait_for(
+                lambda: self._admitted == 0 or self._admitted + rows <= self.queue_rows, self.admit_seconds
+            )
+            metrics.auto_detect_wait_seconds.observe(time.perf_counter() - started)
+            if not room:
+                self.stats["rejected"] += 1
+                raise Backpressure(f"Auto-detection is {self._admitted} rows behind.")
+            self._admitted += rows
+        unused = rows
+
+        def enqueue(ids: List[int]) -> None:
+            nonlocal unused
+            with self._cond:
+                unused -= len(ids)
+                if self.model_name is None:
+                    self._admitted -= len(ids)
+                else:
+                    self._pending.append((list(ids), time.monotonic()))
+                self._cond.notify_all()
+
+        try:
+            yield enqueue
+        finally:
+            with self._cond:
+                self._admitted -= max(unused, 0)
+                self._cond.notify_all()
+
+    # --- Worker ---
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            batch = self._take()
+            if not batch:
+                continue
+            try:
+                self._label(batch)
+            except Exception as e:
+                # Those rows stay unprocessed; a detection run picks them up.
+                self.stats["errors"] += 1
+                self.last_error = str(e)
+                logging.error(f"❌ Auto-detection of {sum(len(ids) for ids, _ in batch)} rows failed: {e}")
+            finally:
+                with self._cond:
+                    self._admitted -= sum(len(ids) for ids, _ in batch)
+                    self._cond.notify_all()
+
+    def _take(self) -> List[Tuple[List[int], float]]:
+        """Waits for queued ids, then collects up to batch_rows of them for at most max_wait."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._pending or self._stopping.is_set(), 1.0) or self._stopping.is_set():
+                return []
+            deadline = time.monotonic() + self.max_wait
+            while sum(len(ids) for ids, _ in self._pending) < self.batch_rows and not self._stopping.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, rows = [], 0
+            while self._pending and rows < self.batch_rows:
+                ids, enqueued_at = self._pending.popleft()
+                room = self.batch_rows - rows
+                if len(ids) > room:
+                    self._pending.appendleft((ids[room:], enqueued_at))
+                    ids = ids[:room]
+                batch.append((ids, enqueued_at))
+                rows += len(ids)
+            return batch
+
+    def _label(self, batch: List[Tuple[List[int], float]]) -> None:
+        model_name = self.model_name
+        if model_name is None:
+            return
+        # The promoted version; a promotion takes effect from the next batch.
+        handle = model.get_handle(model_name)
+        ids = [i for group, _ in batch for i in group]
+        t = database.Transaction.__table__
+        with database.engine.connect() as conn:
+            covered = detection_runs.covered_to(conn)
+        df = pd.read_sql(
+            sqlalchemy.select(t.c.id, t.c.card_token, t.c.timestamp, t.c.amount)
+            .where(t.c.id.in_(ids), t.c.id > covered, t.c.is_fraud == -1)
+            .order_by(t.c.id),
+            database.engine,
+        )
+        if df.empty:
+            self.stats["skipped"] += len(ids)
+            return
+
+        db = database.SessionLocal()
+        try:
+            # Like a detection shard, each batch seeds its cards' history from every earlier row.
+            df = model.add_features(df, db=db, store=features.CardStateStore(), before_id=int(df["id"].iloc[0]))
+            scored = scoring.decide(df, model_name, handle, path="auto")
+            explanation = scored["explanation"].to_numpy(dtype=object, copy=True)
+            ml_fraud = scored["rule"].isna().to_numpy() & (scored["is_fraud"].to_numpy() == 1)
+            if ml_fraud.any():
+                if explanations.worker.enabled:
+                    explanation[ml_fraud] = database.EXPLANATION_PENDING
+                else:
+                    explanation[ml_fraud] = [explanations.fallback_explanation(a) for a in scored["amount"].to_numpy()[ml_fraud]]
+            # A detection run may have labeled some of these rows since they were read. Claiming the rest first
+            # (the no-op UPDATE takes their write locks) tells exactly which rows this batch labels and counts.
+            claimed = db.execute(
+                t.update().where(t.c.id.in_(scored["id"].tolist()), t.c.is_fraud == -1)
+                .values(is_fraud=t.c.is_fraud).returning(t.c.id)
+            ).scalars().all()
+            if len(claimed) < len(scored):
+                keep = scored["id"].isin(claimed).to_numpy()
+                scored, explanation, ml_fraud = scored[keep], explanation[keep], ml_fraud[keep]
+                if scored.empty:
+                    db.rollback()
+                    self.stats["skipped"] += len(ids)
+                    return
+            db.execute(
+                t.update()
+                .where(t.c.id == sqlalchemy.bindparam("_id"), t.c.is_fraud == -1)
+                .values(is_fraud=sqlalchemy.bindparam("is_fraud"), explanation=sqlalchemy.bindparam("explanation")),
+                [{"_id": i, "is_fraud": f, "explanation": e}
+                 for i, f, e in zip(scored["id"].tolist(), scored["is_fraud"].tolist(), explanation.tolist())],
+            )
+            fraudulent = int(scored["is_fraud"].sum())
+            counters.record(db, unprocessed=-len(scored), legit=len(scored) - fraudulent, fraudulent=fraudulent)
+            # Checked after the UPDATE, in its transaction: a run started since either shows up here or sees these labels.
+            if detection_runs.covered_to(db) >= int(scored["id"].iloc[0]):
+                db.rollback()
+                self.stats["skipped"] += len(ids)
+                return
+            db.commit()
+        finally:
+            db.close()
+
+        labeled_at = time.monotonic()
+        labeled = set(scored["id"].tolist())
+        for group, enqueued_at in batch:
+            n = sum(1 for i in group if i in labeled)
+            if n:
+                metrics.ingest_to_label_seconds.observe(labeled_at - enqueued_at, n=n, model=model_name)
+        self.stats["labeled"] += len(scored)
+        self.stats["skipped"] += len(ids) - len(scored)
+        self.stats["batches"] += 1
+        if explanations.worker.enabled and ml_fraud.any():
+            explanations.worker.notify()
+
+
+detector = AutoDetector()
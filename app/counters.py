@@ -0,0 +1,79 @@
+# counters.py
+# Running totals behind the fraud report summary, so a page request reads one
+# row instead of counting the transactions table.
+#
+# Every writer that inserts, labels or deletes transactions applies its delta
+# here in the same database transaction as the change, so the counters commit
+# (or roll back) together with the rows they describe. recount() rebuilds them
+# from the table and is the repair path for databases written before they existed.
+
+from typing import Dict
+
+import sqlalchemy
+
+from app import database
+
+SUMMARY_ID = 1
+_table = database.TransactionCounters.__table__
+_LABELS = {-1: "unprocessed", 0: "legit", 1: "fraudulent"}
+
+
+def record(conn, unprocessed: int = 0, legit: int = 0, fraudulent: int = 0) -> None:
+    """Adds deltas to the counters. `conn` is the Session or Connection making the change."""
+    if not (unprocessed or legit or fraudulent):
+        return
+    conn.execute(
+        _table.update()
+        .where(_table.c.id == SUMMARY_ID)
+        .values(
+            unprocessed=_table.c.unprocessed + unprocessed,
+            legit=_table.c.legit + legit,
+            fraudulent=_table.c.fraudulent + fraudulent,
+        )
+    )
+
+
+def record_inserted(conn, labels) -> None:
+    """Counts newly inserted rows by their is_fraud value (-1, 0 or 1)."""
+    deltas = {name: 0 for name in _LABELS.values()}
+    for label in labels:
+        deltas[_LABELS[label]] += 1
+    record(conn, **deltas)
+
+
+def reset(conn) -> None:
+    conn.execute(_table.update().where(_table.c.id == SUMMARY_ID).values(unprocessed=0, legit=0, fraudulent=0))
+
+
+def recount(conn) -> Dict[str, int]:
+    """Rebuilds the counters from the transactions table. Caller commits."""
+    tx = database.Transaction.__table__
+    counts = {name: 0 for name in _LABELS.values()}
+    for label, n in conn.execute(sqlalchemy.select(tx.c.is_fraud, sqlalchemy.func.count()).group_by(tx.c.is_fraud)):
+        if label in _LABELS:
+            counts[_LABELS[label]] = n
+    conn.execute(_table.delete().where(_table.c.id == SUMMARY_ID))
+    conn.execute(_table.insert().values(id=SUMMARY_ID, **counts))
+    return counts
+
+
+def ensure(conn) -> None:
+    """Creates the counters row from a full count if it is missing."""
+    if conn.execute(sqlalchemy.select(_table.c.id).where(_table.c.id == SUMMARY_ID)).first() is None:
+        recount(conn)
+
+
+def summary(conn) -> Dict[str, float]:
+    """The report summary: total_transactions, fraudulent, legit (everything not fraudulent), fraud_percentage."""
+    row = conn.execute(sqlalchemy.select(_table).where(_table.c.id == SUMMARY_ID)).first()
+    if row is None:
+        ensure(conn)
+        row = conn.execute(sqlalchemy.select(_table).where(_table.c.id == SUMMARY_ID)).first()
+    total = row.unprocessed + row.legit + row.fraudulent
+    return {
+        "total_transactions": total,
+        "fraudulent": row.fraudulent,
+        "legit": total - row.fraudulent,
+        "fraud_percentage": round((row.fraudulent / total) * 100, 2) if total > 0 else 0,
+        "unprocessed": row.unprocessed,
+    }
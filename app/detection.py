@@ -0,0 +1,278 @@
+# detection.py
+# Batch fraud detection as a pipeline of overlapping stages:
+#
+#   read    keyset-paginated read of unprocessed rows (id order), features
+#   rules   the app/rules.py rule set; rows a rule decides skip the model
+#   predict the model's predictor (sklearn or compiled), fanned out to a process pool
+#   explain marks ML-flagged rows for app/explanations.py (or writes the fallback text)
+#   write   bulk_update_mappings + commit, progress (one push to subscribers per chunk)
+#
+# Stages run in their own threads and hand chunks over through bounded queues,
+# so at most a few chunks are in memory and the slowest stage sets the pace.
+# Per-stage busy time is reported through the ProgressTracker to make that stage visible.
+#
+# A pipeline scores one id range. app/detection_runs.py splits a run into such
+# shards and leases them to workers; its `before_commit` hook renews the lease
+# in the same transaction as each chunk's labels.
+
+import os
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from app import counters, database, explanations, metrics, rules, scoring
+from app.progress import ProgressTracker
+from ml import features, model
+from ml.registry import ModelHandle, ModelRegistry
+
+DETECTION_CHUNK_SIZE = int(os.getenv("DETECTION_CHUNK_SIZE", "50000"))
+DETECTION_WORKERS = int(os.getenv("DETECTION_WORKERS", os.cpu_count() or 1))
+STAGES = ("read", "rules", "predict", "explain", "write")
+
+_DONE = object()
+
+# --- Process pool scoring ---
+_worker_estimator = None
+
+def _init_worker(models_dir: str, model_name: str, version: int, backend: Optional[str]) -> None:
+    # Each worker opens the same version from disk; the memory-mapped arrays share page cache.
+    global _worker_estimator
+    handle = ModelRegistry(models_dir).get(model_name, version)
+    _worker_estimator = model.get_predictor(model_name, backend, handle)
+
+def _worker_predict(X: pd.DataFrame) -> Tuple[np.ndarray, float]:
+    started = time.perf_counter()
+    return _worker_estimator.predict(X), time.perf_counter() - started
+
+def make_pool(handle: ModelHandle, workers: int) -> ProcessPoolExecutor:
+    """A scoring pool for one model version; reusable across pipelines on that version."""
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(model.registry.models_dir, handle.name, handle.version, None),
+    )
+
+# Called as before_commit(db, rows, fraudulent) inside each chunk's transaction; raising rolls the chunk back.
+CommitHook = Callable[[Session, int, int], None]
+
+
+class DetectionPipeline:
+    def __init__(self, db: Session, model_name: str, progress: ProgressTracker,
+                 chunk_size: int = DETECTION_CHUNK_SIZE, workers: int = DETECTION_WORKERS,
+                 handle: Optional[ModelHandle] = None, pool: Optional[ProcessPoolExecutor] = None,
+                 store: Optional[features.CardStateStore] = None, before_commit: Optional[CommitHook] = None):
+        self.db = db
+        self.model_name = model_name
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.workers = max(1, workers)
+        self._stop = threading.Event()
+        self._errors = []
+        self._pool = pool
+        self._owns_pool = False
+        self.store = store if store is not None else model.feature_store
+        self.before_commit = before_commit
+        self._before_id: Optional[int] = None
+        # Pinned for the whole run, so a promotion mid-run does not mix model versions.
+        self.handle = handle or model.get_handle(model_name)
+
+    def run(self, lo: Optional[int] = None, hi: Optional[int] = None) -> None:
+        """Scores the unprocessed rows with lo <= id <= hi (by default, every row that exists now)."""
+        table = database.Transaction.__table__
+        if hi is None:
+            # Rows ingested after the run starts are left for the next run.
+            hi = self.db.execute(sqlalchemy.select(sqlalchemy.func.max(table.c.id))).scalar() or 0
+        # A shard seeds card history from every row before it, labeled yet or not.
+        self._before_id = lo
+        total = self.db.query(database.Transaction).filter(
+            database.Transaction.is_fraud == -1, database.Transaction.id >= (lo or 0), database.Transaction.id <= hi
+        ).count()
+        self.progress.reset("running", total, model_name=self.model_name, model_version=self.handle.version)
+
+        # Spawning workers costs seconds; only worth it when there is more than one chunk to score.
+        if self._pool is None and self.workers > 1 and total > self.chunk_size:
+            self._pool = make_pool(self.handle, self.workers)
+            self._owns_pool = True
+        depth = self.workers + 1
+        to_score: queue.Queue = queue.Queue(maxsize=depth)
+        to_explain: queue.Queue = queue.Queue(maxsize=depth)
+        to_write: queue.Queue = queue.Queue(maxsize=depth)
+        threads = [
+            threading.Thread(target=self._guard, args=(self._read, lo or 0, hi, to_score), name="detect-read"),
+            threading.Thread(target=self._guard, args=(self._score, to_score, to_explain), name="detect-score"),
+            threading.Thread(target=self._guard, args=(self._explain, to_explain, to_write), name="detect-explain"),
+        ]
+        try:
+            for t in threads:
+                t.start()
+            self._guard(self._write, to_write)
+        finally:
+            self._stop.set()
+            for q in (to_score, to_explain, to_write):
+                self._drain(q)
+            for t in threads:
+                t.join()
+            if self._owns_pool:
+                self._pool.shutdown(cancel_futures=True)
+        if self._errors:
+            raise self._errors[0]
+
+    # --- Stage plumbing ---
+    def _guard(self, stage: Callable, *args) -> None:
+        try:
+            stage(*args)
+        except Exception as e:
+            self._errors.append(e)
+            self._stop.set()
+
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    @staticmethod
+    def _drain(q: queue.Queue) -> None:
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                return
+
+    # --- Stages ---
+    def _read(self, lo: int, hi: int, out: queue.Queue) -> None:
+        db = database.SessionLocal()
+        try:
+            last_id = lo - 1
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                query = (
+                    db.query(database.Transaction)
+                    .filter(database.Transaction.is_fraud == -1,
+                            database.Transaction.id > last_id,
+                            database.Transaction.id <= hi)
+                    .order_by(database.Transaction.id)
+                    .limit(self.chunk_size)
+                    .statement
+                )
+                with metrics.read_sql_seconds.time():
+                    df_batch = pd.read_sql(query, db.bind)
+                if df_batch.empty:
+                    break
+                last_id = int(df_batch['id'].iloc[-1])
+
+                # Features are computed here, in id order, because the per-card state is sequential.
+                df_batch = model.add_features(df_batch, db=db, store=self.store, before_id=self._before_id)
+                self.progress.add_stage("read", len(df_batch), time.perf_counter() - started)
+
+                started = time.perf_counter()
+                decisions = rules.engine.current().apply(df_batch)
+                df_batch['rule'] = decisions.rule
+                df_batch['is_fraud'] = decisions.is_fraud.astype(int)
+                df_batch['explanation'] = np.where(decisions.decided, decisions.explanation, scoring.LEGIT_EXPLANATION)
+                self.progress.add_stage("rules", len(df_batch), time.perf_counter() - started)
+                if not self._put(out, df_batch):
+                    return
+        finally:
+            db.close()
+            self._put(out, _DONE)
+
+    def _score(self, inp: queue.Queue, out: queue.Queue) -> None:
+        while True:
+            df_batch = self._get(inp)
+            if df_batch is _DONE:
+                break
+            started = time.perf_counter()
+            undecided = df_batch.index[df_batch['rule'].isna()]
+            X = model.model_inputs(df_batch.loc[undecided], self.model_name, self.handle) if len(undecided) else None
+            if X is None:
+                future: Future = Future()
+                future.set_result((np.array([]), 0.0))
+            elif self._pool is not None:
+                future = self._pool.submit(_worker_predict, X)
+            else:
+                future = Future()
+                predict_started = time.perf_counter()
+                future.set_result((model.get_predictor(self.model_name, handle=self.handle).predict(X), time.perf_counter() - predict_started))
+            self.progress.add_stage("predict", 0, time.perf_counter() - started)
+            # The bounded queue caps how many chunks are in flight in the pool.
+            if not self._put(out, (df_batch, undecided, future)):
+                return
+        self._put(out, _DONE)
+
+    def _explain(self, inp: queue.Queue, out: queue.Queue) -> None:
+        while True:
+            item = self._get(inp)
+            if item is _DONE:
+                break
+            df_batch, undecided, future = item
+            predictions, predict_seconds = future.result()
+            self.progress.add_stage("predict", len(df_batch), predict_seconds)
+            metrics.predict_seconds.observe(predict_seconds, path="detection", model=self.model_name)
+
+            started = time.perf_counter()
+            ml_fraud_indices = undecided[predictions == 1] if len(undecided) else undecided
+            df_batch.loc[ml_fraud_indices, 'is_fraud'] = 1
+            if not ml_fraud_indices.empty:
+                # Labels are committed now; the explanation worker fills these in afterwards.
+                if explanations.worker.enabled:
+                    df_batch.loc[ml_fraud_indices, 'explanation'] = database.EXPLANATION_PENDING
+                else:
+                    df_batch.loc[ml_fraud_indices, 'explanation'] = [
+                        explanations.fallback_explanation(amount) for amount in df_batch.loc[ml_fraud_indices, 'amount']
+                    ]
+            self.progress.add_stage("explain", len(df_batch), time.perf_counter() - started)
+            if not self._put(out, df_batch):
+                return
+        self._put(out, _DONE)
+
+    def _write(self, inp: queue.Queue) -> None:
+        while True:
+            df_batch = self._get(inp)
+            if df_batch is _DONE:
+                break
+            started = time.perf_counter()
+            update_mappings = df_batch[['id', 'is_fraud', 'explanation']].to_dict(orient='records')
+            with metrics.bulk_update_seconds.time():
+                self.db.bulk_update_mappings(database.Transaction, update_mappings)
+            fraudulent = int(df_batch['is_fraud'].sum())
+            counters.record(self.db, unprocessed=-len(df_batch), legit=len(df_batch) - fraudulent, fraudulent=fraudulent)
+            if self.before_commit is not None:
+                self.before_commit(self.db, len(df_batch), fraudulent)
+            self.db.commit()
+            by_rule = int(df_batch.loc[df_batch['rule'].notna(), 'is_fraud'].sum())
+            metrics.rows_scored.inc(len(df_batch), path="detection", model=self.model_name)
+            metrics.rows_flagged.inc(by_rule, path="detection", model=self.model_name, source="rule")
+            metrics.rows_flagged.inc(fraudulent - by_rule, path="detection", model=self.model_name, source="model")
+            if explanations.worker.enabled and (df_batch['explanation'] == database.EXPLANATION_PENDING).any():
+                explanations.worker.notify()
+            self.progress.add_stage("write", len(df_batch), time.perf_counter() - started)
+
+            self.progress.add_chunk(len(df_batch), fraudulent)
+            state = self.progress.snapshot()
+            logging.info(
+                f"Processed chunk of {len(df_batch)}. Total processed: {state['processed']}/{state['total']} "
+                f"| {state['rows_per_sec']} rows/sec, ETA {state['eta_seconds']}s "
+                f"| stage rows/sec: " + ", ".join(f"{k}={v['rows_per_sec']}" for k, v in state['stages'].items())
+            )
@@ -0,0 +1,453 @@
+# detection_runs.py
+# Detection runs coordinated through the database, so several API processes
+# (uvicorn --workers N) and any number of workers, on any machine that shares
+# the database and model directory, see one run and can all work on it.
+#
+# start() records the run and splits its unprocessed rows into id-range shards
+# of about DETECTION_SHARD_ROWS rows. A Worker claims a shard with a
+# compare-and-set UPDATE and holds it under a lease. A heartbeat thread renews
+# the lease, and so does every chunk commit, in the same transaction as the
+# chunk's labels. If the lease has been lost, that chunk rolls back. A shard
+# whose worker died is claimed again once its lease expires. The rows that
+# worker already committed are skipped, because detection only reads
+# unprocessed rows. progress() adds up the shard rows, so every process
+# reports the same progress.
+#
+# Only one run is active at a time: a partial unique index allows a single
+# 'running' row.
+#
+#   python -m app.detection_runs            # help with the running run, then exit
+#   python -m app.detection_runs --watch    # keep joining runs as they start
+
+import os
+import uuid
+import socket
+import logging
+import argparse
+import datetime
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from app import database, detection
+from app.progress import ProgressTracker
+from ml import features, model
+from ml.registry import ModelHandle
+
+DETECTION_SHARD_ROWS = int(os.getenv("DETECTION_SHARD_ROWS", "200000"))
+DETECTION_LEASE_SECONDS = float(os.getenv("DETECTION_LEASE_SECONDS", "60"))
+DETECTION_POLL_SECONDS = float(os.getenv("DETECTION_POLL_SECONDS", "2"))  # how often an idle worker looks for shards
+DETECTION_MAX_ATTEMPTS = int(os.getenv("DETECTION_MAX_ATTEMPTS", "3"))  # claims of one shard before the run fails
+
+_runs = database.DetectionRun.__table__
+_shards = database.DetectionShard.__table__
+
+
+class LeaseLost(Exception):
+    """The shard was claimed by another worker after its lease expired, or its run has ended."""
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+# --- Runs ---
+def _shard_bounds(conn, max_id: int, shard_rows: int) -> List[Tuple[int, int, int]]:
+    """(lo, hi, rows) ranges that each hold `shard_rows` unprocessed rows (the last one fewer)."""
+    t = database.Transaction.__table__
+    unprocessed = sqlalchemy.and_(t.c.is_fraud == -1, t.c.id <= max_id)
+    bounds = []
+    lo = conn.execute(sqlalchemy.select(sqlalchemy.func.min(t.c.id)).where(unprocessed)).scalar()
+    while lo is not None:
+        hi = conn.execute(
+            sqlalchemy.select(t.c.id).where(unprocessed, t.c.id >= lo).order_by(t.c.id).offset(shard_rows - 1).limit(1)
+        ).scalar()
+        if hi is None:
+            hi = max_id
+            rows = conn.execute(sqlalchemy.select(sqlalchemy.func.count()).where(unprocessed, t.c.id >= lo)).scalar()
+        else:
+            rows = shard_rows
+        bounds.append((lo, hi, rows))
+        lo = conn.execute(sqlalchemy.select(sqlalchemy.func.min(t.c.id)).where(unprocessed, t.c.id > hi)).scalar()
+    return bounds
+
+
+def active_run(db: Session) -> Optional[database.DetectionRun]:
+    return db.query(database.DetectionRun).filter(database.DetectionRun.status == "running").first()
+
+
+def covered_to(conn) -> int:
+    """The highest id the running run will label (0 if none is running). Newer rows are never touched by it."""
+    return conn.execute(
+        sqlalchemy.select(sqlalchemy.func.max(_shards.c.hi))
+        .select_from(_shards.join(_runs, _runs.c.id == _shards.c.run_id))
+        .where(_runs.c.status == "running")
+    ).scalar() or 0
+
+
+def abandon_stale(db: Session) -> None:
+    """Fails the running run if no worker has held a lease on it for a whole lease period."""
+    run = active_run(db)
+    if run is None or run.created_at > _now() - datetime.timedelta(seconds=DETECTION_LEASE_SECONDS):
+        return
+    last_lease = db.execute(
+        sqlalchemy.select(sqlalchemy.func.max(_shards.c.lease_expires_at)).where(_shards.c.run_id == run.id)
+    ).scalar()
+    if last_lease is not None and last_lease > _now():
+        return
+    logging.warning(f"⚠️ Detection run {run.id} has no live workers; marking it abandoned.")
+    fail_run(run.id, "Abandoned: no worker held a lease on it.")
+    db.expire_all()
+
+
+def start(db: Session, model_name: str, username: str, chunk_size: int = detection.DETECTION_CHUNK_SIZE,
+          workers: int = detection.DETECTION_WORKERS, shard_rows: int = DETECTION_SHARD_ROWS) -> Optional[Dict[str, Any]]:
+    """Records a run over every unprocessed row, with its shards. Returns None if another run is active."""
+    abandon_stale(db)
+    handle = model.get_handle(model_name)
+    t = database.Transaction.__table__
+    # Rows ingested after the run starts are left for the next run.
+    max_id = db.execute(sqlalchemy.select(sqlalchemy.func.max(t.c.id))).scalar() or 0
+    bounds = _shard_bounds(db.connection(), max_id, shard_rows)
+    run = database.DetectionRun(
+        id=uuid.uuid4().hex, model_name=model_name, model_version=handle.version, username=username,
+        status="running", total=sum(rows for _, _, rows in bounds), chunk_size=chunk_size, workers=workers,
+    )
+    db.add(run)
+    try:
+        db.flush()
+    except sqlalchemy.exc.IntegrityError:
+        db.rollback()
+        return None
+    if bounds:
+        db.execute(_shards.insert(), [{"run_id": run.id, "lo": lo, "hi": hi, "total": rows} for lo, hi, rows in bounds])
+    db.commit()
+    logging.info(f"🗂️ Detection run {run.id}: {run.total} rows in {len(bounds)} shards")
+    return {"run_id": run.id, "total": run.total, "shards": len(bounds)}
+
+
+def update_run(run_id: str, **fields) -> None:
+    with database.engine.begin() as conn:
+        conn.execute(_runs.update().where(_runs.c.id == run_id).values(**fields))
+
+
+def fail_run(run_id: str, error: str) -> None:
+    with database.engine.begin() as conn:
+        conn.execute(
+            _runs.update().where(_runs.c.id == run_id, _runs.c.status == "running")
+            .values(status="error", error=error, finished_at=_now())
+        )
+
+
+def finish_if_done(run_id: str) -> bool:
+    """Completes the run once every shard is done. True if the run is no longer running."""
+    with database.engine.begin() as conn:
+        remaining = conn.execute(
+            sqlalchemy.select(sqlalchemy.func.count()).where(_shards.c.run_id == run_id, _shards.c.status != "done")
+        ).scalar()
+        if remaining:
+            return conn.execute(sqlalchemy.select(_runs.c.status).where(_runs.c.id == run_id)).scalar() != "running"
+        completed = conn.execute(
+            _runs.update().where(_runs.c.id == run_id, _runs.c.status == "running")
+            .values(status="completed", finished_at=_now())
+        ).rowcount
+    if completed:
+        logging.info(f"✅ Detection run {run_id} completed.")
+    return True
+
+
+# --- Leases ---
+def _claimable(now: datetime.datetime):
+    return sqlalchemy.or_(
+        _shards.c.status == "pending",
+        sqlalchemy.and_(_shards.c.status == "leased", _shards.c.lease_expires_at < now),
+    )
+
+
+def claim(run_id: str, owner: str, lease_seconds: float = DETECTION_LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+    """Leases the lowest pending (or expired) shard of the run to `owner`; None if there is none."""
+    while True:
+        now = _now()
+        with database.engine.begin() as conn:
+            candidate = conn.execute(
+                sqlalchemy.select(_shards.c.id).where(_shards.c.run_id == run_id, _claimable(now))
+                .order_by(_shards.c.lo).limit(1)
+            ).scalar()
+            if candidate is None:
+                return None
+            # Compare-and-set: only one of several workers racing for the candidate updates it.
+            claimed = conn.execute(
+                _shards.update().where(_shards.c.id == candidate, _claimable(now)).values(
+                    status="leased", owner=owner, lease_expires_at=now + datetime.timedelta(seconds=lease_seconds),
+                    attempts=_shards.c.attempts + 1,
+                )
+            ).rowcount
+            if not claimed:
+                continue
+            shard = dict(conn.execute(sqlalchemy.select(_shards).where(_shards.c.id == candidate)).mappings().one())
+        if shard["attempts"] > DETECTION_MAX_ATTEMPTS:
+            fail_run(run_id, f"Shard {shard['lo']}-{shard['hi']} failed {shard['attempts'] - 1} times.")
+            return None
+        return shard
+
+
+def _held(shard_id: int, owner: str):
+    """The shard is still leased by `owner` and its run is still running."""
+    return sqlalchemy.and_(
+        _shards.c.id == shard_id, _shards.c.owner == owner, _shards.c.status == "leased",
+        _shards.c.run_id.in_(sqlalchemy.select(_runs.c.id).where(_runs.c.status == "running")),
+    )
+
+
+def heartbeat(shard_id: int, owner: str, lease_seconds: float = DETECTION_LEASE_SECONDS) -> bool:
+    """Extends the lease. False once it has been lost."""
+    with database.engine.begin() as conn:
+        return bool(conn.execute(
+            _shards.update().where(_held(shard_id, owner))
+            .values(lease_expires_at=_now() + datetime.timedelta(seconds=lease_seconds))
+        ).rowcount)
+
+
+def record_chunk(db: Session, shard_id: int, owner: str, rows: int, fraudulent: int, stages: Dict[str, Any],
+                 lease_seconds: float = DETECTION_LEASE_SECONDS) -> None:
+    """Adds a chunk to the shard's progress and renews the lease, in the caller's transaction."""
+    renewed = db.execute(
+        _shards.update().where(_held(shard_id, owner)).values(
+            processed=_shards.c.processed + rows, fraudulent=_shards.c.fraudulent + fraudulent, stages=stages,
+            lease_expires_at=_now() + datetime.timedelta(seconds=lease_seconds),
+        )
+    ).rowcount
+    if not renewed:
+        raise LeaseLost(f"Lost the lease on shard {shard_id}.")
+
+
+def complete(shard_id: int, owner: str, stages: Dict[str, Any]) -> None:
+    with database.engine.begin() as conn:
+        conn.execute(
+            _shards.update().where(_shards.c.id == shard_id, _shards.c.owner == owner, _shards.c.status == "leased")
+            .values(status="done", stages=stages, finished_at=_now())
+        )
+
+
+def release(shard: Dict[str, Any], owner: str, error: Optional[str] = None) -> None:
+    """Returns the shard to the pending pool; with an `error`, fails the run after DETECTION_MAX_ATTEMPTS."""
+    with database.engine.begin() as conn:
+        conn.execute(
+            _shards.update().where(_shards.c.id == shard["id"], _shards.c.owner == owner, _shards.c.status == "leased")
+            .values(status="pending", owner=None, lease_expires_at=None)
+        )
+    if error is not None and shard["attempts"] >= DETECTION_MAX_ATTEMPTS:
+        fail_run(shard["run_id"], error)
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, shard_id: int, owner: str, lease_seconds: float):
+        super().__init__(name=f"detect-lease-{shard_id}", daemon=True)
+        self.shard_id = shard_id
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self._done = threading.Event()
+
+    def run(self) -> None:
+        while not self._done.wait(self.lease_seconds / 3):
+            try:
+                if not heartbeat(self.shard_id, self.owner, self.lease_seconds):
+                    logging.warning(f"⚠️ Lease on shard {self.shard_id} lost.")
+                    return
+            except sqlalchemy.exc.OperationalError as e:
+                logging.warning(f"⚠️ Lease heartbeat for shard {self.shard_id} failed, retrying: {e}")
+
+    def stop(self) -> None:
+        self._done.set()
+        self.join()
+
+
+# --- Progress ---
+def progress(db: Session, run_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Progress of `run_id` (default: the latest run) from its shard rows; None if there is no such run."""
+    if run_id:
+        run = db.get(database.DetectionRun, run_id)
+    else:
+        run = db.query(database.DetectionRun).order_by(database.DetectionRun.created_at.desc()).first()
+    if run is None:
+        return None if run_id else ProgressTracker(detection.STAGES).snapshot()
+    shards = db.query(database.DetectionShard).filter(database.DetectionShard.run_id == run.id).all()
+    now = _now()
+    processed = sum(s.processed or 0 for s in shards)
+    fraudulent = sum(s.fraudulent or 0 for s in shards)
+    stages = {name: {"rows": 0, "busy_seconds": 0.0, "rows_per_sec": None} for name in detection.STAGES}
+    for shard in shards:
+        for name, entry in (shard.stages or {}).items():
+            if name in stages:
+                stages[name]["rows"] += entry["rows"]
+                stages[name]["busy_seconds"] = round(stages[name]["busy_seconds"] + entry["busy_seconds"], 4)
+    for entry in stages.values():
+        entry["rows_per_sec"] = round(entry["rows"] / entry["busy_seconds"], 1) if entry["busy_seconds"] else None
+
+    elapsed = ((run.finished_at or now) - run.created_at).total_seconds()
+    rate = processed / elapsed if elapsed > 0 and processed else None
+    eta = round(max(run.total - processed, 0) / rate, 1) if rate else None
+    return {
+        "run_id": run.id,
+        "status": run.status,
+        "processed": processed,
+        "total": run.total,
+        "fraudulent": fraudulent,
+        "fraud_rate": round(fraudulent / processed, 4) if processed else None,
+        "rows_per_sec": round(rate, 1) if rate else None,
+        "eta_seconds": 0.0 if run.status == "completed" else eta,
+        "elapsed_seconds": round(elapsed, 3),
+        "stages": stages,
+        "model_name": run.model_name,
+        "model_version": run.model_version,
+        "shards": {status: sum(1 for s in shards if s.status == status) for status in ("pending", "leased", "done")},
+        "workers": len({s.owner for s in shards if s.status == "leased" and s.lease_expires_at > now}),
+        "error": run.error,
+        "profile": run.profile,
+    }
+
+
+# --- Workers ---
+# model.feature_store (which /score also reads) carries card history from one shard to the next. It is only
+# valid for a shard if the same store featurized the shard just before it, so workers record which one that was.
+_store_lock = threading.Lock()
+_store_after: Optional[Tuple[str, int]] = None  # (run_id, shard id) the shared store has seen up to
+
+
+class Worker:
+    """Claims and scores shards until its run is over (or, watching, indefinitely)."""
+
+    def __init__(self, progress: Optional[ProgressTracker] = None, workers: Optional[int] = None,
+                 lease_seconds: float = DETECTION_LEASE_SECONDS, poll_seconds: float = DETECTION_POLL_SECONDS):
+        self.id = worker_id()
+        self.progress = progress or ProgressTracker(detection.STAGES)
+        self.workers = workers  # scoring processes; the run's setting by default
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.shards_done = 0
+        self._stopping = threading.Event()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_key: Optional[Tuple[str, int, int]] = None
+
+    def work(self, run_id: Optional[str] = None, watch: bool = False) -> Optional[str]:
+        """Works on `run_id` (default: the running run) and returns its final status; with `watch`, never returns."""
+        try:
+            while not self._stopping.is_set():
+                db = database.SessionLocal()
+                try:
+                    run = db.get(database.DetectionRun, run_id) if run_id and not watch else active_run(db)
+                    if run is not None:
+                        db.expunge(run)
+                finally:
+                    db.close()
+                if run is None or run.status != "running":
+                    if not watch:
+                        return run.status if run is not None else None
+                    self._stopping.wait(self.poll_seconds)
+                    continue
+                run_id = run_id or run.id
+                shard = claim(run.id, self.id, self.lease_seconds)
+                if shard is not None:
+                    self._process(run, shard)
+                elif not finish_if_done(run.id):
+                    # Other workers hold the remaining shards; wait, in case one of them dies.
+                    self._stopping.wait(self.poll_seconds)
+            return None
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _pool_for(self, handle: ModelHandle, workers: int) -> ProcessPoolExecutor:
+        key = (handle.name, handle.version, workers)
+        if self._pool_key != key:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+            self._pool, self._pool_key = detection.make_pool(handle, workers), key
+        return self._pool
+
+    def _predecessor(self, shard: Dict[str, Any]) -> Optional[int]:
+        with database.engine.connect() as conn:
+            return conn.execute(
+                sqlalchemy.select(_shards.c.id).where(_shards.c.run_id == shard["run_id"], _shards.c.lo < shard["lo"])
+                .order_by(_shards.c.lo.desc()).limit(1)
+            ).scalar()
+
+    def _process(self, run: database.DetectionRun, shard: Dict[str, Any]) -> None:
+        global _store_after
+        workers = max(1, self.workers or run.workers or 1)
+        shared = _store_lock.acquire(blocking=False)
+        if shared:
+            if _store_after != (run.id, self._predecessor(shard)):
+                model.feature_store.clear()
+            _store_after = None
+            store = model.feature_store
+        else:
+            store = features.CardStateStore()
+
+        def before_commit(db: Session, rows: int, fraudulent: int) -> None:
+            record_chunk(db, shard["id"], self.id, rows, fraudulent, self.progress.snapshot()["stages"],
+                         self.lease_seconds)
+
+        logging.info(f"🔒 {self.id} leased shard {shard['lo']}-{shard['hi']} of run {run.id}")
+        beat = _Heartbeat(shard["id"], self.id, self.lease_seconds)
+        beat.start()
+        db = database.SessionLocal()
+        try:
+            handle = model.registry.get(run.model_name, run.model_version)
+            # Spawning a pool costs seconds; it is kept for the following shards of the same version.
+            pool = self._pool_for(handle, workers) if workers > 1 and shard["total"] > run.chunk_size else None
+            detection.DetectionPipeline(
+                db, run.model_name, self.progress, chunk_size=run.chunk_size, workers=workers, handle=handle,
+                pool=pool, store=store, before_commit=before_commit,
+            ).run(shard["lo"], shard["hi"])
+        except LeaseLost as e:
+            db.rollback()
+            logging.warning(f"⚠️ {e} Another worker finishes it.")
+        except BaseException as e:
+            db.rollback()
+            interrupted = not isinstance(e, Exception)
+            release(shard, self.id, error=None if interrupted else f"Shard {shard['lo']}-{shard['hi']}: {e}")
+            if interrupted:
+                raise
+            logging.error(f"❌ Shard {shard['lo']}-{shard['hi']} of run {run.id} failed: {e}")
+        else:
+            complete(shard["id"], self.id, self.progress.snapshot()["stages"])
+            self.shards_done += 1
+            if shared:
+                _store_after = (run.id, shard["id"])
+        finally:
+            beat.stop()
+            db.close()
+            if shared:
+                _store_lock.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score shards of detection runs alongside the API.")
+    parser.add_argument("--watch", action="store_true", help="Keep joining new runs instead of exiting.")
+    parser.add_argument("--run", help="Work on this run id (default: the running run).")
+    parser.add_argument("--workers", type=int, help="Scoring processes (default: the run's setting).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    database.create_db()
+    worker = Worker(workers=args.workers)
+    try:
+        status = worker.work(args.run, watch=args.watch)
+    except KeyboardInterrupt:
+        return
+    logging.info(f"Worker {worker.id} done after {worker.shards_done} shards (run status: {status or 'none running'}).")
+
+
+if __name__ == "__main__":
+    main()
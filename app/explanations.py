@@ -0,0 +1,330 @@
+# explanations.py
+# LLM explanations for ML-flagged transactions, decoupled from detection.
+#
+# Detection commits its labels straight away with explanation = EXPLANATION_PENDING
+# and calls notify(). ExplanationWorker runs its own asyncio loop in a background
+# thread and drains pending rows from the database (so nothing is lost on restart):
+#
+#   1. read a batch of pending rows (keyset on id, served by a partial index)
+#   2. answer what it can from the explanation_cache table, keyed on the
+#      normalized prompt inputs
+#   3. send the rest EXPLAIN_BATCH_SIZE transactions per prompt, through one pooled
+#      httpx client, at most EXPLAIN_CONCURRENCY requests in flight, retrying
+#      429/5xx/transport errors with exponential backoff (honouring Retry-After)
+#   4. write explanations and new cache entries in one commit
+#
+# A prompt the API still fails after its retries leaves its rows pending. Its
+# key goes into explanation_failures with an attempt count, and its rows are
+# skipped until retry_at, which backs off from EXPLAIN_RETRY_SECONDS up to
+# EXPLAIN_MAX_RETRY_SECONDS. An outage therefore delays explanations but
+# does not lose them.
+#
+# GEMINI_API_URL can point at a local stub (see benchmarks/stub_gemini.py).
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import datetime
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import sqlalchemy
+
+from app import database, metrics
+
+# --- Gemini API Config ---
+GEMINI_API_URL = os.getenv(
+    "GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent"
+)
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "YOUR_GEMINI_API_KEY_HERE")
+USE_GEMINI = os.getenv("USE_GEMINI", "false").lower() in ("1", "true", "yes")  # set after adding your API key
+
+# --- Stage config ---
+EXPLAIN_BATCH_SIZE = int(os.getenv("EXPLAIN_BATCH_SIZE", "20"))  # transactions per prompt
+EXPLAIN_CONCURRENCY = int(os.getenv("EXPLAIN_CONCURRENCY", "4"))  # requests in flight
+EXPLAIN_MAX_RETRIES = int(os.getenv("EXPLAIN_MAX_RETRIES", "4"))
+EXPLAIN_BACKOFF_SECONDS = float(os.getenv("EXPLAIN_BACKOFF_SECONDS", "0.5"))
+EXPLAIN_MAX_BACKOFF_SECONDS = float(os.getenv("EXPLAIN_MAX_BACKOFF_SECONDS", "30"))
+EXPLAIN_TIMEOUT_SECONDS = float(os.getenv("EXPLAIN_TIMEOUT_SECONDS", "25"))
+EXPLAIN_POLL_SECONDS = float(os.getenv("EXPLAIN_POLL_SECONDS", "5"))
+EXPLAIN_RETRY_SECONDS = float(os.getenv("EXPLAIN_RETRY_SECONDS", "30"))  # first wait after a failed prompt
+EXPLAIN_MAX_RETRY_SECONDS = float(os.getenv("EXPLAIN_MAX_RETRY_SECONDS", "3600"))
+
+UNAVAILABLE_EXPLANATION = "Flagged by ML anomaly detection."
+
+
+def fallback_explanation(amount: float) -> str:
+    """Used when Gemini is disabled."""
+    return f"ML Anomaly Detection: Transaction of ${amount:.2f} flagged for review."
+
+
+def normalize(amount: float, timestamp: datetime.datetime) -> Dict[str, Any]:
+    """The inputs a prompt is built from; equal inputs share a cache entry."""
+    return {"amount": round(float(amount), 2), "hour": timestamp.hour if timestamp else None}
+
+
+def cache_key(inputs: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def _describe(inputs: Dict[str, Any]) -> str:
+    hour = f" at {inputs['hour']:02d}:00" if inputs["hour"] is not None else ""
+    return f"amount=${inputs['amount']:.2f}{hour}"
+
+
+def build_prompt(batch: Sequence[Dict[str, Any]]) -> str:
+    if len(batch) == 1:
+        return (
+            "Explain in simple terms why this credit card transaction might be fraudulent. Be concise. "
+            f"Transaction: {_describe(batch[0])}"
+        )
+    lines = "\n".join(f"{i + 1}. {_describe(inputs)}" for i, inputs in enumerate(batch))
+    return (
+        "For each credit card transaction below, explain in one or two simple sentences why it might be "
+        f"fraudulent. Reply with only a JSON array of {len(batch)} strings, in the same order.\n{lines}"
+    )
+
+
+def parse_batch_reply(text: str, expected: int) -> Optional[List[str]]:
+    """The list of explanations in a batched reply, or None if it is not a JSON array of `expected` strings."""
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    try:
+        items = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != expected or not all(isinstance(i, str) for i in items):
+        return None
+    return [i.strip() for i in items]
+
+
+class _Retryable(Exception):
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ExplanationWorker:
+    def __init__(self, api_url: Optional[str] = None, api_key: Optional[str] = None, enabled: Optional[bool] = None,
+                 batch_size: int = EXPLAIN_BATCH_SIZE, concurrency: int = EXPLAIN_CONCURRENCY,
+                 max_retries: int = EXPLAIN_MAX_RETRIES, backoff_seconds: float = EXPLAIN_BACKOFF_SECONDS):
+        self.api_url = api_url or GEMINI_API_URL
+        self.api_key = api_key or GEMINI_API_KEY
+        self.enabled = (USE_GEMINI and bool(GEMINI_API_KEY)) if enabled is None else enabled
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.stats = {"explained": 0, "cache_hits": 0, "requests": 0, "retries": 0, "failed": 0, "deferred": 0}
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Lifecycle ---
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=lambda: asyncio.run(self._main()), name="explanations", daemon=True)
+            self._thread.start()
+            self.notify()
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def notify(self) -> None:
+        """Tells the worker new pending rows were committed."""
+        self._wake.set()
+
+    def pending_count(self, db) -> int:
+        t = database.Transaction.__table__
+        return db.execute(
+            sqlalchemy.select(sqlalchemy.func.count()).where(t.c.explanation == database.EXPLANATION_PENDING)
+        ).scalar()
+
+    def drain(self) -> int:
+        """Explains every pending row on the calling thread; returns rows explained. For scripts and benchmarks."""
+        async def run() -> int:
+            async with self._client() as client:
+                return await self._drain_all(client, asyncio.Semaphore(self.concurrency))
+        return asyncio.run(run())
+
+    # --- Loop ---
+    def _client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        return httpx.AsyncClient(limits=limits, timeout=EXPLAIN_TIMEOUT_SECONDS)
+
+    async def _main(self) -> None:
+        # One client for the worker's lifetime, so connections are reused across rounds.
+        async with self._client() as client:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            while not self._stopping.is_set():
+                self._wake.clear()
+                try:
+                    await self._drain_all(client, semaphore)
+                except Exception as e:
+                    logging.error(f"❌ Explanation worker error: {e}")
+                await asyncio.get_running_loop().run_in_executor(None, self._wake.wait, EXPLAIN_POLL_SECONDS)
+
+    async def _drain_all(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore) -> int:
+        done, last_id = 0, 0
+        while not self._stopping.is_set():
+            explained, read, last_id = await self._round(client, semaphore, last_id)
+            if read == 0:
+                break
+            done += explained
+        return done
+
+    async def _round(self, client: httpx.AsyncClient, semaphore: asyncio.Semaphore, after_id: int):
+        """Explains one read of pending rows. Returns (rows explained, rows read, last id read)."""
+        t = database.Transaction.__table__
+        db = database.SessionLocal()
+        try:
+            rows = db.execute(
+                sqlalchemy.select(t.c.id, t.c.amount, t.c.timestamp)
+                .where(t.c.explanation == database.EXPLANATION_PENDING, t.c.id > after_id)
+                .order_by(t.c.id)
+                .limit(self.batch_size * self.concurrency * 4)
+            ).all()
+            if not rows:
+                return 0, 0, after_id
+
+            failed: Dict[str, Tuple[int, str]] = {}  # key -> (attempts so far, error)
+            if not self.enabled:
+                texts = {row.id: fallback_explanation(row.amount) for row in rows}
+                new_cache: Dict[str, str] = {}
+            else:
+                keys = {row.id: cache_key(normalize(row.amount, row.timestamp)) for row in rows}
+                inputs = {keys[row.id]: normalize(row.amount, row.timestamp) for row in rows}
+                cache = database.ExplanationCache.__table__
+                cached = dict(db.execute(
+                    sqlalchemy.select(cache.c.key, cache.c.explanation).where(cache.c.key.in_(list(inputs)))
+                ).all())
+                self.stats["cache_hits"] += sum(1 for row in rows if keys[row.id] in cached)
+                failures = database.ExplanationFailure.__table__
+                now = datetime.datetime.utcnow()
+                attempts, waiting = {}, set()
+                for key, n, retry_at in db.execute(
+                    sqlalchemy.select(failures.c.key, failures.c.attempts, failures.c.retry_at)
+                    .where(failures.c.key.in_([k for k in inputs if k not in cached]))
+                ).all():
+                    attempts[key] = n
+                    if retry_at > now:
+                        waiting.add(key)
+                self.stats["deferred"] += sum(1 for row in rows if keys[row.id] in waiting)
+
+                # Rows with equal inputs share one prompt slot.
+                missing = [k for k in inputs if k not in cached and k not in waiting]
+                batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+                results = await asyncio.gather(
+                    *(self._explain([inputs[k] for k in batch], client, semaphore) for batch in batches)
+                )
+                new_cache = {}
+                for batch, (texts_, error) in zip(batches, results):
+                    for k, text in zip(batch, texts_):
+                        if text is None:
+                            failed[k] = (attempts.get(k, 0), error or "No explanation returned.")
+                        else:
+                            new_cache[k] = text
+                answers = {**cached, **new_cache}
+                texts = {row.id: answers[keys[row.id]] for row in rows if keys[row.id] in answers}
+
+            # Only rows still pending are updated, so a relabel or clear in the meantime wins.
+            if texts:
+                db.execute(
+                    t.update()
+                    .where(t.c.id == sqlalchemy.bindparam("_id"), t.c.explanation == database.EXPLANATION_PENDING)
+                    .values(explanation=sqlalchemy.bindparam("explanation")),
+                    [{"_id": i, "explanation": text} for i, text in texts.items()],
+                )
+            if new_cache:
+                # Another API process's worker may have cached the same inputs since they were read.
+                db.execute(
+                    database.dialect_insert(database.ExplanationCache.__table__).on_conflict_do_nothing(),
+                    [{"key": k, "explanation": v, "created_at": datetime.datetime.utcnow()} for k, v in new_cache.items()],
+                )
+                failures = database.ExplanationFailure.__table__
+                db.execute(failures.delete().where(failures.c.key.in_(list(new_cache))))
+            if failed:
+                self._record_failures(db, failed)
+            db.commit()
+            self.stats["explained"] += len(texts)
+            return len(texts), len(rows), rows[-1].id
+        finally:
+            db.close()
+
+    def _record_failures(self, db, failed: Dict[str, Tuple[int, str]]) -> None:
+        table = database.ExplanationFailure.__table__
+        now = datetime.datetime.utcnow()
+        insert = database.dialect_insert(table, db.get_bind())
+        db.execute(
+            insert.on_conflict_do_update(
+                index_elements=[table.c.key],
+                set_={"attempts": insert.excluded.attempts, "retry_at": insert.excluded.retry_at,
+                      "last_error": insert.excluded.last_error},
+            ),
+            [
+                {"key": k, "attempts": n + 1, "last_error": error[:500],
+                 "retry_at": now + datetime.timedelta(seconds=min(EXPLAIN_RETRY_SECONDS * 2 ** n, EXPLAIN_MAX_RETRY_SECONDS))}
+                for k, (n, error) in failed.items()
+            ],
+        )
+
+    # --- Requests ---
+    async def _explain(self, batch: List[Dict[str, Any]], client: httpx.AsyncClient,
+                       semaphore: asyncio.Semaphore) -> Tuple[List[Optional[str]], Optional[str]]:
+        """Explanations for `batch`, None where the API gave none (those rows stay pending), and the last error."""
+        try:
+            text = await self._generate(build_prompt(batch), client, semaphore)
+        except Exception as e:
+            logging.error(f"Explanation request failed for {len(batch)} transactions: {e}")
+            self.stats["failed"] += len(batch)
+            return [None] * len(batch), str(e) or type(e).__name__
+        if len(batch) == 1:
+            return [text.strip() or UNAVAILABLE_EXPLANATION], None
+        parsed = parse_batch_reply(text, len(batch))
+        if parsed is not None:
+            return parsed, None
+        # The model did not follow the batch format; ask for each one on its own.
+        singles = await asyncio.gather(*(self._explain([inputs], client, semaphore) for inputs in batch))
+        errors = [error for _, error in singles if error]
+        return [texts[0] for texts, _ in singles], errors[-1] if errors else None
+
+    async def _generate(self, prompt: str, client: httpx.AsyncClient, semaphore: asyncio.Semaphore) -> str:
+        payload = {"contents": [{"parts": [{"text": prompt}]}]}
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    self.stats["requests"] += 1
+                    started = time.perf_counter()
+                    try:
+                        resp = await client.post(self.api_url, params={"key": self.api_key}, json=payload)
+                    except httpx.TransportError:
+                        metrics.explanation_request_seconds.observe(time.perf_counter() - started, outcome="transport_error")
+                        raise
+                retryable = resp.status_code == 429 or resp.status_code >= 500
+                outcome = "ok" if resp.is_success else "retryable" if retryable else "error"
+                metrics.explanation_request_seconds.observe(time.perf_counter() - started, outcome=outcome)
+                if retryable:
+                    retry_after = resp.headers.get("Retry-After")
+                    raise _Retryable(f"HTTP {resp.status_code}", float(retry_after) if retry_after and retry_after.isdigit() else None)
+                resp.raise_for_status()
+                data = resp.json()
+                return data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+            except (httpx.TransportError, _Retryable) as e:
+                if attempt == self.max_retries:
+                    raise
+                self.stats["retries"] += 1
+                delay = getattr(e, "retry_after", None) or self.backoff_seconds * (2 ** attempt) * (0.5 + random.random())
+                await asyncio.sleep(min(delay, EXPLAIN_MAX_BACKOFF_SECONDS))
+
+
+worker = ExplanationWorker()
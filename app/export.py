@@ -0,0 +1,151 @@
+# export.py
+# Streaming fraud report exports. Rows are read from the database in batches
+# with yield_per and each batch is encoded and handed to the response before the
+# next one is read, so memory is bounded by EXPORT_BATCH_SIZE and the first
+# bytes go out as soon as the header is written.
+#
+#   csv      text/csv, optionally gzip-compressed as it is produced
+#   parquet  one row group per batch (requires pyarrow)
+#   arrow    Arrow IPC stream, one record batch per batch (requires pyarrow)
+
+import os
+import csv
+import io
+import zlib
+from typing import Any, Dict, Iterator, List
+
+import sqlalchemy
+
+from app import database, security
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - the columnar formats are optional
+    pa = None
+    pq = None
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+COLUMNS = ["id", "masked_card_number", "amount", "timestamp", "explanation"]
+
+# format -> (media type, file extension)
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+COLUMNAR_FORMATS = ("parquet", "arrow")
+
+
+def columnar_available() -> bool:
+    return pa is not None
+
+
+def fraud_row_batches(batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """Fraud rows newest first, `batch_size` at a time, from a session owned by the generator."""
+    t = database.Transaction.__table__
+    stmt = (
+        sqlalchemy.select(t.c.id, t.c.card_masked, t.c.card_number_encrypted, t.c.amount, t.c.timestamp, t.c.explanation)
+        .where(t.c.is_fraud == 1)
+        .order_by(t.c.timestamp.desc(), t.c.id.desc())
+        .execution_options(yield_per=batch_size)
+    )
+    db = database.SessionLocal()
+    try:
+        for rows in db.execute(stmt).partitions():
+            yield [
+                {
+                    "id": row.id,
+                    "masked_card_number": security.stored_masked_card(row.card_masked, row.card_number_encrypted),
+                    "amount": row.amount,
+                    "timestamp": row.timestamp,
+                    "explanation": row.explanation or "Explanation not available",
+                }
+                for row in rows
+            ]
+    finally:
+        db.close()
+
+
+def csv_stream(gzip: bool = False, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    # wbits=31 writes a gzip header and trailer around the deflate stream.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take() -> bytes:
+        data = buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(data) if compressor else data
+
+    writer.writerow(COLUMNS)
+    yield take()
+    for batch in fraud_row_batches(batch_size):
+        writer.writerows(
+            [r["id"], r["masked_card_number"], r["amount"], r["timestamp"].isoformat() if r["timestamp"] else "", r["explanation"]]
+            for r in batch
+        )
+        chunk = take()
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that keeps what was written until it is taken."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("masked_card_number", pa.string()),
+        ("amount", pa.float64()),
+        ("timestamp", pa.timestamp("us")),
+        ("explanation", pa.string()),
+    ])
+
+
+def columnar_stream(fmt: str, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """Parquet (a row group per batch) or an Arrow IPC stream (a record batch per batch)."""
+    if pa is None:
+        raise RuntimeError("pyarrow is not installed.")
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema) if fmt == "parquet" else pa.ipc.new_stream(sink, schema)
+    try:
+        chunk = sink.take()
+        if chunk:
+            yield chunk
+        for batch in fraud_row_batches(batch_size):
+            table = pa.Table.from_pylist(batch, schema=schema)
+            writer.write_table(table)
+            chunk = sink.take()
+            if chunk:
+                yield chunk
+    finally:
+        writer.close()
+    # The Parquet footer / Arrow end-of-stream marker are written on close.
+    yield sink.take()
@@ -2,23 +2,25 @@
 
 import os
 import sys
+import json
+import contextlib
+import uuid
 import asyncio
-import threading
 import logging
 from datetime import datetime
-from typing import List, Dict
-import pandas as pd
-from io import StringIO
+from typing import List, Dict, Optional
 
-from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, Query
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+import sqlalchemy
 from sqlalchemy.orm import Session
 from starlette.staticfiles import StaticFiles
 
-from app import database, security, services
-from ml import model
+from app import audit, auto_detection, counters, database, detection, detection_runs, explanations, export, metrics, migrations, progress, rules, scoring, security, services, training_jobs
+from ml import evaluation, model, training
 
 # --- Fix Windows event loop issues ---
 if sys.platform == "win32":
@@ -29,10 +31,14 @@ logging.basicConfig(level=logging.INFO)
 
 # --- FastAPI App ---
 app = FastAPI(title="Fraud Detection API", version="11.0-BatchedProcessing")
+app.add_middleware(metrics.RequestTimer)
 
 # --- Task Management ---
-task_lock = threading.Lock()
-task_progress: Dict[str, any] = {"status": "idle", "processed": 0, "total": 0, "fraudulent": 0}
+# Runs and their progress live in the database (app/detection_runs.py). This tracker only
+# wakes this process's progress streams when its own worker commits a chunk.
+detection_progress = progress.ProgressTracker(detection.STAGES)
+PROGRESS_HEARTBEAT_SECONDS = float(os.getenv("PROGRESS_HEARTBEAT_SECONDS", "15"))
+PROGRESS_POLL_SECONDS = float(os.getenv("PROGRESS_POLL_SECONDS", "1"))  # streams also poll, for other processes' chunks
 
 # --- Frontend Setup ---
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -73,10 +79,48 @@ class TransactionIn(BaseModel):
 class TransactionBatch(BaseModel):
     transactions: List[TransactionIn]
 
+class CardLookup(BaseModel):
+    card_number: str
+
+class UploadCreate(BaseModel):
+    filename: str | None = None
+
 class ModelName(BaseModel):
     model_name: str
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+class ModelPromote(ModelName):
+    version: int
+
+class RetrainRequest(ModelName):
+    incremental: bool = False  # partial_fit models only: continue the promoted version on rows added since
+
+class EvaluateRequest(BaseModel):
+    cv_folds: int = Field(0, ge=0, le=10)  # 0: holdout only; otherwise k-fold cross-validation of the training split too
+
+class DetectionStart(ModelName):
+    chunk_size: int | None = Field(None, ge=100, le=500000)
+    workers: int | None = Field(None, ge=1, le=64)
+    shard_rows: int | None = Field(None, ge=100)  # rows per leased shard, see app/detection_runs.py
+    profile: bool = False  # sample the run's stacks into metrics.PROFILE_DIR for a flamegraph
+
+class AutoDetectSelect(BaseModel):
+    model_name: str | None = None  # None switches auto-detection off
+
+class ScoreRequest(BaseModel):
+    transactions: List[TransactionIn] = Field(..., min_length=1, max_length=100)
+    model_name: str = "IsolationForest"
+    persist: bool = False
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    return _authenticate(token)
+
+def _authenticate(token: str) -> UserInDB:
+    """Resolves a token to a user. Tokens verified recently are answered from
+    security.principal_cache without decoding or a database session."""
+    username = security.principal_cache.get(token)
+    if username is not None:
+        return UserInDB(username=username)
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid authentication credentials",
@@ -90,88 +134,62 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     except security.JWTError:
         raise credentials_exception
 
-    user = db.query(database.User).filter(database.User.username == username).first()
+    db = database.SessionLocal()
+    try:
+        user = db.query(database.User).filter(database.User.username == username).first()
+    finally:
+        db.close()
     if user is None:
         raise credentials_exception
+    security.principal_cache.put(token, user.username, payload.get("exp"))
     return UserInDB(username=user.username)
 
-# --- Fraud Detection Background Task (High-Performance Batching) ---
-def run_detection_in_background(db: Session, model_name: str):
-    global task_progress
+@sqlalchemy.event.listens_for(database.User, "after_update")
+@sqlalchemy.event.listens_for(database.User, "after_delete")
+def _invalidate_cached_principal(mapper, connection, target):
+    # ORM changes only; code that updates users with Core statements must call invalidate_user itself.
+    renamed_from = sqlalchemy.inspect(target).attrs.username.history.deleted or ()
+    for username in {target.username, *renamed_from}:
+        security.principal_cache.invalidate_user(username)
+
+# --- Fraud Detection Background Task (Pipelined, see app/detection.py) ---
+def run_detection_in_background(run_id: str, profile: bool = False):
+    """This process's worker on the run. Other API processes and `python -m app.detection_runs` may join it."""
+    profiler = metrics.SamplingProfiler() if profile else None
     try:
-        total_unprocessed = db.query(database.Transaction).filter(database.Transaction.is_fraud == -1).count()
-        task_progress.update({"status": "running", "processed": 0, "total": total_unprocessed, "fraudulent": 0})
-        chunk_size = 50000
-
-        while task_progress["processed"] < total_unprocessed:
-            query = db.query(database.Transaction).filter(database.Transaction.is_fraud == -1).limit(chunk_size).statement
-            df_batch = pd.read_sql(query, db.bind)
-            if df_batch.empty:
-                break
-
-            df_batch['is_fraud'] = 0
-            df_batch['explanation'] = "Transaction appears legitimate."
-
-            # --- Rule-based detection ---
-            df_batch.loc[df_batch['amount'] > 10000, ['is_fraud', 'explanation']] = (
-                1, "Transaction flagged due to high value (> $10,000)."
-            )
-
-            # --- ML-based detection ---
-            unflagged_mask = (df_batch['is_fraud'] == 0)
-            if unflagged_mask.any():
-                df_to_predict = df_batch.loc[unflagged_mask]
-                ml_predictions = model.predict(df_to_predict, model_name=model_name)
-                ml_fraud_indices = df_to_predict.index[ml_predictions == 1]
-
-                df_batch.loc[ml_fraud_indices, 'is_fraud'] = 1
-
-                if not ml_fraud_indices.empty:
-                    gemini_details = df_batch.loc[ml_fraud_indices].apply(
-                        lambda r: {"amount": r['amount'], "timestamp": r['timestamp'].strftime('%Y-%m-%d %H:%M:%S')},
-                        axis=1
-                    ).tolist()
-
-                    async def fetch_all_explanations():
-                        try:
-                            return await services.get_fraud_explanation_batch_async(gemini_details)
-                        except Exception as e:
-                            logging.error(f"Error fetching explanations: {e}")
-                            return ["Flagged by ML anomaly detection."] * len(gemini_details)
-
-                    explanations = asyncio.run(fetch_all_explanations())
-                    if len(explanations) == len(ml_fraud_indices):
-                        df_batch.loc[ml_fraud_indices, 'explanation'] = explanations
-                    else:
-                        logging.error("Mismatch between ML fraud indices and explanations count.")
-
-            update_mappings = df_batch[['id', 'is_fraud', 'explanation']].to_dict(orient='records')
-            db.bulk_update_mappings(database.Transaction, update_mappings)
-            db.commit()
-
-            task_progress['processed'] += len(df_batch)
-            task_progress['fraudulent'] += int(df_batch['is_fraud'].sum())
-            logging.info(f"Processed chunk of {len(df_batch)}. Total processed: {task_progress['processed']}/{total_unprocessed}")
-
-        task_progress["status"] = "completed"
-        logging.info("✅ Fraud detection completed successfully.")
-
+        with profiler or contextlib.nullcontext():
+            status = detection_runs.Worker(progress=detection_progress).work(run_id)
+        if profiler:
+            name = f"detection-{datetime.utcnow():%Y%m%d-%H%M%S}-{run_id}.folded"
+            detection_runs.update_run(run_id, profile=profiler.write(os.path.join(metrics.PROFILE_DIR, name)))
+        if status == "completed":
+            logging.info("✅ Fraud detection completed successfully.")
+        else:
+            logging.error(f"❌ Fraud detection run {run_id} ended with status '{status}'.")
     except Exception as e:
-        task_progress["status"] = "error"
         logging.error(f"❌ Error in background detection task: {e}")
-
     finally:
-        if task_lock.locked():
-            task_lock.release()
-        db.close()
+        detection_progress.update()  # wakes this process's streams to read the final state
 
 # --- App Events ---
 @app.on_event("startup")
 async def startup_event():
     model.load_models()
     database.create_db()
+    audit.writer.start()
+    explanations.worker.start()
+    auto_detection.detector.start()
     logging.info("✅ Application startup: Models loaded and database ready.")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await scoring.batcher.close()
+    security.shutdown_encrypt_pool()
+    auto_detection.detector.stop()
+    training_jobs.shutdown()
+    explanations.worker.stop()
+    audit.writer.stop()
+
 # --- API Endpoints ---
 
 @app.post("/users/")
@@ -194,122 +212,455 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     return {"access_token": token, "token_type": "bearer"}
 
 @app.post("/ingest_batch/")
-def ingest_batch(batch: TransactionBatch, db: Session = Depends(get_db), current_user: UserInDB = Depends(get_current_user)):
-    masked_response = []
-    for tx in batch.transactions:
-        encrypted_card = security.encrypt_data(tx.card_number)
-        db_tx = database.Transaction(card_number_encrypted=encrypted_card, amount=tx.amount, is_fraud=-1)
-        db.add(db_tx)
-        masked_response.append({"masked_card": security.mask_card_number(tx.card_number), "amount": tx.amount})
-    db.commit()
-    db.add(database.AuditLog(username=current_user.username, action=f"Ingested {len(batch.transactions)} new transactions"))
-    db.commit()
+def ingest_batch(
+    batch: TransactionBatch,
+    bulk: bool = Query(False, description="High-throughput mode: parallel encryption, Core bulk inserts, summary response."),
+    db: Session = Depends(get_db),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """With auto-detection on, the new rows are queued for labeling; a full queue makes this wait, then 503."""
+    try:
+        with auto_detection.detector.admit(len(batch.transactions)) as enqueue:
+            if bulk:
+                summary = services.bulk_ingest_transactions(db, [tx.model_dump() for tx in batch.transactions],
+                                                            on_commit=enqueue)
+                audit.record(current_user.username, f"Ingested {summary['ingested']} new transactions (bulk)")
+                return {"message": "Batch ingested successfully.", **summary}
+
+            masked_response, db_txs = [], []
+            for tx in batch.transactions:
+                encrypted_card = security.encrypt_data(tx.card_number)
+                masked_card = security.mask_card_number(tx.card_number)
+                db_tx = database.Transaction(
+                    card_number_encrypted=encrypted_card, card_token=security.card_token(tx.card_number),
+                    card_masked=masked_card, amount=tx.amount, is_fraud=-1
+                )
+                db.add(db_tx)
+                db_txs.append(db_tx)
+                masked_response.append({"masked_card": masked_card, "amount": tx.amount})
+            counters.record(db, unprocessed=len(batch.transactions))
+            db.flush()
+            ids = [db_tx.id for db_tx in db_txs]
+            db.commit()
+            metrics.rows_ingested.inc(len(ids))
+            enqueue(ids)
+    except auto_detection.Backpressure as e:
+        # Raised before anything is inserted.
+        raise HTTPException(status_code=503, detail=f"{e} Retry shortly.",
+                            headers={"Retry-After": str(max(1, round(auto_detection.detector.admit_seconds)))})
+    audit.record(current_user.username, f"Ingested {len(batch.transactions)} new transactions")
     return {"message": "Batch ingested successfully.", "transactions": masked_response}
 
+def _upload_state(upload: database.IngestUpload) -> Dict[str, any]:
+    return {
+        "upload_id": upload.id,
+        "offset": upload.bytes_committed,
+        "rows_ingested": upload.rows_ingested,
+        "rows_skipped": upload.rows_skipped,
+        "status": upload.status,
+    }
+
+def _get_upload(db: Session, upload_id: str, username: str) -> database.IngestUpload:
+    upload = db.get(database.IngestUpload, upload_id)
+    if upload is None or upload.username != username:
+        raise HTTPException(status_code=404, detail="Upload not found.")
+    return upload
+
+@app.post("/ingest_csv/uploads")
+def create_csv_upload(payload: UploadCreate, db: Session = Depends(get_db), current_user: UserInDB = Depends(get_current_user)):
+    upload = database.IngestUpload(id=uuid.uuid4().hex, username=current_user.username, filename=payload.filename)
+    db.add(upload)
+    db.commit()
+    return _upload_state(upload)
+
+@app.get("/ingest_csv/uploads/{upload_id}")
+def get_csv_upload(upload_id: str, db: Session = Depends(get_db), current_user: UserInDB = Depends(get_current_user)):
+    return _upload_state(_get_upload(db, upload_id, current_user.username))
+
+@app.put("/ingest_csv/uploads/{upload_id}")
+async def append_csv_upload(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0, description="Byte offset of this piece; must equal the committed offset."),
+    final: bool = Query(False, description="This piece ends the file."),
+    db: Session = Depends(get_db),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Streams a piece of a CSV file into the database.
+
+    The body is parsed as it arrives and written every `INGEST_COMMIT_SIZE` rows.
+    The response acknowledges the committed offset, which may be short of the
+    bytes sent when the piece ends mid-line; the client sends the next piece
+    from there. After a dropped connection, GET the upload to find where to resume.
+    """
+    upload = await run_in_threadpool(_get_upload, db, upload_id, current_user.username)
+    if upload.status != "open":
+        raise HTTPException(status_code=409, detail="Upload already completed.")
+    if offset != upload.bytes_committed:
+        raise HTTPException(status_code=409, detail=f"Offset mismatch: resume from {upload.bytes_committed}.")
+
+    ingestor = services.CsvStreamIngestor(db, upload)
+    try:
+        async for data in request.stream():
+            if ingestor.feed(data):
+                await run_in_threadpool(ingestor.flush)
+        await run_in_threadpool(ingestor.finish, final)
+    except services.UploadConflict:
+        db.expire(upload)
+        state = await run_in_threadpool(_upload_state, upload)
+        raise HTTPException(status_code=409, detail=f"Offset mismatch: resume from {state['offset']}.")
+
+    if final:
+        audit.record(current_user.username, f"Ingested {upload.rows_ingested} new transactions from CSV upload")
+    return await run_in_threadpool(_upload_state, upload)
+
+def persist_scored_in_background(transactions: List[Dict[str, any]]):
+    db = database.SessionLocal()
+    try:
+        services.insert_transactions(db, transactions)
+        db.commit()
+    except Exception as e:
+        logging.error(f"❌ Error persisting scored transactions: {e}")
+    finally:
+        db.close()
+
+@app.post("/score")
+async def score_transactions(
+    payload: ScoreRequest,
+    background_tasks: BackgroundTasks,
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Scores transactions in-line: the rules, then the loaded model, micro-batched with concurrent calls.
+
+    Cards detection has not seen yet get their history from the database. With `persist`, the rows are
+    stored with the time they were scored."""
+    if payload.model_name not in model._models:
+        raise HTTPException(status_code=400, detail=f"Model '{payload.model_name}' not trained yet.")
+    transactions = [tx.model_dump() for tx in payload.transactions]
+    result = await scoring.score(transactions, payload.model_name)
+    if payload.persist:
+        labeled = [{**tx, **decision} for tx, decision in zip(transactions, result["decisions"])]
+        background_tasks.add_task(persist_scored_in_background, labeled)
+    return result
+
 @app.post("/transactions/clear")
 def clear_transactions(db: Session = Depends(get_db), current_user: UserInDB = Depends(get_current_user)):
     num_deleted = db.query(database.Transaction).delete()
-    db.add(database.AuditLog(username=current_user.username, action=f"Cleared {num_deleted} transactions"))
+    counters.reset(db)
+    model.feature_store.clear()
     db.commit()
+    audit.record(current_user.username, f"Cleared {num_deleted} transactions")
     return {"message": f"Cleared {num_deleted} transactions."}
 
-@app.post("/model/retrain")
-def retrain_model(payload: ModelName, db: Session = Depends(get_db), current_user: UserInDB = Depends(get_current_user)):
+@app.post("/model/retrain", status_code=status.HTTP_202_ACCEPTED)
+def retrain_model(payload: RetrainRequest, db: Session = Depends(get_db), current_user: UserInDB = Depends(get_current_user)):
+    """Starts a training job in a separate process; poll GET /model/jobs/{job_id} for its progress."""
+    if payload.model_name not in model.AVAILABLE_MODELS:
+        raise HTTPException(status_code=400, detail=f"Model '{payload.model_name}' not available.")
     labeled_count = db.query(database.Transaction).filter(database.Transaction.is_fraud != -1).count()
-    if payload.model_name != "IsolationForest" and labeled_count < 10:
+    if payload.model_name != "IsolationForest" and labeled_count < training.MIN_LABELED_ROWS:
         raise HTTPException(status_code=400, detail="Not enough labeled data. Run detection with IsolationForest first.")
-    model.train_model(db, payload.model_name)
-    db.add(database.AuditLog(username=current_user.username, action=f"Retrained model '{payload.model_name}'"))
-    db.commit()
-    return {"message": f"Model '{payload.model_name}' retrained successfully."}
+    if payload.incremental and not training.supports_partial_fit(model.AVAILABLE_MODELS[payload.model_name]):
+        raise HTTPException(status_code=400, detail=f"Model '{payload.model_name}' has no partial_fit; retrain it in full.")
+    if payload.incremental and payload.model_name not in model._models:
+        raise HTTPException(status_code=400, detail=f"Model '{payload.model_name}' has no trained version to update.")
+    running = training_jobs.active_job(db, payload.model_name)
+    if running:
+        raise HTTPException(status_code=409, detail=f"Model '{payload.model_name}' is already training (job {running['job_id']}).")
+    job = training_jobs.start(db, payload.model_name, current_user.username, payload.incremental)
+    if job is None:
+        raise HTTPException(status_code=409, detail=f"Model '{payload.model_name}' is already training, or an evaluation is running.")
+    mode = "incremental" if payload.incremental else "full"
+    audit.record(current_user.username, f"Started {mode} retraining of model '{payload.model_name}' (job {job['job_id']})")
+    return {"message": f"Retraining of model '{payload.model_name}' started.", "job_id": job["job_id"], "status": job["status"]}
+
+@app.get("/model/jobs")
+def list_training_jobs(limit: int = Query(20, ge=1, le=200), db: Session = Depends(get_db),
+                       current_user: UserInDB = Depends(get_current_user)):
+    return training_jobs.list_jobs(db, limit)
+
+@app.get("/model/jobs/{job_id}")
+def get_training_job(job_id: str, db: Session = Depends(get_db), current_user: UserInDB = Depends(get_current_user)):
+    job = training_jobs.get(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found.")
+    return job
+
+@app.post("/model/evaluate", status_code=status.HTTP_202_ACCEPTED)
+def evaluate_models(payload: EvaluateRequest, db: Session = Depends(get_db), current_user: UserInDB = Depends(get_current_user)):
+    """Trains and scores every model side by side in a job; poll GET /model/evaluations for the results."""
+    if payload.cv_folds == 1:
+        raise HTTPException(status_code=400, detail="cv_folds must be 0 (holdout only) or at least 2.")
+    labeled_count = db.query(database.Transaction).filter(database.Transaction.is_fraud != -1).count()
+    if labeled_count < training.MIN_LABELED_ROWS:
+        raise HTTPException(status_code=400, detail="Not enough labeled data. Run detection with IsolationForest first.")
+    running = training_jobs.active_job(db, evaluation.ALL_MODELS)
+    if running:
+        raise HTTPException(status_code=409, detail=f"An evaluation is already running (job {running['job_id']}).")
+    job = training_jobs.start_evaluation(db, current_user.username, payload.cv_folds)
+    if job is None:
+        raise HTTPException(status_code=409, detail="An evaluation or a retraining job is already running.")
+    audit.record(current_user.username, f"Started evaluation of all models (job {job['job_id']})")
+    return {"message": "Evaluation of all models started.", "job_id": job["job_id"], "status": job["status"]}
+
+@app.get("/model/evaluations")
+def get_model_evaluations(job_id: str | None = None, db: Session = Depends(get_db),
+                          current_user: UserInDB = Depends(get_current_user)):
+    found = training_jobs.evaluations(db, job_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="No evaluation found. Start one with POST /model/evaluate.")
+    return found
+
+@app.get("/model/evaluations/best")
+def get_best_model(
+    min_precision: float = Query(evaluation.EVAL_MIN_PRECISION, ge=0, le=1),
+    min_recall: float = Query(evaluation.EVAL_MIN_RECALL, ge=0, le=1),
+    backend: str = Query(model.PREDICT_BACKEND, pattern="^(sklearn|compiled)$"),
+    job_id: str | None = None,
+    db: Session = Depends(get_db),
+    current_user: UserInDB = Depends(get_current_user),
+):
+    """The fastest evaluated model meeting both thresholds; promote its version with POST /model/promote."""
+    best = training_jobs.best_evaluation(db, min_precision, min_recall, backend, job_id)
+    if best is None:
+        raise HTTPException(status_code=404, detail="No completed evaluation has a model meeting those thresholds.")
+    return best
+
+@app.get("/model/versions")
+def list_model_versions(current_user: UserInDB = Depends(get_current_user)):
+    return {name: model.registry.describe(name) for name in model.AVAILABLE_MODELS}
+
+@app.post("/model/promote")
+def promote_model(payload: ModelPromote, current_user: UserInDB = Depends(get_current_user)):
+    """Switches the serving version. Running detection jobs finish on the version they started with."""
+    if payload.model_name not in model.AVAILABLE_MODELS:
+        raise HTTPException(status_code=400, detail=f"Model '{payload.model_name}' not available.")
+    try:
+        model.registry.promote(payload.model_name, payload.version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model '{payload.model_name}' has no version {payload.version}.")
+    audit.record(current_user.username, f"Promoted model '{payload.model_name}' to v{payload.version}")
+    return {"message": f"Model '{payload.model_name}' v{payload.version} promoted."}
 
 
 @app.post("/detection/start")
 def start_detection(
-    payload: ModelName,
+    payload: DetectionStart,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: UserInDB = Depends(get_current_user)
 ):
-    if not task_lock.acquire(blocking=False):
+    detection_runs.abandon_stale(db)
+    if detection_runs.active_run(db) is not None:
         raise HTTPException(status_code=409, detail="Detection already running.")
 
     unprocessed_count = db.query(database.Transaction).filter(database.Transaction.is_fraud == -1).count()
     if unprocessed_count == 0:
-        task_lock.release()
         raise HTTPException(status_code=404, detail="No unprocessed transactions.")
 
     # ✅ Safety: supervised models must be trained first
     if payload.model_name != "IsolationForest" and payload.model_name not in model._models:
-        task_lock.release()
         raise HTTPException(
             status_code=400,
             detail=f"Model '{payload.model_name}' not trained yet. Retrain it first using /model/retrain."
         )
 
-    global task_progress
-    task_progress = {"status": "starting", "processed": 0, "total": unprocessed_count, "fraudulent": 0}
+    run = detection_runs.start(
+        db, payload.model_name, current_user.username,
+        chunk_size=payload.chunk_size or detection.DETECTION_CHUNK_SIZE,
+        workers=payload.workers or detection.DETECTION_WORKERS,
+        shard_rows=payload.shard_rows or detection_runs.DETECTION_SHARD_ROWS,
+    )
+    if run is None:
+        raise HTTPException(status_code=409, detail="Detection already running.")
 
-    db.add(database.AuditLog(
-        username=current_user.username,
-        action=f"Started detection for {unprocessed_count} txns using model '{payload.model_name}'"
-    ))
-    db.commit()
+    audit.record(current_user.username, f"Started detection for {run['total']} txns using model '{payload.model_name}'")
 
-    db_session_for_task = database.SessionLocal()
-    background_tasks.add_task(run_detection_in_background, db_session_for_task, payload.model_name)
+    background_tasks.add_task(run_detection_in_background, run["run_id"], payload.profile)
 
-    return {"message": f"Started fraud detection for {unprocessed_count} transactions."}
+    return {"message": f"Started fraud detection for {run['total']} transactions.", "run_id": run["run_id"],
+            "shards": run["shards"]}
 
 
+def _read_progress(run_id: Optional[str] = None) -> Optional[Dict[str, any]]:
+    db = database.SessionLocal()
+    try:
+        return detection_runs.progress(db, run_id)
+    finally:
+        db.close()
+
 @app.get("/detection/progress")
-def get_progress(current_user: UserInDB = Depends(get_current_user)):
-    global task_progress
-    current_status = "running" if task_lock.locked() else task_progress.get("status", "idle")
-    return {**task_progress, "status": current_status}
+def get_progress(run_id: Optional[str] = Query(None, description="Defaults to the latest run."),
+                 current_user: UserInDB = Depends(get_current_user)):
+    state = _read_progress(run_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Detection run not found.")
+    return state
+
+@app.post("/detection/progress/ticket")
+def issue_progress_ticket(current_user: UserInDB = Depends(get_current_user)):
+    """A single-use ticket for /detection/progress/stream, valid for STREAM_TICKET_SECONDS."""
+    return {"ticket": security.issue_stream_ticket(current_user.username),
+            "expires_in": security.STREAM_TICKET_SECONDS}
+
+@app.get("/detection/progress/stream")
+async def stream_progress(request: Request, ticket: str = Query(...)):
+    """Server-sent events: one `data:` message per processed chunk and status change, with
+    rows/sec, ETA, fraud rate and per-stage timings. EventSource cannot set headers, so the
+    URL carries a ticket from POST /detection/progress/ticket, never the bearer token. The
+    stream ends once a run has completed or failed.
+
+    Chunks committed by this process push at once; the database is also polled every
+    PROGRESS_POLL_SECONDS for chunks committed by other workers."""
+    username = await run_in_threadpool(security.redeem_stream_ticket, ticket)
+    if username is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired stream ticket.")
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        sent, sent_at = None, loop.time()
+        async for _ in detection_progress.subscribe(PROGRESS_POLL_SECONDS):
+            if await request.is_disconnected():
+                break
+            state = await run_in_threadpool(_read_progress)
+            key = (state.get("run_id"), state["status"], state["processed"])
+            if key == sent:
+                if loop.time() - sent_at >= PROGRESS_HEARTBEAT_SECONDS:
+                    sent_at = loop.time()
+                    yield ": keepalive\n\n"
+                continue
+            sent, sent_at = key, loop.time()
+            yield f"data: {json.dumps(state, default=str)}\n\n"
+            if state["status"] in progress.TERMINAL_STATUSES:
+                break
+
+    logging.info(f"📡 {username} subscribed to detection progress")
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/detection/auto")
+def auto_detection_status(current_user: UserInDB = Depends(get_current_user)):
+    """This process's streaming detection: the selected model, queued rows and counts since startup."""
+    return auto_detection.detector.status()
+
+@app.post("/detection/auto")
+def select_auto_detection(payload: AutoDetectSelect, current_user: UserInDB = Depends(get_current_user)):
+    """Labels rows ingested through /ingest_batch/ as they arrive, with this model (or stops, with none)."""
+    if payload.model_name is not None and payload.model_name not in model._models:
+        raise HTTPException(status_code=400, detail=f"Model '{payload.model_name}' not trained yet.")
+    auto_detection.detector.select(payload.model_name)
+    if payload.model_name is None:
+        audit.record(current_user.username, "Switched auto-detection off")
+        return {"message": "Auto-detection off.", **auto_detection.detector.status()}
+    audit.record(current_user.username, f"Switched auto-detection on with model '{payload.model_name}'")
+    return {"message": f"Auto-detecting new transactions with model '{payload.model_name}'.",
+            **auto_detection.detector.status()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text format. Unauthenticated so a scraper can read it; it holds counts and timings only."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/rules")
+def get_rules(current_user: UserInDB = Depends(get_current_user)):
+    """The rule set in force, with each rule's hits and evaluation time in this process."""
+    return rules.engine.status()
+
+@app.post("/rules/reload")
+def reload_rules(current_user: UserInDB = Depends(get_current_user)):
+    """Re-reads the rules file now instead of at the next change check."""
+    try:
+        ruleset = rules.engine.reload()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Rules not reloaded: {e}")
+    audit.record(current_user.username, f"Reloaded {len(ruleset.rules)} rules")
+    return {"message": f"Loaded {len(ruleset.rules)} rules.", "rules": [rule.name for rule in ruleset.rules]}
+
+@app.get("/explanations/status")
+def explanation_status(db: Session = Depends(get_db), current_user: UserInDB = Depends(get_current_user)):
+    worker = explanations.worker
+    return {"enabled": worker.enabled, "pending": worker.pending_count(db), **worker.stats}
 
 @app.get("/fraud/report")
 def fraud_report(
     page: int = Query(1, ge=1),
     page_size: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page; takes precedence over page."),
     db: Session = Depends(get_db),
     current_user: UserInDB = Depends(get_current_user)
 ):
-    return services.get_fraud_report_chunk(db, page, page_size)
+    try:
+        return services.get_fraud_report_chunk(db, page, page_size, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/fraud/report/download")
-def download_fraud_report(db: Session = Depends(get_db), current_user: UserInDB = Depends(get_current_user)):
-    fraud_cases = db.query(database.Transaction).filter(database.Transaction.is_fraud == 1).all()
-    if not fraud_cases:
+def download_fraud_report(
+    format: str = Query("csv", pattern="^(csv|parquet|arrow)$", description="csv, parquet or arrow (Arrow IPC stream)."),
+    gzip: bool = Query(False, description="Gzip the CSV as it streams."),
+    db: Session = Depends(get_db),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """Streams every fraud case in batches; memory stays bounded however many there are."""
+    if counters.summary(db)["fraudulent"] == 0:
         raise HTTPException(status_code=404, detail="No fraudulent transactions found.")
+    if format in export.COLUMNAR_FORMATS and not export.columnar_available():
+        raise HTTPException(status_code=501, detail=f"{format} export requires pyarrow.")
 
-    data = []
-    for tx in fraud_cases:
-        # Decrypt and mask the card number before adding to the report
-        try:
-            decrypted_card = security.decrypt_data(tx.card_number_encrypted)
-            masked_card = security.mask_card_number(decrypted_card)
-        except Exception:
-            masked_card = "Decryption Error"
-            
-        data.append({
-            "id": tx.id,
-            "masked_card_number": masked_card, # Added this missing field
-            "amount": tx.amount,
-            "timestamp": tx.timestamp.isoformat(),
-            "explanation": tx.explanation or "Explanation not available"
-        })
-
-    df = pd.DataFrame(data)
-    stream = StringIO()
-    df.to_csv(stream, index=False)
-
-    response = StreamingResponse(iter([stream.getvalue()]), media_type="text/csv")
-    response.headers["Content-Disposition"] = f"attachment; filename=fraud_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-
-    db.add(database.AuditLog(username=current_user.username, action="Downloaded fraud report"))
-    db.commit()
+    media_type, extension = export.FORMATS[format]
+    if format == "csv":
+        body = export.csv_stream(gzip=gzip)
+        if gzip:
+            media_type, extension = "application/gzip", "csv.gz"
+    else:
+        body = export.columnar_stream(format)
+
+    response = StreamingResponse(body, media_type=media_type)
+    response.headers["Content-Disposition"] = f"attachment; filename=fraud_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+
+    audit.record(current_user.username, f"Downloaded fraud report ({extension})")
     return response
 
+@app.post("/cards/transactions")
+def card_transactions(
+    payload: CardLookup,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    # POST so the card number never lands in a URL or access log.
+    results = services.get_card_transactions(db, payload.card_number, limit)
+    audit.record(current_user.username, f"Looked up transactions for card {security.mask_card_number(payload.card_number)}")
+    return {"transactions": results}
+
+def run_backfills_in_background(db: Session):
+    try:
+        logging.info(f"✅ Backfill finished: {migrations.run_backfills(db)}")
+    except Exception as e:
+        logging.error(f"❌ Error in backfill task: {e}")
+    finally:
+        db.close()
+
+@app.post("/maintenance/backfill")
+def start_backfill(background_tasks: BackgroundTasks, current_user: UserInDB = Depends(get_current_user)):
+    audit.record(current_user.username, "Started derived-column backfill")
+    background_tasks.add_task(run_backfills_in_background, database.SessionLocal())
+    return {"message": "Backfill started."}
+
 @app.get("/audit_log/")
-def audit_log(db: Session = Depends(get_db), current_user: UserInDB = Depends(get_current_user)):
-    return db.query(database.AuditLog).order_by(database.AuditLog.timestamp.desc()).all()
+def audit_log(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page."),
+    username: Optional[str] = None,
+    action: Optional[str] = Query(None, description="Case-insensitive substring of the action."),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+    current_user: UserInDB = Depends(get_current_user)
+):
+    """A page of audit events, newest first. Queued events are written first so the page is current."""
+    audit.writer.flush()
+    try:
+        return audit.query_log(db, limit, cursor, username, action, since, until)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,253 @@
+# metrics.py
+# In-process counters and histograms, rendered in the Prometheus text format by
+# GET /metrics. Each metric is a dict of label values -> numbers behind one lock,
+# cheap enough for the per-row hot paths (Fernet) as well as per-chunk ones.
+# Values are per process: work done in pool workers (bulk encryption, parallel
+# predict) is timed by the parent around the whole call instead.
+#
+# SamplingProfiler is the optional flamegraph hook: while active it samples every
+# thread's stack and writes collapsed stacks ("frame;frame;frame count" lines)
+# that flamegraph.pl, speedscope or inferno render directly.
+
+import os
+import sys
+import time
+import bisect
+import logging
+import threading
+import collections
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# Seconds; spans a Fernet call (~10µs) up to a full detection chunk.
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {value:g}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, n: int = 1, **labels) -> None:
+        """Records `value` (n times, for a batch of rows that share it)."""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += n
+            series[1] += value * n
+            series[2] += n
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return series[2] if series else 0
+
+    def total(self, **labels) -> float:
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            return series[1] if series else 0.0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None without observations; inf past the last bucket)."""
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            if not series or not series[2]:
+                return None
+            rank, cumulative = q * series[2], 0
+            for bound, n in zip(self.buckets + (float("inf"),), series[0]):
+                cumulative += n
+                if cumulative >= rank:
+                    return bound
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                pairs = list(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, n in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(pairs)} {total:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in _metrics for line in metric.render()) + "\n"
+
+
+# --- Application metrics ---
+http_request_seconds = Histogram(
+    "http_request_duration_seconds", "Time to the response start, by route template.", ("method", "route", "status"))
+rows_ingested = Counter("rows_ingested_total", "Transactions inserted.")
+rows_scored = Counter("rows_scored_total", "Transactions scored, by path (detection, score or auto).", ("path", "model"))
+rows_flagged = Counter("rows_flagged_total", "Transactions flagged as fraud, by path and by what flagged them.",
+                       ("path", "model", "source"))
+read_sql_seconds = Histogram("detection_read_sql_seconds", "pd.read_sql of one detection chunk.")
+predict_seconds = Histogram("model_predict_seconds", "One model.predict call (a chunk or a micro-batch).",
+                            ("path", "model"))
+explanation_request_seconds = Histogram(
+    "explanation_request_seconds", "One LLM explanation request, by outcome.", ("outcome",))
+bulk_update_seconds = Histogram("detection_bulk_update_seconds", "bulk_update_mappings of one detection chunk.")
+fernet_seconds = Histogram("fernet_seconds", "Fernet calls; encrypt_batch is one encrypt_many call.", ("op",))
+rule_hits = Counter("rule_hits_total", "Rows decided by each rule (app/rules.py).", ("rule", "action"))
+rule_seconds = Histogram("rule_eval_seconds", "One rule's mask over a chunk or micro-batch.", ("rule",))
+ingest_to_label_seconds = Histogram(
+    "ingest_to_label_seconds", "From an /ingest_batch/ commit to the auto-detection label, per row.", ("model",))
+auto_detect_wait_seconds = Histogram(
+    "auto_detect_wait_seconds", "Time /ingest_batch/ waited for room in the auto-detection queue.")
+
+
+# --- Request latency ---
+class RequestTimer:
+    """ASGI middleware observing http_request_seconds at the response start, so a
+    streamed download or the SSE stream counts its time to first byte, not its length."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        observed = False
+
+        async def timed_send(message):
+            nonlocal observed
+            if message["type"] == "http.response.start" and not observed:
+                observed = True
+                self._observe(scope, message["status"], started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            if not observed:
+                self._observe(scope, 500, started)
+
+    @staticmethod
+    def _observe(scope, status: int, started: float) -> None:
+        # The route template (e.g. /model/promote), set by the router once it matched; raw paths would explode the label set.
+        route = getattr(scope.get("route"), "path", "unmatched")
+        http_request_seconds.observe(time.perf_counter() - started, method=scope["method"], route=route, status=status)
+
+
+# --- Profiling ---
+class SamplingProfiler:
+    """Samples the stacks of all other threads every `interval_ms` until stopped."""
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.samples = 0
+        self._stacks: collections.Counter = collections.Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info(f"🔥 Wrote {self.samples} profile samples to {path}")
+        return path
@@ -0,0 +1,104 @@
+# migrations.py
+# Additive schema changes for databases created before a column existed, plus
+# batched backfill jobs for the derived columns. `create_all` only creates
+# missing tables, so new columns on existing tables are added here.
+#
+#   python -m app.migrations            # upgrade schema + run all backfills
+
+import logging
+from typing import Dict
+
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from app import counters, database, security
+
+# table -> {column: DDL type}
+ADDED_COLUMNS: Dict[str, Dict[str, str]] = {
+    "transactions": {"card_token": "VARCHAR", "card_masked": "VARCHAR"},
+}
+
+# index name -> (table, columns[, partial-index WHERE clause])
+ADDED_INDEXES = {
+    "ix_transactions_card_token": ("transactions", "card_token"),
+    "ix_transactions_fraud_ts_id": ("transactions", "is_fraud, timestamp, id"),
+    "ix_audit_log_ts_id": ("audit_log", "timestamp, id"),
+    "ix_transactions_explanation_pending": (
+        "transactions", "id", f"explanation = '{database.EXPLANATION_PENDING}'"
+    ),
+}
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade_schema(engine: sqlalchemy.engine.Engine) -> None:
+    """Adds any columns and indexes the models define that the live tables lack."""
+    inspector = sqlalchemy.inspect(engine)
+    with engine.begin() as conn:
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            for column, ddl_type in columns.items():
+                if column not in existing:
+                    conn.execute(sqlalchemy.text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+                    logging.info(f"Added column {table}.{column}")
+        for name, (table, columns, *where) in ADDED_INDEXES.items():
+            partial = f" WHERE {where[0]}" if where else ""
+            conn.execute(sqlalchemy.text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns}){partial}"))
+        counters.ensure(conn)
+
+
+def backfill_card_fields(db: Session, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """Fills card_token and card_masked for rows ingested before those columns existed.
+
+    Both come from the card number, so each row is decrypted once for the pair.
+    Returns rows updated.
+    """
+    table = database.Transaction.__table__
+    update = (
+        table.update()
+        .where(table.c.id == sqlalchemy.bindparam("_id"))
+        .values(card_token=sqlalchemy.bindparam("card_token"), card_masked=sqlalchemy.bindparam("card_masked"))
+    )
+    last_id, updated = 0, 0
+    while True:
+        rows = db.execute(
+            sqlalchemy.select(table.c.id, table.c.card_number_encrypted)
+            .where(sqlalchemy.or_(table.c.card_token.is_(None), table.c.card_masked.is_(None)), table.c.id > last_id)
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        params = []
+        for row in rows:
+            # Undecryptable rows still get values, so they are not retried forever.
+            try:
+                card_number = security.cipher_suite.decrypt(row.card_number_encrypted.encode()).decode()
+                masked = security.mask_card_number(card_number)
+            except Exception:
+                card_number, masked = "", security.UNREADABLE_CARD
+            params.append({"_id": row.id, "card_token": security.card_token(card_number), "card_masked": masked})
+        db.execute(update, params)
+        db.commit()
+        last_id = rows[-1].id
+        updated += len(rows)
+        logging.info(f"Backfilled card fields through id {last_id} ({updated} rows)")
+    return updated
+
+
+def run_backfills(db: Session) -> Dict[str, int]:
+    results = {"card_fields": backfill_card_fields(db)}
+    # Repairs the report counters if anything wrote to the table without going through app/counters.py.
+    results["counted"] = sum(counters.recount(db).values())
+    db.commit()
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    database.create_db()
+    session = database.SessionLocal()
+    try:
+        print(run_backfills(session))
+    finally:
+        session.close()
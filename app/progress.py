@@ -0,0 +1,123 @@
+# progress.py
+# Detection progress shared between the pipeline threads and the API.
+#
+# ProgressTracker owns the state behind a lock; readers get a snapshot copy.
+# Each completed chunk (and every status change) bumps a version and wakes
+# subscribers, which is what the /detection/progress/stream SSE endpoint waits
+# on, so clients get one push per chunk instead of polling.
+
+import time
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+TERMINAL_STATUSES = ("completed", "error")
+
+
+class ProgressTracker:
+    def __init__(self, stages: Iterable[str] = ()):
+        self._lock = threading.Lock()
+        self._stage_names = tuple(stages)
+        self._subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+        self._version = 0
+        self._started: Optional[float] = None
+        self._state: Dict[str, Any] = {}
+        self.reset()
+
+    # --- Writers (pipeline / API threads) ---
+    def reset(self, status: str = "idle", total: int = 0, **extra) -> None:
+        with self._lock:
+            self._started = time.perf_counter() if status != "idle" else None
+            self._state = {
+                "status": status,
+                "processed": 0,
+                "total": total,
+                "fraudulent": 0,
+                "fraud_rate": None,
+                "rows_per_sec": None,
+                "eta_seconds": None,
+                "elapsed_seconds": 0.0,
+                "stages": {name: {"rows": 0, "busy_seconds": 0.0, "rows_per_sec": None} for name in self._stage_names},
+                **extra,
+            }
+        self._publish()
+
+    def update(self, **fields) -> None:
+        with self._lock:
+            self._state.update(fields)
+        self._publish()
+
+    def add_stage(self, stage: str, rows: int, seconds: float) -> None:
+        """Rows and busy seconds per stage; rows/sec is per busy second, so the bottleneck has the lowest rate."""
+        with self._lock:
+            entry = self._state["stages"][stage]
+            entry["rows"] += rows
+            entry["busy_seconds"] = round(entry["busy_seconds"] + seconds, 4)
+            entry["rows_per_sec"] = round(entry["rows"] / entry["busy_seconds"], 1) if entry["busy_seconds"] else None
+
+    def add_chunk(self, rows: int, fraudulent: int) -> None:
+        with self._lock:
+            state = self._state
+            state["processed"] += rows
+            state["fraudulent"] += fraudulent
+            elapsed = time.perf_counter() - self._started if self._started else 0.0
+            state["elapsed_seconds"] = round(elapsed, 3)
+            state["fraud_rate"] = round(state["fraudulent"] / state["processed"], 4) if state["processed"] else None
+            if elapsed > 0:
+                rate = state["processed"] / elapsed
+                state["rows_per_sec"] = round(rate, 1)
+                state["eta_seconds"] = round(max(state["total"] - state["processed"], 0) / rate, 1) if rate else None
+        self._publish()
+
+    def finish(self, status: str) -> None:
+        with self._lock:
+            self._state["status"] = status
+            if self._started:
+                self._state["elapsed_seconds"] = round(time.perf_counter() - self._started, 3)
+            if status == "completed":
+                self._state["eta_seconds"] = 0.0
+        self._publish()
+
+    # --- Readers ---
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            state = dict(self._state)
+            state["stages"] = {name: dict(entry) for name, entry in self._state["stages"].items()}
+            return state
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    async def subscribe(self, heartbeat_seconds: float = 15.0) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Yields a snapshot now and after every change; yields None after `heartbeat_seconds` without one."""
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        entry = (loop, changed)
+        with self._lock:
+            self._subscribers.append(entry)
+        try:
+            seen = -1
+            while True:
+                if self._version != seen:
+                    seen = self._version
+                    changed.clear()
+                    yield self.snapshot()
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._subscribers.remove(entry)
+
+    def _publish(self) -> None:
+        with self._lock:
+            self._version += 1
+            subscribers = list(self._subscribers)
+        for loop, changed in subscribers:
+            try:
+                loop.call_soon_threadsafe(changed.set)
+            except RuntimeError:
+                pass  # the subscriber's loop has closed
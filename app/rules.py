@@ -0,0 +1,254 @@
+# rules.py
+# Declarative fraud rules, applied to each chunk (detection) or micro-batch
+# (/score) before the model. The rule set is read from RULES_PATH (JSON) and
+# compiled once into functions that build NumPy boolean masks over the whole
+# chunk. Rules are tried in order and the first one that matches a row decides
+# it: "flag" marks it fraud, "allow" marks it legitimate, and either way the
+# model never sees the row.
+#
+# A rule's conditions are ANDed. Each one names a field, an operator and a value:
+#   fields     amount, hour (0-24 with minutes as a fraction, UTC), and every
+#              feature in ml/features.py, i.e. the per-card history:
+#              txn_count_1h, amount_mean_7d, secs_since_prev, ...
+#   operators  > >= < <= == !=, between (inclusive), in
+#   values     a number; [low, high] for between (an hour range may wrap past
+#              midnight, e.g. [22, 6]); a list for in; or
+#              {"field": "amount_mean_7d", "times": 4, "plus": 0} to compare
+#              with another field of the same row
+#
+# The file is re-read when its mtime changes, checked at most every
+# RULES_CHECK_SECONDS, so rules change without a restart. A file that fails to
+# parse or validate is rejected, and the previous rules stay in force.
+
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app import metrics
+from ml import model
+
+RULES_PATH = os.getenv("RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+RULES_CHECK_SECONDS = float(os.getenv("RULES_CHECK_SECONDS", "2"))
+
+ACTIONS = ("flag", "allow")
+FIELDS = frozenset(("amount", "hour", *model.FEATURES))
+_COMPARISONS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal,
+                "==": np.equal, "!=": np.not_equal}
+
+Columns = Dict[str, np.ndarray]
+Mask = Callable[[Columns], np.ndarray]
+
+
+@dataclass(frozen=True)
+class Rule:
+    name: str
+    action: str
+    explanation: str
+    fields: FrozenSet[str]
+    mask: Mask
+
+
+class Decisions(NamedTuple):
+    rule: np.ndarray         # name of the deciding rule; None where no rule matched
+    is_fraud: np.ndarray     # 1 for flagged rows, else 0
+    explanation: np.ndarray  # the deciding rule's explanation; None where no rule matched
+
+    @property
+    def decided(self) -> np.ndarray:
+        return pd.notna(self.rule)
+
+
+# --- Compilation ---
+def _field(name: Any, rule: str) -> str:
+    if name not in FIELDS:
+        raise ValueError(f"Rule '{rule}': unknown field {name!r}; expected one of {sorted(FIELDS)}.")
+    return name
+
+
+def _condition(spec: Dict[str, Any], rule: str) -> Tuple[Mask, FrozenSet[str]]:
+    field, op, value = _field(spec.get("field"), rule), spec.get("op"), spec.get("value")
+    if op in _COMPARISONS:
+        compare = _COMPARISONS[op]
+        if isinstance(value, dict):
+            other = _field(value.get("field"), rule)
+            times, plus = float(value.get("times", 1)), float(value.get("plus", 0))
+            return (lambda cols: compare(cols[field], cols[other] * times + plus)), frozenset((field, other))
+        number = float(value)
+        return (lambda cols: compare(cols[field], number)), frozenset((field,))
+    if op == "between":
+        low, high = (float(v) for v in value)
+        if low <= high:
+            return (lambda cols: (cols[field] >= low) & (cols[field] <= high)), frozenset((field,))
+        if field != "hour":
+            raise ValueError(f"Rule '{rule}': between needs low <= high for {field}.")
+        return (lambda cols: (cols[field] >= low) | (cols[field] <= high)), frozenset((field,))
+    if op == "in":
+        values = np.array([float(v) for v in value])
+        return (lambda cols: np.isin(cols[field], values)), frozenset((field,))
+    raise ValueError(f"Rule '{rule}': unknown operator {op!r}.")
+
+
+def compile_rule(spec: Dict[str, Any]) -> Rule:
+    name = spec.get("name")
+    if not name:
+        raise ValueError("Every rule needs a name.")
+    if spec.get("action", "flag") not in ACTIONS:
+        raise ValueError(f"Rule '{name}': action must be one of {ACTIONS}.")
+    conditions = spec.get("conditions") or []
+    if not conditions:
+        raise ValueError(f"Rule '{name}' has no conditions.")
+    try:
+        compiled = [_condition(c, name) for c in conditions]
+    except (TypeError, ValueError) as e:
+        raise ValueError(str(e) if str(e).startswith("Rule ") else f"Rule '{name}': {e}") from e
+    masks = [mask for mask, _ in compiled]
+
+    def mask(cols: Columns) -> np.ndarray:
+        result = masks[0](cols)
+        for m in masks[1:]:
+            result = result & m(cols)
+        return result
+
+    return Rule(
+        name=name, action=spec.get("action", "flag"), explanation=spec.get("explanation") or f"Matched rule '{name}'.",
+        fields=frozenset().union(*(fields for _, fields in compiled)), mask=mask,
+    )
+
+
+class RuleSet:
+    """Compiled, enabled rules in order. Immutable; a reload builds a new one."""
+
+    def __init__(self, specs: List[Dict[str, Any]], source: Optional[str] = None):
+        names = [spec.get("name") for spec in specs]
+        duplicates = {n for n in names if names.count(n) > 1}
+        if duplicates:
+            raise ValueError(f"Duplicate rule names: {sorted(duplicates)}")
+        self.specs = specs
+        # Disabled rules are validated too, so enabling one later cannot be what breaks the file.
+        compiled = [compile_rule(spec) for spec in specs]
+        self.rules = [rule for rule, spec in zip(compiled, specs) if spec.get("enabled", True)]
+        self.fields = frozenset().union(*(rule.fields for rule in self.rules))
+        self.source = source
+        self.loaded_at = datetime.datetime.utcnow()
+
+    @classmethod
+    def load(cls, path: str) -> "RuleSet":
+        with open(path) as f:
+            config = json.load(f)
+        if not isinstance(config, dict) or not isinstance(config.get("rules"), list):
+            raise ValueError(f"{path} must hold an object with a 'rules' list.")
+        return cls(config["rules"], source=path)
+
+    def _columns(self, df: pd.DataFrame) -> Columns:
+        cols: Columns = {}
+        for name in self.fields:
+            if name == "hour":
+                ts = pd.to_datetime(df["timestamp"])
+                cols[name] = (ts.dt.hour + ts.dt.minute / 60).to_numpy(dtype=np.float64)
+            else:
+                cols[name] = df[name].to_numpy(dtype=np.float64)
+        return cols
+
+    def apply(self, df: pd.DataFrame) -> Decisions:
+        """Decides the rows any rule matches. `df` needs amount, timestamp and the features the rules use."""
+        n = len(df)
+        rule = np.full(n, None, dtype=object)
+        is_fraud = np.zeros(n, dtype=np.int8)
+        explanation = np.full(n, None, dtype=object)
+        if not self.rules or n == 0:
+            return Decisions(rule, is_fraud, explanation)
+        cols = self._columns(df)
+        undecided = np.ones(n, dtype=bool)
+        for r in self.rules:
+            started = time.perf_counter()
+            hit = r.mask(cols) & undecided
+            hits = int(hit.sum())
+            if hits:
+                rule[hit] = r.name
+                explanation[hit] = r.explanation
+                if r.action == "flag":
+                    is_fraud[hit] = 1
+                undecided &= ~hit
+            metrics.rule_seconds.observe(time.perf_counter() - started, rule=r.name)
+            metrics.rule_hits.inc(hits, rule=r.name, action=r.action)
+            if not undecided.any():
+                break
+        return Decisions(rule, is_fraud, explanation)
+
+    def describe(self) -> List[Dict[str, Any]]:
+        """Each configured rule with its hit count and evaluation time in this process."""
+        return [
+            {
+                **spec,
+                "enabled": spec.get("enabled", True),
+                "hits": int(metrics.rule_hits.value(rule=spec["name"], action=spec.get("action", "flag"))),
+                "evaluations": metrics.rule_seconds.count(rule=spec["name"]),
+                "seconds": round(metrics.rule_seconds.total(rule=spec["name"]), 6),
+            }
+            for spec in self.specs
+        ]
+
+
+# --- Hot reload ---
+class RuleEngine:
+    def __init__(self, path: str = RULES_PATH, check_seconds: float = RULES_CHECK_SECONDS):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._rules = RuleSet([])
+        self._mtime: Optional[int] = None
+        self._checked: Optional[float] = None
+
+    def current(self) -> RuleSet:
+        """The rule set in force, re-read first if the file changed. Hold on to it for a whole chunk."""
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= self.check_seconds:
+            self._refresh()
+        return self._rules
+
+    def reload(self) -> RuleSet:
+        """Re-reads the file now. Raises ValueError (and keeps the previous rules) if it is invalid."""
+        self._refresh(force=True)
+        if self.error:
+            raise ValueError(self.error)
+        return self._rules
+
+    def _refresh(self, force: bool = False) -> None:
+        with self._lock:
+            self._checked = time.monotonic()
+            try:
+                mtime: Optional[int] = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self._mtime and not force:
+                return
+            self._mtime = mtime
+            if mtime is None:
+                logging.warning(f"⚠️ No rules file at {self.path}; every row goes to the model.")
+                self._rules, self.error = RuleSet([]), None
+                return
+            try:
+                rules = RuleSet.load(self.path)
+            except (OSError, ValueError) as e:
+                # json.JSONDecodeError is a ValueError too.
+                self.error = f"{self.path}: {e}"
+                logging.error(f"❌ Rules not reloaded, keeping the previous {len(self._rules.rules)}: {self.error}")
+                return
+            self._rules, self.error = rules, None
+            logging.info(f"📏 Loaded {len(rules.rules)} rules from {self.path}")
+
+    def status(self) -> Dict[str, Any]:
+        rules = self.current()
+        return {"path": self.path, "loaded_at": rules.loaded_at, "error": self.error, "rules": rules.describe()}
+
+
+engine = RuleEngine()
@@ -0,0 +1,167 @@
+# scoring.py
+# Synchronous, in-line scoring for /score. Concurrent requests are coalesced by
+# an asyncio micro-batcher into one vectorized model.predict call per batch.
+# The rule set (app/rules.py) decides rows first, as in detection.
+#
+# Window features use the card history detection has built up in
+# model.feature_store, without extending it. A card the store has not seen
+# (after a restart, /transactions/clear, or before detection reached it) is
+# seeded from every stored row of the card instead, in a private store, so its
+# features match what detection would compute. Each decision carries the time
+# the row was scored, and persisted rows are stored with that timestamp.
+
+import os
+import asyncio
+import datetime
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from app import database, metrics, rules, security
+from ml import features, model
+from ml.registry import ModelHandle
+
+SCORE_MAX_BATCH = int(os.getenv("SCORE_MAX_BATCH", "256"))
+SCORE_MAX_WAIT_MS = float(os.getenv("SCORE_MAX_WAIT_MS", "2"))
+# Small batches are dominated by sklearn's per-call validation; the compiled arrays skip it.
+SCORE_BACKEND = os.getenv("SCORE_BACKEND", "compiled")
+
+ML_EXPLANATION = "Flagged by ML anomaly detection."
+LEGIT_EXPLANATION = "Transaction appears legitimate."
+
+
+def score_frame(df: pd.DataFrame, model_name: str, handle: Optional[ModelHandle] = None,
+                db: Optional[Session] = None) -> pd.DataFrame:
+    """Applies the rules, then the model to the rows no rule decided. Needs card_token, timestamp, amount.
+
+    With `db`, cards model.feature_store has not seen are seeded from the database; without it they start empty.
+    """
+    tokens = [t for t in pd.unique(df["card_token"].dropna()) if t]
+    if db is None or not model.feature_store.missing(tokens):
+        return decide(model.add_features(df, store=model.feature_store, update=False), model_name, handle)
+    # The shared store's history for the cards it has, the rest loaded into this private copy only:
+    # the shared store must keep matching what detection has scored.
+    store = features.CardStateStore()
+    store.replace(*model.feature_store.history(tokens))
+    t = database.Transaction.__table__
+    next_id = (db.execute(sqlalchemy.select(sqlalchemy.func.max(t.c.id))).scalar() or 0) + 1
+    return decide(model.add_features(df, db=db, store=store, update=False, before_id=next_id), model_name, handle)
+
+
+def decide(df: pd.DataFrame, model_name: str, handle: Optional[ModelHandle] = None, path: str = "score") -> pd.DataFrame:
+    """score_frame() for a frame that already has its features; `path` labels the metrics."""
+    decisions = rules.engine.current().apply(df)
+    decided = decisions.decided
+    is_fraud = decisions.is_fraud.astype(int)
+    by_rule = int(is_fraud.sum())
+    explanation = np.where(decided, decisions.explanation, LEGIT_EXPLANATION).astype(object)
+    if not decided.all():
+        rest = np.flatnonzero(~decided)
+        with metrics.predict_seconds.time(path=path, model=model_name):
+            predictions = model.predict(df.iloc[rest], model_name=model_name, backend=SCORE_BACKEND, handle=handle)
+        ml_fraud = rest[predictions.to_numpy() == 1]
+        is_fraud[ml_fraud] = 1
+        explanation[ml_fraud] = ML_EXPLANATION
+    metrics.rows_scored.inc(len(df), path=path, model=model_name)
+    metrics.rows_flagged.inc(by_rule, path=path, model=model_name, source="rule")
+    metrics.rows_flagged.inc(int(is_fraud.sum()) - by_rule, path=path, model=model_name, source="model")
+    return df.assign(is_fraud=is_fraud, explanation=explanation, rule=decisions.rule)
+
+
+class MicroBatcher:
+    """Collects score requests for up to `max_wait_ms` (or `max_batch` rows) and scores them together."""
+
+    def __init__(self, max_batch: int = SCORE_MAX_BATCH, max_wait_ms: float = SCORE_MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(self, transactions: List[Dict[str, Any]], model_name: str) -> List[Dict[str, Any]]:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((transactions, model_name, future))
+        return await future
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            rows = len(pending[0][0])
+            deadline = loop.time() + self.max_wait
+            while rows < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                rows += len(item[0])
+
+            by_model: Dict[str, List[Tuple[List[Dict[str, Any]], asyncio.Future]]] = {}
+            for transactions, model_name, future in pending:
+                by_model.setdefault(model_name, []).append((transactions, future))
+            for model_name, requests in by_model.items():
+                try:
+                    results = await loop.run_in_executor(None, self._score, model_name, [r[0] for r in requests])
+                except Exception as e:
+                    logging.error(f"Scoring batch failed: {e}")
+                    for _, future in requests:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), result in zip(requests, results):
+                    if not future.done():
+                        future.set_result(result)
+
+    @staticmethod
+    def _score(model_name: str, requests: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+        flat = [tx for txs in requests for tx in txs]
+        now = datetime.datetime.utcnow()
+        df = pd.DataFrame({
+            "card_token": [security.card_token(tx["card_number"]) for tx in flat],
+            "timestamp": [now] * len(flat),
+            "amount": [tx["amount"] for tx in flat],
+        })
+        db = database.SessionLocal()
+        try:
+            # One version per batch; a promotion takes effect from the next batch.
+            scored = score_frame(df, model_name, model.get_handle(model_name), db=db)
+        finally:
+            db.close()
+        decisions = [
+            {"is_fraud": int(f), "explanation": e, "rule": r, "timestamp": now}
+            for f, e, r in zip(scored["is_fraud"].tolist(), scored["explanation"].tolist(), scored["rule"].tolist())
+        ]
+        results, start = [], 0
+        for txs in requests:
+            results.append(decisions[start:start + len(txs)])
+            start += len(txs)
+        return results
+
+
+batcher = MicroBatcher()
+
+
+async def score(transactions: List[Dict[str, Any]], model_name: str) -> Dict[str, Any]:
+    started = time.perf_counter()
+    decisions = await batcher.submit(transactions, model_name)
+    return {
+        "model_name": model_name,
+        "decisions": decisions,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
@@ -1,6 +1,17 @@
 # security.py
 
+import os
 import re
+import hmac
+import time
+import hashlib
+import secrets
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
 from cryptography.fernet import Fernet
 from passlib.context import CryptContext
 from jose import JWTError, jwt
@@ -8,6 +19,8 @@ from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from pydantic import BaseModel
 
+from app import database, metrics
+
 # --- Encryption/Decryption ---
 ENCRYPTION_KEY = b'qO9ZINaZA0SgA_f6pPqJb2e7FmN8cVd1uUa4gHk9l_I='  # must stay constant
 cipher_suite = Fernet(ENCRYPTION_KEY)
@@ -15,16 +28,69 @@ cipher_suite = Fernet(ENCRYPTION_KEY)
 def encrypt_data(data: str) -> str:
     if not data:
         return ""
-    return cipher_suite.encrypt(data.encode()).decode()
+    started = time.perf_counter()
+    encrypted = cipher_suite.encrypt(data.encode()).decode()
+    metrics.fernet_seconds.observe(time.perf_counter() - started, op="encrypt")
+    return encrypted
+
+def _encrypt_slice(values: List[str]) -> List[str]:
+    return [encrypt_data(v) for v in values]
+
+# Fernet holds the GIL, so bulk encryption fans out to worker processes.
+ENCRYPT_WORKERS = int(os.getenv("ENCRYPT_WORKERS", os.cpu_count() or 1))
+ENCRYPT_PARALLEL_MIN_ROWS = 5000
+_encrypt_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_encrypt_pool() -> ProcessPoolExecutor:
+    global _encrypt_pool
+    if _encrypt_pool is None:
+        # spawn, as for detection and training: a fork could copy a lock (such as a metric's) another thread holds.
+        _encrypt_pool = ProcessPoolExecutor(max_workers=ENCRYPT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _encrypt_pool
+
+def encrypt_many(values: List[str]) -> List[str]:
+    """Encrypt a list of values, spreading large lists across the worker pool."""
+    with metrics.fernet_seconds.time(op="encrypt_batch"):
+        if ENCRYPT_WORKERS <= 1 or len(values) < ENCRYPT_PARALLEL_MIN_ROWS:
+            return _encrypt_slice(values)
+        step = -(-len(values) // ENCRYPT_WORKERS)
+        slices = [values[i:i + step] for i in range(0, len(values), step)]
+        encrypted: List[str] = []
+        for part in _get_encrypt_pool().map(_encrypt_slice, slices):
+            encrypted.extend(part)
+        return encrypted
+
+def shutdown_encrypt_pool() -> None:
+    global _encrypt_pool
+    if _encrypt_pool is not None:
+        _encrypt_pool.shutdown(wait=False, cancel_futures=True)
+        _encrypt_pool = None
 
 def decrypt_data(encrypted_data: str) -> str:
     """Decrypt safely. Fallback to last 4 of encrypted string if key mismatch."""
     if not encrypted_data:
         return ""
+    started = time.perf_counter()
     try:
         return cipher_suite.decrypt(encrypted_data.encode()).decode()
     except Exception:
         return f"****{encrypted_data[-4:]}" if len(encrypted_data) >= 4 else "****"
+    finally:
+        metrics.fernet_seconds.observe(time.perf_counter() - started, op="decrypt")
+
+# --- Card tokens ---
+# Fernet output is randomized, so the ciphertext cannot be indexed or compared.
+# The token is a keyed hash of the normalized PAN, stable across rows.
+CARD_TOKEN_KEY = os.getenv("CARD_TOKEN_KEY", "fraud_detector_card_token_key").encode()  # must stay constant
+
+def card_token(card_number: str) -> str:
+    """HMAC-SHA256 of the card's digits, hex encoded. Empty if there are no digits."""
+    digits = re.sub(r'\D', '', card_number or "")
+    if not digits:
+        return ""
+    return hmac.new(CARD_TOKEN_KEY, digits.encode(), hashlib.sha256).hexdigest()
+
+UNREADABLE_CARD = "**** **** **** ????"
 
 def mask_card_number(card_number: str) -> str:
     """Mask card numbers, showing only last 4 digits."""
@@ -40,6 +106,15 @@ def mask_card_number(card_number: str) -> str:
     groups = [masked[i:i+4] for i in range(0, len(masked), 4)]
     return ' '.join(groups)
 
+def stored_masked_card(card_masked: str, card_number_encrypted: str) -> str:
+    """The stored masked card; decrypts only for rows ingested before card_masked existed and not yet backfilled."""
+    if card_masked is not None:
+        return card_masked
+    try:
+        return mask_card_number(decrypt_data(card_number_encrypted))
+    except Exception:
+        return UNREADABLE_CARD
+
 # --- Passwords + JWT ---
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -64,3 +139,106 @@ def create_access_token(data: dict):
 
 class TokenData(BaseModel):
     username: str | None = None
+
+# --- Stream tickets ---
+# EventSource cannot send an Authorization header, and a bearer token in a URL
+# ends up in access logs. A stream URL instead carries a ticket that expires
+# after STREAM_TICKET_SECONDS and is consumed by its first use. Tickets live in
+# the database, so any API process can redeem one another process issued.
+STREAM_TICKET_SECONDS = float(os.getenv("STREAM_TICKET_SECONDS", "30"))
+
+def _ticket_id(ticket: str) -> str:
+    return hashlib.sha256(ticket.encode()).hexdigest()
+
+def issue_stream_ticket(username: str) -> str:
+    ticket = secrets.token_urlsafe(32)
+    table = database.StreamTicket.__table__
+    now = datetime.utcnow()
+    with database.engine.begin() as conn:
+        conn.execute(table.delete().where(table.c.expires_at <= now))
+        conn.execute(table.insert().values(id=_ticket_id(ticket), username=username,
+                                           expires_at=now + timedelta(seconds=STREAM_TICKET_SECONDS)))
+    return ticket
+
+def redeem_stream_ticket(ticket: str) -> Optional[str]:
+    """The ticket's username, consuming it; None if it is unknown, expired or already used."""
+    table = database.StreamTicket.__table__
+    ticket_id = _ticket_id(ticket)
+    now = datetime.utcnow()
+    with database.engine.begin() as conn:
+        username = conn.execute(
+            table.select().with_only_columns(table.c.username).where(table.c.id == ticket_id, table.c.expires_at > now)
+        ).scalar()
+        # Of two concurrent redemptions, only the one whose DELETE removes the row gets in.
+        if username is None or conn.execute(table.delete().where(table.c.id == ticket_id)).rowcount != 1:
+            return None
+    return username
+
+# --- Verified principal cache ---
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+class PrincipalCache:
+    """token -> username for tokens already decoded and checked against the users table.
+
+    Entries expire after `ttl` seconds or at the token's own exp, whichever is
+    first; the least recently used entry is evicted past `max_entries`.
+    invalidate_user() drops every token of a user that changed.
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL_SECONDS, max_entries: int = AUTH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._tokens_by_user: Dict[str, Set[str]] = {}
+
+    def get(self, token: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            username, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._drop(token)
+                return None
+            self._entries.move_to_end(token)
+            return username
+
+    def put(self, token: str, username: str, token_exp: Optional[float] = None) -> None:
+        """`token_exp` is the JWT exp claim (epoch seconds)."""
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        lifetime = self.ttl if token_exp is None else min(self.ttl, token_exp - time.time())
+        if lifetime <= 0:
+            return
+        with self._lock:
+            self._drop(token)
+            self._entries[token] = (username, time.monotonic() + lifetime)
+            self._tokens_by_user.setdefault(username, set()).add(token)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_user(self, username: str) -> None:
+        with self._lock:
+            for token in list(self._tokens_by_user.get(username, ())):
+                self._drop(token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._tokens_by_user.get(entry[0])
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._tokens_by_user[entry[0]]
+
+principal_cache = PrincipalCache()
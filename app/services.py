@@ -1,83 +1,261 @@
 # services.py (Corrected)
 
-import httpx
-import asyncio
-from typing import Any, Dict, List
+import os
+import io
+import csv
+import json
+import math
+import time
+import base64
+import datetime
+from typing import Any, Callable, Dict, List, Optional
+import sqlalchemy
 from sqlalchemy.orm import Session
-from . import database, security
-
-# --- Gemini API Config ---
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent"
-GEMINI_API_KEY = "YOUR_GEMINI_API_KEY_HERE"
-USE_GEMINI = False # Set to True after adding your API key
-
-async def get_fraud_explanation_async(client: httpx.AsyncClient, transaction_details: Dict[str, Any]) -> str:
-    """Asynchronously gets a single fraud explanation."""
-    if not USE_GEMINI or not GEMINI_API_KEY:
-        return f"ML Anomaly Detection: Transaction of ${transaction_details.get('amount', 0):.2f} flagged for review."
-    
+from . import counters, database, metrics, security
+
+# --- Bulk ingest config ---
+INGEST_COMMIT_SIZE = int(os.getenv("INGEST_COMMIT_SIZE", "20000"))
+
+def insert_transactions(db: Session, transactions: List[Dict[str, Any]]) -> List[int]:
+    """Encrypts and inserts one chunk with a single Core executemany. Caller commits.
+
+    Rows are unprocessed (is_fraud = -1) unless they carry their own is_fraud/explanation, and are
+    timestamped now unless they carry a timestamp (as rows scored by /score do).
+    """
+    if not transactions:
+        return []
+    table = database.Transaction.__table__
+    encrypted = security.encrypt_many([tx["card_number"] for tx in transactions])
+    now = datetime.datetime.utcnow()
+    params = [
+        {
+            "card_number_encrypted": enc,
+            "card_token": security.card_token(tx["card_number"]),
+            "card_masked": security.mask_card_number(tx["card_number"]),
+            "amount": tx["amount"],
+            "is_fraud": tx.get("is_fraud", -1),
+            "explanation": tx.get("explanation"),
+            "timestamp": tx.get("timestamp") or now,
+        }
+        for enc, tx in zip(encrypted, transactions)
+    ]
+    ids = db.execute(table.insert().returning(table.c.id), params).scalars().all()
+    counters.record_inserted(db, [p["is_fraud"] for p in params])
+    metrics.rows_ingested.inc(len(ids))
+    return ids
+
+def bulk_ingest_transactions(db: Session, transactions: List[Dict[str, Any]], commit_size: int = INGEST_COMMIT_SIZE,
+                             on_commit: Optional[Callable[[List[int]], None]] = None) -> Dict[str, Any]:
+    """Encrypts and inserts transactions with Core executemany, committing every `commit_size` rows.
+
+    `on_commit` is called with each chunk's new ids once they are committed.
+    """
+    started = time.perf_counter()
+    first_id = last_id = None
+
+    for start in range(0, len(transactions), commit_size):
+        ids = insert_transactions(db, transactions[start:start + commit_size])
+        db.commit()
+        if on_commit is not None:
+            on_commit(ids)
+        if ids:
+            first_id = min(ids) if first_id is None else min(first_id, min(ids))
+            last_id = max(ids) if last_id is None else max(last_id, max(ids))
+
+    elapsed = time.perf_counter() - started
+    return {
+        "ingested": len(transactions),
+        "first_id": first_id,
+        "last_id": last_id,
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "rows_per_sec": round(len(transactions) / elapsed, 1) if elapsed > 0 else None,
+    }
+
+# --- Streaming CSV ingest ---
+CARD_COLUMNS = ("card_number", "CardNumber", "card")
+AMOUNT_COLUMNS = ("amount", "Amount", "transaction_amount", "value")
+
+class UploadConflict(Exception):
+    """Another request moved the upload's committed offset (or completed it) first."""
+
+class CsvStreamIngestor:
+    """Parses CSV bytes as they arrive and writes them in fixed-size chunks.
+
+    `upload.bytes_committed` only ever advances past complete records, and it is
+    committed in the same transaction as the rows those records produced, so a
+    client that loses its connection can resume from the stored offset without
+    duplicating or dropping rows. The offset is advanced with a compare-and-set
+    on its previous value: if a concurrent request (say a retry racing a slow
+    PUT) committed first, the chunk is rolled back and UploadConflict raised.
+    Records end at newlines outside quoted fields, so a quoted value may span
+    lines. Memory is bounded by `flush_rows` plus one partial record.
+    """
+
+    def __init__(self, db: Session, upload: database.IngestUpload, flush_rows: int = INGEST_COMMIT_SIZE):
+        self.db = db
+        self.upload = upload
+        self.flush_rows = flush_rows
+        self.header: Optional[List[str]] = json.loads(upload.header) if upload.header else None
+        self._offset = upload.bytes_committed
+        self._tail = b""
+        self._scanned = 0  # bytes of _tail already searched for newlines
+        self._quoted = False  # whether _tail[:_scanned] ends inside a quoted field
+        self._pending: List[Dict[str, Any]] = []
+        self._pending_bytes = 0
+        self._pending_skipped = 0
+
+    def feed(self, data: bytes) -> bool:
+        """Consumes a piece of the body. Returns True when a chunk is ready to flush."""
+        buf = self._tail + data
+        start, pos, quoted = 0, self._scanned, self._quoted
+        while True:
+            end = buf.find(b"\n", pos)
+            if end == -1:
+                break
+            # An escaped quote ("") flips the state twice, so odd counts are all that matter.
+            quoted ^= buf.count(b'"', pos, end) % 2 == 1
+            pos = end + 1
+            if quoted:
+                continue
+            self._consume_record(buf[start:end])
+            self._pending_bytes += end + 1 - start
+            start = end + 1
+        self._tail = buf[start:]
+        self._scanned = pos - start
+        self._quoted = quoted
+        return len(self._pending) >= self.flush_rows
+
+    def finish(self, final: bool) -> None:
+        """Flushes what is pending; on the final piece the unterminated last record counts too."""
+        if final and self._tail:
+            self._consume_record(self._tail)
+            self._pending_bytes += len(self._tail)
+            self._tail, self._scanned, self._quoted = b"", 0, False
+        self.flush(complete=final)
+
+    def flush(self, complete: bool = False) -> None:
+        """Commits the pending rows and advances the offset; `complete` also closes the upload."""
+        if not self._pending_bytes and not complete:
+            return
+        insert_transactions(self.db, self._pending)
+        table = database.IngestUpload.__table__
+        values: Dict[str, Any] = {
+            "bytes_committed": self._offset + self._pending_bytes,
+            "rows_ingested": table.c.rows_ingested + len(self._pending),
+            "rows_skipped": table.c.rows_skipped + self._pending_skipped,
+            "header": json.dumps(self.header) if self.header else None,
+        }
+        if complete:
+            values["status"] = "completed"
+        updated = self.db.execute(
+            table.update()
+            .where(table.c.id == self.upload.id, table.c.bytes_committed == self._offset, table.c.status == "open")
+            .values(**values)
+        ).rowcount
+        if updated != 1:
+            self.db.rollback()
+            raise UploadConflict("The upload was advanced by another request.")
+        self.db.commit()
+        self._offset += self._pending_bytes
+        self._pending = []
+        self._pending_bytes = 0
+        self._pending_skipped = 0
+
+    def _consume_record(self, raw: bytes) -> None:
+        text = raw.decode("utf-8-sig" if self.header is None else "utf-8", errors="replace").rstrip("\r")
+        if not text.strip():
+            return
+        try:
+            values = next(csv.reader(io.StringIO(text, newline="")))
+        except csv.Error:
+            self._pending_skipped += 1
+            return
+        if self.header is None:
+            self.header = [v.strip() for v in values]
+            return
+        row = dict(zip(self.header, values))
+        card = next((row[c].strip() for c in CARD_COLUMNS if row.get(c)), "")
+        try:
+            amount = float(next((row[c] for c in AMOUNT_COLUMNS if row.get(c)), 0))
+        except ValueError:
+            amount = float("nan")
+        if not card or math.isnan(amount):
+            self._pending_skipped += 1
+            return
+        self._pending.append({"card_number": card, "amount": amount})
+
+def get_card_transactions(db: Session, card_number: str, limit: int):
+    """All transactions for one card, newest first, via the card_token index."""
+    token = security.card_token(card_number)
+    if not token:
+        return []
+    transactions = (
+        db.query(database.Transaction)
+        .filter(database.Transaction.card_token == token)
+        .order_by(database.Transaction.id.desc())
+        .limit(limit)
+        .all()
+    )
+    masked_card = security.mask_card_number(card_number)
+    return [
+        {
+            "id": tx.id,
+            "masked_card_number": masked_card,
+            "amount": tx.amount,
+            "timestamp": tx.timestamp.isoformat() if tx.timestamp else None,
+            "is_fraud": tx.is_fraud,
+            "explanation": tx.explanation,
+        }
+        for tx in transactions
+    ]
+
+def encode_cursor(timestamp: datetime.datetime, row_id: int) -> str:
+    """Opaque keyset cursor for pages ordered by (timestamp, id) descending."""
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{row_id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    """(timestamp, id) of the last row on the previous page. Raises ValueError if malformed."""
     try:
-        prompt = (
-            "Explain in simple terms why this credit card transaction might be fraudulent. Be concise. "
-            f"Amount=${transaction_details.get('amount')}, Timestamp='{transaction_details.get('timestamp')}'"
-        )
-        headers = {"Content-Type": "application/json"}
-        params = {"key": GEMINI_API_KEY}
-        payload = {"contents": [{"parts": [{"text": prompt}]}]}
-        
-        resp = await client.post(GEMINI_API_URL, headers=headers, params=params, json=payload, timeout=25)
-        resp.raise_for_status() # Raises an exception for 4xx/5xx responses
-        
-        data = resp.json()
-        return data.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "No explanation provided.").strip()
-
-    except httpx.RequestError as e:
-        return f"Gemini API request failed: {e}"
-    except Exception as e:
-        return f"Gemini unavailable or error processing response: {str(e)}"
-
-async def get_fraud_explanation_batch_async(transaction_details_list: List[Dict[str, Any]]) -> List[str]:
-    """Asynchronously fetches explanations for a batch of transactions."""
-    async with httpx.AsyncClient() as client:
-        tasks = [get_fraud_explanation_async(client, details) for details in transaction_details_list]
-        explanations = await asyncio.gather(*tasks, return_exceptions=True)
-        # Handle cases where an exception was returned by gather
-        return [str(exp) if isinstance(exp, Exception) else exp for exp in explanations]
-
-def get_fraud_report_chunk(db: Session, page: int, page_size: int):
-    """Fetches a paginated report of ONLY fraudulent transactions."""
-    offset = (page - 1) * page_size
-    
-    # Corrected Query: Filter for is_fraud == 1
-    query = db.query(database.Transaction).filter(database.Transaction.is_fraud == 1)
-    
-    total_fraudulent = query.count()
-    total_transactions = db.query(database.Transaction).count()
-    
-    transactions = query.order_by(database.Transaction.timestamp.desc()).offset(offset).limit(page_size).all()
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(timestamp), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+def get_fraud_report_chunk(db: Session, page: int, page_size: int, cursor: Optional[str] = None):
+    """Fetches a page of ONLY fraudulent transactions, newest first.
+
+    With `cursor` (the previous page's next_cursor) the page is a keyset seek on
+    the (is_fraud, timestamp, id) index, so every page costs the same. Without it,
+    `page` falls back to OFFSET for old clients. The summary is read from the
+    counters table rather than counted.
+    """
+    t = database.Transaction
+    query = db.query(t).filter(t.is_fraud == 1).order_by(t.timestamp.desc(), t.id.desc())
+    if cursor:
+        after_ts, after_id = decode_cursor(cursor)
+        query = query.filter(sqlalchemy.tuple_(t.timestamp, t.id) < sqlalchemy.tuple_(after_ts, after_id))
+    else:
+        query = query.offset((page - 1) * page_size)
+    # One extra row tells whether there is a next page without counting.
+    transactions = query.limit(page_size + 1).all()
+    has_more = len(transactions) > page_size
+    transactions = transactions[:page_size]
 
     results = []
     for tx in transactions:
-        try:
-            decrypted_card = security.decrypt_data(tx.card_number_encrypted)
-            masked_card = security.mask_card_number(decrypted_card)
-        except Exception:
-            masked_card = "**** **** **** ????"
-
         results.append({
             "id": tx.id,
-            "masked_card_number": masked_card,
+            "masked_card_number": security.stored_masked_card(tx.card_masked, tx.card_number_encrypted),
             "amount": tx.amount,
             "timestamp": tx.timestamp.isoformat() if tx.timestamp else None,
             "explanation": tx.explanation or "Explanation not available",
         })
-    
-    # Build a summary object that the frontend can use
-    summary = {
-        "total_transactions": total_transactions,
-        "fraudulent": total_fraudulent,
-        "legit": total_transactions - total_fraudulent,
-        "fraud_percentage": round((total_fraudulent / total_transactions) * 100, 2) if total_transactions > 0 else 0
-    }
 
-    return {"summary": summary, "fraud_cases": results, "page": page, "page_size": page_size}
\ No newline at end of file
+    next_cursor = encode_cursor(transactions[-1].timestamp, transactions[-1].id) if has_more else None
+    return {
+        "summary": counters.summary(db),
+        "fraud_cases": results,
+        "page": page,
+        "page_size": page_size,
+        "next_cursor": next_cursor,
+    }
@@ -0,0 +1,309 @@
+# training_jobs.py
+# Model training as background jobs. start() records a training_jobs row and
+# spawns a separate process that runs ml/training.train() against the same
+# database and model directory, so the API stays responsive and a large fit
+# cannot take the API's memory with it. The worker writes its phase and row
+# counts to the row after every chunk; clients poll GET /model/jobs/{id}.
+#
+# One job per model at a time: a job is inserted together with a training_slots
+# row per model it trains, whose primary key is the model name, so of two
+# concurrent requests only one can commit. A job whose row has not been updated
+# for TRAIN_JOB_STALE_SECONDS (its process died without reporting) no longer
+# blocks a new one and is reported as an error; slots of finished jobs are freed.
+#
+# start_evaluation() runs ml/evaluation.evaluate_all() the same way, as a job
+# whose model_name is "all". Its per-model results go to model_evaluations as
+# each model finishes; best_evaluation() picks the fastest adequate one.
+
+import os
+import uuid
+import logging
+import datetime
+import threading
+import multiprocessing
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from app import database
+from ml import evaluation, model, training
+from ml.registry import ModelRegistry
+
+TRAIN_JOB_STALE_SECONDS = float(os.getenv("TRAIN_JOB_STALE_SECONDS", "600"))
+ACTIVE_STATUSES = ("queued", "running")
+
+# spawn, not fork: the API process has threads (audit writer, explanation worker) and open connections.
+_context = multiprocessing.get_context("spawn")
+_processes: Dict[str, multiprocessing.process.BaseProcess] = {}
+_lock = threading.Lock()
+
+
+def _as_dict(job: database.TrainingJob) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "model_name": job.model_name,
+        "incremental": bool(job.incremental),
+        "status": job.status,
+        "phase": job.phase,
+        "rows_read": job.rows_read,
+        "rows_total": job.rows_total,
+        "progress": round(job.rows_read / job.rows_total, 4) if job.rows_total else None,
+        "version": job.version,
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+    }
+
+
+def _update(job_id: str, **fields) -> None:
+    table = database.TrainingJob.__table__
+    with database.engine.begin() as conn:
+        conn.execute(table.update().where(table.c.id == job_id).values(updated_at=datetime.datetime.utcnow(), **fields))
+        if fields.get("status") not in (None, *ACTIVE_STATUSES):
+            _free_slots(conn)
+
+
+def _free_slots(conn) -> None:
+    """Drops the slots of jobs that are no longer active."""
+    slots, jobs = database.TrainingSlot.__table__, database.TrainingJob.__table__
+    active = sqlalchemy.select(jobs.c.id).where(jobs.c.status.in_(ACTIVE_STATUSES))
+    conn.execute(slots.delete().where(slots.c.job_id.not_in(active)))
+
+
+def _reap(db: Session) -> None:
+    """Marks jobs whose process has exited, or that went silent, without finishing as failed."""
+    with _lock:
+        for job_id, process in list(_processes.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            del _processes[job_id]
+            job = db.get(database.TrainingJob, job_id)
+            if job is not None and job.status in ACTIVE_STATUSES:
+                _update(job_id, status="error", error=f"Training process exited with code {process.exitcode}.",
+                        finished_at=datetime.datetime.utcnow())
+    stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=TRAIN_JOB_STALE_SECONDS)
+    table = database.TrainingJob.__table__
+    with database.engine.begin() as conn:
+        conn.execute(
+            table.update()
+            .where(table.c.status.in_(ACTIVE_STATUSES), table.c.updated_at < stale_before)
+            .values(status="error", error="Training process stopped reporting.", finished_at=datetime.datetime.utcnow())
+        )
+        _free_slots(conn)
+    db.expire_all()
+
+
+def active_job(db: Session, model_name: str) -> Optional[Dict[str, Any]]:
+    _reap(db)
+    job = (
+        db.query(database.TrainingJob)
+        .filter(database.TrainingJob.model_name == model_name, database.TrainingJob.status.in_(ACTIVE_STATUSES))
+        .first()
+    )
+    return _as_dict(job) if job else None
+
+
+def start(db: Session, model_name: str, username: str, incremental: bool = False) -> Optional[Dict[str, Any]]:
+    """Queues a job and starts its process; None if the model is already training."""
+    return _launch(db, model_name, [model_name], username, incremental, run_job, ())
+
+
+def start_evaluation(db: Session, username: str, cv_folds: int = 0) -> Optional[Dict[str, Any]]:
+    """Queues a train-and-evaluate-all job; None if one is already running, or any model is retraining."""
+    # It holds every model's slot too, so no model retrains (and promotes a version) while it is being evaluated.
+    # Not a daemon: a daemonic process may not start the evaluation's process pool. shutdown() stops it instead.
+    return _launch(db, evaluation.ALL_MODELS, [evaluation.ALL_MODELS, *model.AVAILABLE_MODELS], username, False,
+                   run_evaluation_job, (cv_folds,), daemon=False)
+
+
+def _claim(db: Session, job: database.TrainingJob, slots: List[str]) -> bool:
+    """Inserts the job with its slots in one transaction; False if another job holds one of them."""
+    _reap(db)
+    db.add(job)
+    db.flush()
+    try:
+        db.execute(database.TrainingSlot.__table__.insert(), [{"model_name": name, "job_id": job.id} for name in slots])
+        db.commit()
+    except sqlalchemy.exc.IntegrityError:
+        db.rollback()
+        return False
+    return True
+
+
+def _launch(db: Session, model_name: str, slots: List[str], username: str, incremental: bool, target: Callable,
+            extra: Tuple, daemon: bool = True) -> Optional[Dict[str, Any]]:
+    job = database.TrainingJob(id=uuid.uuid4().hex, model_name=model_name, incremental=incremental,
+                               username=username, status="queued")
+    if not _claim(db, job, slots):
+        return None
+    process = _context.Process(
+        target=target, args=(job.id, database.engine.url.render_as_string(hide_password=False), model.MODELS_DIR, *extra),
+        name=f"train-{model_name}", daemon=daemon,
+    )
+    try:
+        process.start()
+    except Exception as e:
+        _update(job.id, status="error", error=f"Could not start the training process: {e}", finished_at=datetime.datetime.utcnow())
+        raise
+    with _lock:
+        _processes[job.id] = process
+    _update(job.id, pid=process.pid)
+    db.refresh(job)
+    return _as_dict(job)
+
+
+def get(db: Session, job_id: str) -> Optional[Dict[str, Any]]:
+    _reap(db)
+    job = db.get(database.TrainingJob, job_id)
+    return _as_dict(job) if job else None
+
+
+def list_jobs(db: Session, limit: int = 20) -> List[Dict[str, Any]]:
+    _reap(db)
+    jobs = db.query(database.TrainingJob).order_by(database.TrainingJob.created_at.desc()).limit(limit).all()
+    return [_as_dict(job) for job in jobs]
+
+
+def wait(job_id: str, timeout: Optional[float] = None) -> None:
+    """Blocks until the job's process exits (benchmarks and scripts)."""
+    with _lock:
+        process = _processes.get(job_id)
+    if process is not None:
+        process.join(timeout)
+
+
+def shutdown(timeout: float = 5) -> None:
+    """Stops this process's running jobs (app shutdown) and marks them as failed."""
+    with _lock:
+        running = [(job_id, p) for job_id, p in _processes.items() if p.is_alive()]
+    for job_id, process in running:
+        process.terminate()
+        process.join(timeout)
+        _update(job_id, status="error", error="Stopped by API shutdown.", finished_at=datetime.datetime.utcnow())
+
+
+# --- Evaluations ---
+def _evaluation_dict(row: database.ModelEvaluation) -> Dict[str, Any]:
+    return {
+        "model_name": row.model_name,
+        "status": row.status,
+        "error": row.error,
+        "version": row.version,
+        "train_rows": row.train_rows,
+        "test_rows": row.test_rows,
+        "fit_seconds": row.fit_seconds,
+        "sklearn_rows_per_sec": row.sklearn_rows_per_sec,
+        "compiled_rows_per_sec": row.compiled_rows_per_sec,
+        "precision": row.precision,
+        "recall": row.recall,
+        "f1": row.f1,
+        "cv": row.cv,
+        "artifact_bytes": row.artifact_bytes,
+    }
+
+
+def _evaluation_job(db: Session, job_id: Optional[str]) -> Optional[database.TrainingJob]:
+    query = db.query(database.TrainingJob).filter(database.TrainingJob.model_name == evaluation.ALL_MODELS)
+    if job_id:
+        return query.filter(database.TrainingJob.id == job_id).first()
+    return query.order_by(database.TrainingJob.created_at.desc()).first()
+
+
+def evaluations(db: Session, job_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """An evaluation job (default: the latest) with the results recorded so far, or None."""
+    _reap(db)
+    job = _evaluation_job(db, job_id)
+    if job is None:
+        return None
+    rows = db.query(database.ModelEvaluation).filter(database.ModelEvaluation.job_id == job.id) \
+        .order_by(database.ModelEvaluation.id).all()
+    return {"job": _as_dict(job), "results": [_evaluation_dict(row) for row in rows]}
+
+
+def rows_per_sec(result: Dict[str, Any], backend: str) -> Optional[float]:
+    """Throughput with `backend`; "compiled" falls back to sklearn for models without a compiled form, like model.get_predictor."""
+    if backend == "compiled" and result["compiled_rows_per_sec"] is not None:
+        return result["compiled_rows_per_sec"]
+    return result["sklearn_rows_per_sec"]
+
+
+def best_evaluation(db: Session, min_precision: float, min_recall: float, backend: str,
+                    job_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """The fastest model meeting both thresholds in the latest completed evaluation (or `job_id`), or None."""
+    if job_id is None:
+        job = db.query(database.TrainingJob).filter(
+            database.TrainingJob.model_name == evaluation.ALL_MODELS, database.TrainingJob.status == "completed"
+        ).order_by(database.TrainingJob.created_at.desc()).first()
+        job_id = job.id if job else None
+    found = evaluations(db, job_id) if job_id else None
+    if found is None:
+        return None
+    adequate = [
+        r for r in found["results"]
+        if r["status"] == "ok" and r["precision"] >= min_precision and r["recall"] >= min_recall
+    ]
+    if not adequate:
+        return None
+    best = max(adequate, key=lambda r: rows_per_sec(r, backend))
+    return {**best, "job_id": found["job"]["job_id"], "backend": backend, "rows_per_sec": rows_per_sec(best, backend)}
+
+
+# --- Worker process ---
+def _attach(database_url: str, models_dir: str) -> None:
+    logging.basicConfig(level=logging.INFO)
+    # The parent may have been pointed elsewhere than the environment says (e.g. benchmarks' temp database).
+    if database_url != database.engine.url.render_as_string(hide_password=False):
+        database.engine = database.make_engine(database_url)
+        database.SessionLocal.configure(bind=database.engine)
+    if os.path.abspath(models_dir) != os.path.abspath(model.MODELS_DIR):
+        model.MODELS_DIR = models_dir
+        model.registry = ModelRegistry(models_dir)
+
+
+def run_job(job_id: str, database_url: str, models_dir: str) -> None:
+    _attach(database_url, models_dir)
+    db = database.SessionLocal()
+    try:
+        job = db.get(database.TrainingJob, job_id)
+        _update(job_id, status="running", pid=os.getpid())
+        handle = training.train(db, job.model_name, incremental=bool(job.incremental),
+                                progress=lambda **fields: _update(job_id, **fields))
+        _update(job_id, status="completed", phase=None, version=handle.version, finished_at=datetime.datetime.utcnow())
+    except Exception as e:
+        logging.error(f"❌ Training job {job_id} failed: {e}")
+        _update(job_id, status="error", error=str(e), finished_at=datetime.datetime.utcnow())
+    finally:
+        db.close()
+        database.engine.dispose()
+
+
+def run_evaluation_job(job_id: str, database_url: str, models_dir: str, cv_folds: int) -> None:
+    _attach(database_url, models_dir)
+
+    def record(result: Dict[str, Any]) -> None:
+        with database.engine.begin() as conn:
+            conn.execute(database.ModelEvaluation.__table__.insert().values(
+                job_id=job_id, created_at=datetime.datetime.utcnow(),
+                **{k: result.get(k) for k in _evaluation_columns},
+            ))
+
+    db = database.SessionLocal()
+    try:
+        _update(job_id, status="running", pid=os.getpid())
+        results = evaluation.evaluate_all(db, progress=lambda **fields: _update(job_id, **fields), on_result=record,
+                                          cv_folds=cv_folds)
+        if not any(r["status"] == "ok" for r in results):
+            raise RuntimeError("Every model failed; see the evaluation results.")
+        _update(job_id, status="completed", phase=None, finished_at=datetime.datetime.utcnow())
+    except Exception as e:
+        logging.error(f"❌ Evaluation job {job_id} failed: {e}")
+        _update(job_id, status="error", error=str(e), finished_at=datetime.datetime.utcnow())
+    finally:
+        db.close()
+        database.engine.dispose()
+
+
+_evaluation_columns = [c.name for c in database.ModelEvaluation.__table__.columns if c.name not in ("id", "job_id", "created_at")]
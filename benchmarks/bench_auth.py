@@ -0,0 +1,61 @@
+# bench_auth.py
+# Requests/sec and database queries per request on an authenticated endpoint
+# (/detection/progress), with and without the verified-principal cache.
+#   python -m benchmarks.bench_auth --requests 2000
+
+import argparse
+import json
+
+import sqlalchemy
+from fastapi.testclient import TestClient
+
+from app import database, security
+from benchmarks.common import Timer, temp_database
+
+
+def run(client: TestClient, headers: dict, requests: int) -> dict:
+    queries = {"count": 0}
+
+    def count(*args):
+        queries["count"] += 1
+
+    sqlalchemy.event.listen(database.engine, "before_cursor_execute", count)
+    try:
+        with Timer() as t:
+            for _ in range(requests):
+                client.get("/detection/progress", headers=headers).raise_for_status()
+    finally:
+        sqlalchemy.event.remove(database.engine, "before_cursor_execute", count)
+    return {
+        "requests_per_sec": round(requests / t.elapsed, 1),
+        "queries_per_request": round(queries["count"] / requests, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark token verification with and without the principal cache.")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    from app.main import app
+
+    results = {"requests": args.requests}
+    with temp_database(), TestClient(app) as client:
+        client.post("/users/", json={"username": "bench", "password": "bench"})
+        token = client.post("/token", data={"username": "bench", "password": "bench"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        ttl = security.principal_cache.ttl
+        security.principal_cache.ttl = 0
+        security.principal_cache.clear()
+        results["uncached"] = run(client, headers, args.requests)
+
+        security.principal_cache.ttl = ttl
+        results["cached"] = run(client, headers, args.requests)
+        results["speedup"] = round(results["cached"]["requests_per_sec"] / results["uncached"]["requests_per_sec"], 2)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
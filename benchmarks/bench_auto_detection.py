@@ -0,0 +1,104 @@
+# bench_auto_detection.py
+# Streaming detection under sustained ingest: --clients threads post
+# /ingest_batch/?bulk=true batches of --batch-rows rows as fast as they are
+# accepted, with auto-detection on. Reports the ingest rate, how often ingest
+# was held back or turned away by the queue, and the ingest-to-label latency
+# quantiles from the ingest_to_label_seconds histogram.
+#   python -m benchmarks.bench_auto_detection --rows 100000 --clients 4
+
+import argparse
+import json
+import os
+import threading
+import time
+from typing import Any, Dict
+
+from fastapi.testclient import TestClient
+
+from app import auto_detection, counters, metrics, services
+from app.main import app
+from benchmarks import synthetic
+from benchmarks.bench_e2e import detect, login, train
+from benchmarks.common import Timer, temp_database, temp_models_dir
+from ml import model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest-to-label latency with auto-detection on.")
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--seed-rows", type=int, default=10_000, help="Rows ingested and labeled first, to train on.")
+    parser.add_argument("--batch-rows", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--model", default="IsolationForest", choices=list(model.AVAILABLE_MODELS))
+    args = parser.parse_args()
+
+    with temp_database() as SessionLocal, temp_models_dir(), TestClient(app) as client:
+        headers = login(client)
+        frames = synthetic.batches(args.seed_rows + args.rows, batch_rows=args.batch_rows)
+        db = SessionLocal()
+        seeded = 0
+        while seeded < args.seed_rows:
+            frame = next(frames)
+            services.bulk_ingest_transactions(db, frame[["card_number", "amount"]].to_dict("records"))
+            seeded += len(frame)
+        db.close()
+        train(client, headers, "IsolationForest")
+        detect(client, headers, "IsolationForest", argparse.Namespace(chunk_size=5_000))
+        if args.model != "IsolationForest":
+            train(client, headers, args.model)
+        client.post("/detection/auto", json={"model_name": args.model}, headers=headers).raise_for_status()
+
+        lock = threading.Lock()
+        statuses: Dict[int, int] = {}
+
+        def post_batches():
+            while True:
+                with lock:
+                    frame = next(frames, None)
+                if frame is None:
+                    return
+                body = {"transactions": frame[["card_number", "amount"]].to_dict("records")}
+                while True:
+                    status = client.post("/ingest_batch/", params={"bulk": True}, json=body, headers=headers).status_code
+                    with lock:
+                        statuses[status] = statuses.get(status, 0) + 1
+                    if status != 503:
+                        break
+
+        threads = [threading.Thread(target=post_batches) for _ in range(args.clients)]
+        with Timer() as ingest_timer:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        auto_detection.detector.wait_idle()
+        drained = time.perf_counter() - ingest_timer.started
+
+        db = SessionLocal()
+        summary = counters.summary(db)
+        db.close()
+        latency = metrics.ingest_to_label_seconds
+        wait = metrics.auto_detect_wait_seconds
+        results: Dict[str, Any] = {
+            "rows": args.rows,
+            "batch_rows": args.batch_rows,
+            "clients": args.clients,
+            "model": args.model,
+            "cpus": os.cpu_count(),
+            "ingest_seconds": round(ingest_timer.elapsed, 3),
+            "ingest_rows_per_sec": round(args.rows / ingest_timer.elapsed, 1),
+            "all_labeled_seconds": round(drained, 3),
+            "unprocessed": summary["unprocessed"],
+            "responses": statuses,
+            "admit_wait_mean_ms": round(wait.total() / max(wait.count(), 1) * 1000, 3),
+            "ingest_to_label_seconds": {
+                "mean": round(latency.total(model=args.model) / max(latency.count(model=args.model), 1), 4),
+                **{f"p{int(q * 100)}_le": latency.quantile(q, model=args.model) for q in (0.5, 0.95, 0.99)},
+            },
+            "detector": auto_detection.detector.status(),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# bench_compiled.py
+# Parity and throughput of the compiled (array-based) predict backend vs. sklearn.
+# Exits non-zero if any model's compiled predictions differ from sklearn's.
+#   python -m benchmarks.bench_compiled --rows 200000
+
+import argparse
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+
+from benchmarks.common import Timer
+from ml import compiled, features, model
+
+
+def synthetic_features(n: int, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "card_token": rng.integers(0, max(n // 20, 1), n).astype(str),
+        "timestamp": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 30 * 86400, n)), unit="s"),
+        "amount": rng.lognormal(4, 1.2, n).round(2),
+    })
+    X = features.compute(df)
+    X["is_fraud"] = ((X["amount"] > X["amount_mean_7d"] * 3) | (X["txn_count_1h"] > 3)).astype(int)
+    return X
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compiled predict backend against sklearn.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--train-rows", type=int, default=20000)
+    parser.add_argument("--small-batch", type=int, default=8, help="Rows per call for the per-call latency check.")
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    train = synthetic_features(args.train_rows, seed=1)
+    X = synthetic_features(args.rows, seed=2)[model.FEATURES]
+    results, mismatched = {"rows": args.rows, "small_batch": args.small_batch}, False
+
+    for name, template in model.AVAILABLE_MODELS.items():
+        estimator = clone(template)
+        if name == "IsolationForest":
+            estimator.fit(train[model.FEATURES])
+        else:
+            estimator.fit(train[model.FEATURES], train["is_fraud"])
+        fast = compiled.compile_model(estimator)
+
+        with Timer() as t_sklearn:
+            expected = estimator.predict(X)
+        X_matrix = X.to_numpy(dtype=np.float32)
+        with Timer() as t_compiled:
+            actual = fast.predict(X_matrix)
+
+        small, small_matrix = X.iloc[:args.small_batch], X_matrix[:args.small_batch]
+        with Timer() as t_small_sklearn:
+            for _ in range(args.calls):
+                estimator.predict(small)
+        with Timer() as t_small_compiled:
+            for _ in range(args.calls):
+                fast.predict(small_matrix)
+
+        parity = bool(np.array_equal(expected, actual))
+        mismatched |= not parity
+        results[name] = {
+            "parity": parity,
+            "mismatches": int((expected != actual).sum()),
+            "sklearn_rows_per_sec": round(args.rows / t_sklearn.elapsed, 1),
+            "compiled_rows_per_sec": round(args.rows / t_compiled.elapsed, 1),
+            "speedup": round(t_sklearn.elapsed / t_compiled.elapsed, 2),
+            "sklearn_ms_per_small_call": round(t_small_sklearn.elapsed / args.calls * 1000, 3),
+            "compiled_ms_per_small_call": round(t_small_compiled.elapsed / args.calls * 1000, 3),
+        }
+
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if mismatched else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# bench_db_concurrency.py
+# Read latency of report queries while a detection job is writing, with SQLite's
+# default settings (rollback journal) vs. the tuned pragmas from app/database.py.
+# Readers first run alone for a baseline, then alongside the detection pipeline.
+#   python -m benchmarks.bench_db_concurrency --rows 200000 --readers 4
+
+import argparse
+import json
+import statistics
+import threading
+import time
+from typing import Any, Dict, List
+
+import sqlalchemy
+
+from app import counters, database, detection, services
+from app.progress import ProgressTracker
+from benchmarks import synthetic
+from benchmarks.common import Timer, temp_database
+
+# SQLite's own defaults, i.e. what the app ran with before the engine was tuned.
+SQLITE_DEFAULTS = {"journal_mode": "DELETE", "synchronous": "FULL", "mmap_size": 0, "cache_size": -2000,
+                   "temp_store": "DEFAULT"}
+CONFIGS = {"sqlite_defaults": SQLITE_DEFAULTS, "tuned": {}}
+
+
+def read_once(SessionLocal) -> None:
+    db = SessionLocal()
+    try:
+        services.get_fraud_report_chunk(db, 1, 50)
+        counters.summary(db.connection())
+    finally:
+        db.close()
+
+
+def readers(SessionLocal, count: int, stop: threading.Event) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors: List[str] = []
+    lock = threading.Lock()
+
+    def loop():
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                read_once(SessionLocal)
+            except sqlalchemy.exc.OperationalError as e:
+                with lock:
+                    errors.append(str(e.orig))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=loop) for _ in range(count)]
+    for t in threads:
+        t.start()
+    return {"threads": threads, "latencies": latencies, "errors": errors}
+
+
+def summarize(latencies: List[float], errors: List[str], seconds: float) -> Dict[str, Any]:
+    ms = sorted(x * 1000 for x in latencies)
+    pick = lambda q: round(ms[min(len(ms) - 1, int(q * len(ms)))], 2) if ms else None
+    return {
+        "reads": len(ms),
+        "reads_per_sec": round(len(ms) / seconds, 1),
+        "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": round(ms[-1], 2) if ms else None,
+        "mean_ms": round(statistics.fmean(ms), 2) if ms else None,
+        "errors": len(errors),
+    }
+
+
+def run(config: Dict[str, Any], args) -> Dict[str, Any]:
+    with temp_database(**config) as SessionLocal:
+        db = SessionLocal()
+        for frame in synthetic.batches(args.rows, fraud_rate=0.02):
+            services.bulk_ingest_transactions(db, frame[["card_number", "amount"]].to_dict("records"))
+        db.close()
+        with database.engine.connect() as conn:
+            journal = conn.execute(sqlalchemy.text("PRAGMA journal_mode")).scalar()
+
+        # Baseline: readers alone.
+        stop = threading.Event()
+        state = readers(SessionLocal, args.readers, stop)
+        time.sleep(args.baseline_seconds)
+        stop.set()
+        for t in state["threads"]:
+            t.join()
+        idle = summarize(state["latencies"], state["errors"], args.baseline_seconds)
+
+        # Readers while detection writes every chunk.
+        stop = threading.Event()
+        state = readers(SessionLocal, args.readers, stop)
+        with Timer() as t:
+            writer = SessionLocal()
+            try:
+                detection.DetectionPipeline(writer, args.model, ProgressTracker(detection.STAGES),
+                                            chunk_size=args.chunk_size, workers=1).run()
+            finally:
+                writer.close()
+        stop.set()
+        for thread in state["threads"]:
+            thread.join()
+        busy = summarize(state["latencies"], state["errors"], t.elapsed)
+        busy["sample_errors"] = sorted(set(state["errors"]))[:3]
+
+    return {"journal_mode": journal, "idle": idle, "during_detection": busy, "detection_seconds": round(t.elapsed, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark report reads while detection writes.")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=20_000)
+    parser.add_argument("--baseline-seconds", type=float, default=2.0)
+    parser.add_argument("--model", default="IsolationForest")
+    args = parser.parse_args()
+
+    results = {"rows": args.rows, "readers": args.readers, "chunk_size": args.chunk_size}
+    for name, config in CONFIGS.items():
+        results[name] = run(config, args)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
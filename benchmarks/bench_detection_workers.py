@@ -0,0 +1,80 @@
+# bench_detection_workers.py
+# Detection throughput by number of worker processes. Each round relabels the
+# same synthetic data from scratch: one run is started, split into shards, and
+# N `python -m app.detection_runs` processes work on it until it completes.
+# Workers load the model from ml/saved_models, like a real deployment.
+#   python -m benchmarks.bench_detection_workers --rows 1000000 --workers 1 2 4
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict
+
+from app import counters, database, detection_runs, services
+from benchmarks import synthetic
+from benchmarks.common import Timer, temp_database
+from ml import model
+
+
+def reset_labels() -> None:
+    with database.engine.begin() as conn:
+        conn.execute(database.Transaction.__table__.update().values(is_fraud=-1, explanation=None))
+        counters.recount(conn)
+
+
+def run(SessionLocal, workers: int, args) -> Dict[str, Any]:
+    reset_labels()
+    db = SessionLocal()
+    try:
+        started = detection_runs.start(db, args.model, "bench", chunk_size=args.chunk_size, workers=1,
+                                       shard_rows=args.shard_rows)
+    finally:
+        db.close()
+    env = {**os.environ, "DATABASE_URL": database.engine.url.render_as_string(hide_password=False)}
+    with Timer() as t:
+        processes = [
+            subprocess.Popen([sys.executable, "-m", "app.detection_runs", "--run", started["run_id"]], env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.wait()
+    db = SessionLocal()
+    try:
+        state = detection_runs.progress(db, started["run_id"])
+    finally:
+        db.close()
+    return {
+        "workers": workers,
+        "status": state["status"],
+        "shards": started["shards"],
+        "wall_seconds": round(t.elapsed, 3),
+        "rows_per_sec": round(state["processed"] / t.elapsed, 1),
+        "stages": state["stages"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark detection throughput by number of worker processes.")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--shard-rows", type=int, default=25_000)
+    parser.add_argument("--chunk-size", type=int, default=5_000)
+    parser.add_argument("--model", default="IsolationForest", choices=list(model.AVAILABLE_MODELS))
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {"rows": args.rows, "shard_rows": args.shard_rows, "cpus": os.cpu_count(), "runs": []}
+    with temp_database() as SessionLocal:
+        db = SessionLocal()
+        for frame in synthetic.batches(args.rows):
+            services.bulk_ingest_transactions(db, frame[["card_number", "amount"]].to_dict("records"))
+        db.close()
+        for workers in args.workers:
+            results["runs"].append(run(SessionLocal, workers, args))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
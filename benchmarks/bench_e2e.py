@@ -0,0 +1,247 @@
+# bench_e2e.py
+# End-to-end benchmark against the real FastAPI app (TestClient, temp SQLite file,
+# throwaway model registry), on synthetic data from benchmarks/synthetic.py.
+# For each --rows size it measures:
+#   ingest     rows/sec through the streaming CSV upload
+#   detection  training time and detection wall time per model in AVAILABLE_MODELS,
+#              with precision/recall against the injected fraud
+#   report     /fraud/report latency at deep pages, by page number (OFFSET) and by cursor
+#   export     CSV download time and size, and the peak Python memory of the export stream
+# Results are printed (and written to --out) as JSON for comparing runs.
+#   python -m benchmarks.bench_e2e --rows 10000 1000000 10000000 --out e2e.json
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import sqlalchemy
+from fastapi.testclient import TestClient
+
+from app import counters, database, export, services, training_jobs
+from app.main import app
+from benchmarks import synthetic
+from benchmarks.common import Timer, temp_database, temp_models_dir
+from ml import model
+
+REPORT_DEPTHS = (0.0, 0.1, 0.5, 0.9, 1.0)  # fractions of the fraud cases
+REPORT_REPEATS = 5
+
+
+def login(client: TestClient) -> Dict[str, str]:
+    client.post("/users/", json={"username": "bench", "password": "bench"})
+    token = client.post("/token", data={"username": "bench", "password": "bench"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def ingest(client: TestClient, headers: Dict[str, str], rows: int, args) -> Tuple[Dict[str, Any], np.ndarray, np.ndarray]:
+    """Uploads the synthetic CSV piece by piece; returns stats and the ground truth in id order."""
+    labels, patterns = [], []
+
+    def pieces():
+        for frame in synthetic.batches(rows, args.seed, args.cards, args.card_skew,
+                                       fraud_rate=args.fraud_rate):
+            labels.append(frame["label"].to_numpy())
+            patterns.append(frame["pattern"].to_numpy())
+            yield frame
+
+    upload_id = client.post("/ingest_csv/uploads", json={"filename": "synthetic.csv"}, headers=headers).json()["upload_id"]
+    offset, pending, sent = 0, b"", 0
+    with Timer() as t:
+        for chunk in synthetic.csv_chunks(pieces()):
+            pending += chunk
+            state = client.put(f"/ingest_csv/uploads/{upload_id}", params={"offset": offset}, content=pending,
+                               headers=headers).json()
+            sent += len(pending)
+            # Resend whatever was not acknowledged (a piece may end mid-line).
+            pending = pending[state["offset"] - offset:]
+            offset = state["offset"]
+        state = client.put(f"/ingest_csv/uploads/{upload_id}", params={"offset": offset, "final": True},
+                           content=pending, headers=headers).json()
+    ingested = state["rows_ingested"]
+    return (
+        {"rows": ingested, "seconds": round(t.elapsed, 3), "rows_per_sec": round(ingested / t.elapsed, 1), "bytes": sent},
+        np.concatenate(labels),
+        np.concatenate(patterns),
+    )
+
+
+def reset_labels() -> None:
+    with database.engine.begin() as conn:
+        conn.execute(database.Transaction.__table__.update().values(is_fraud=-1, explanation=None))
+        counters.recount(conn)
+    model.feature_store.clear()
+
+
+def evaluate(labels: np.ndarray, patterns: np.ndarray) -> Dict[str, Any]:
+    """Precision/recall of the stored labels against the injected fraud (ids follow ingest order)."""
+    t = database.Transaction.__table__
+    with database.engine.connect() as conn:
+        predicted = np.fromiter(conn.execute(sqlalchemy.select(t.c.is_fraud).order_by(t.c.id)).scalars(), dtype=np.int8)
+    flagged, actual = predicted == 1, labels == 1
+    hits = int((flagged & actual).sum())
+    return {
+        "flagged": int(flagged.sum()),
+        "precision": round(hits / flagged.sum(), 4) if flagged.any() else None,
+        "recall": round(hits / actual.sum(), 4) if actual.any() else None,
+        "recall_by_pattern": {
+            kind: round(float(flagged[patterns == kind].mean()), 4)
+            for kind in synthetic.PATTERNS if (patterns == kind).any()
+        },
+    }
+
+
+def detect(client: TestClient, headers: Dict[str, str], model_name: str, args) -> Dict[str, Any]:
+    with Timer() as t:
+        # TestClient runs the background task before returning, so this is the whole run.
+        response = client.post("/detection/start", json={"model_name": model_name, "chunk_size": args.chunk_size},
+                               headers=headers)
+    response.raise_for_status()
+    progress = client.get("/detection/progress", headers=headers).json()
+    return {
+        "wall_seconds": round(t.elapsed, 3),
+        "status": progress["status"],
+        "rows_per_sec": progress["rows_per_sec"],
+        "model_version": progress.get("model_version"),
+        "stages": progress["stages"],
+    }
+
+
+def train(client: TestClient, headers: Dict[str, str], model_name: str) -> Dict[str, Any]:
+    with Timer() as t:
+        response = client.post("/model/retrain", json={"model_name": model_name}, headers=headers)
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        training_jobs.wait(job_id)
+    job = client.get(f"/model/jobs/{job_id}", headers=headers).json()
+    if job["status"] != "completed":
+        raise RuntimeError(f"Training {model_name} failed: {job['error']}")
+    return {"seconds": round(t.elapsed, 3), "version": job["version"]}
+
+
+def detection(client: TestClient, headers: Dict[str, str], labels, patterns, args) -> Dict[str, Any]:
+    """IsolationForest labels the data the supervised models are then trained on; each model detects from scratch."""
+    results: Dict[str, Dict[str, Any]] = {"IsolationForest": {"train": train(client, headers, "IsolationForest")}}
+    results["IsolationForest"]["detect"] = detect(client, headers, "IsolationForest", args)
+    results["IsolationForest"]["quality"] = evaluate(labels, patterns)
+    supervised = [name for name in args.models if name != "IsolationForest"]
+    # All of them train on the IsolationForest labels, before any reset.
+    for name in supervised:
+        results[name] = {"train": train(client, headers, name)}
+    for name in supervised:
+        reset_labels()
+        results[name]["detect"] = detect(client, headers, name, args)
+        results[name]["quality"] = evaluate(labels, patterns)
+    return results
+
+
+def timed_get(client: TestClient, url: str, headers: Dict[str, str], params: Dict[str, Any]) -> float:
+    samples = []
+    for _ in range(REPORT_REPEATS):
+        started = time.perf_counter()
+        client.get(url, params=params, headers=headers).raise_for_status()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def report(client: TestClient, headers: Dict[str, str], page_size: int) -> Dict[str, Any]:
+    """Median latency of a report page at several depths, reached by page number and by cursor."""
+    t = database.Transaction.__table__
+    with database.engine.connect() as conn:
+        total = counters.summary(conn)["fraudulent"]
+    pages = max(1, -(-total // page_size))
+    results = []
+    for depth in REPORT_DEPTHS:
+        page = min(pages, 1 + int(depth * (pages - 1)))
+        offset = (page - 1) * page_size
+        entry = {"page": page, "offset": offset,
+                 "offset_ms": timed_get(client, "/fraud/report", headers, {"page": page, "page_size": page_size})}
+        if offset:
+            # The cursor the previous page would have returned: its last row.
+            with database.engine.connect() as conn:
+                last = conn.execute(
+                    sqlalchemy.select(t.c.timestamp, t.c.id).where(t.c.is_fraud == 1)
+                    .order_by(t.c.timestamp.desc(), t.c.id.desc()).offset(offset - 1).limit(1)
+                ).one()
+            cursor = services.encode_cursor(last.timestamp, last.id)
+            entry["cursor_ms"] = timed_get(client, "/fraud/report", headers, {"cursor": cursor, "page_size": page_size})
+        results.append(entry)
+    return {"fraud_cases": total, "page_size": page_size, "depths": results}
+
+
+def download(client: TestClient, headers: Dict[str, str]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    response = client.get("/fraud/report/download", headers=headers)
+    response.raise_for_status()
+    elapsed = time.perf_counter() - started
+    # TestClient buffers the whole body, so memory is measured on the generator the endpoint streams from.
+    # It is a second pass because tracemalloc slows everything down.
+    tracemalloc.start()
+    for _ in export.csv_stream():
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"total_seconds": round(elapsed, 3), "bytes": len(response.content), "peak_mib": round(peak / 2**20, 2)}
+
+
+def run(rows: int, args) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"rows": rows}
+    with temp_database(), temp_models_dir(), TestClient(app) as client:
+        headers = login(client)
+        result["ingest"], labels, patterns = ingest(client, headers, rows, args)
+        result["detection"] = detection(client, headers, labels, patterns, args)
+        result["report"] = report(client, headers, args.page_size)
+        result["export"] = download(client, headers) if result["report"]["fraud_cases"] else None
+    return result
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of ingest, detection, report and export.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--models", nargs="+", default=list(model.AVAILABLE_MODELS), choices=list(model.AVAILABLE_MODELS))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cards", type=int, default=10_000)
+    parser.add_argument("--card-skew", type=float, default=1.1)
+    parser.add_argument("--fraud-rate", type=float, default=0.01)
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--out", help="Also write the JSON here.")
+    args = parser.parse_args()
+    if "IsolationForest" not in args.models:
+        args.models.insert(0, "IsolationForest")  # it produces the labels the others train on
+
+    results: Dict[str, Any] = {
+        "environment": environment(),
+        "config": {k: v for k, v in vars(args).items() if k != "out"},
+        "runs": [run(rows, args) for rows in args.rows],
+    }
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
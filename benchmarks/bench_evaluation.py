@@ -0,0 +1,65 @@
+# bench_evaluation.py
+# Comparing every model: the POST /model/evaluate job against the sequential
+# path it replaces, one /model/retrain per model. Both run on the same labeled
+# synthetic data (IsolationForest detection labels it first). The evaluation
+# job is run once per --workers value to show the process pool's speed-up.
+# Prints the wall times and the last job's per-model results as JSON.
+#   python -m benchmarks.bench_evaluation --rows 200000 --workers 1 4
+
+import argparse
+import json
+import os
+from typing import Any, Dict
+
+from fastapi.testclient import TestClient
+
+from app import services, training_jobs
+from app.main import app
+from benchmarks import synthetic
+from benchmarks.bench_e2e import detect, login, train
+from benchmarks.common import Timer, temp_database, temp_models_dir
+from ml import model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the train-and-evaluate-all job.")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, len(model.AVAILABLE_MODELS)])
+    parser.add_argument("--cv-folds", type=int, default=0)
+    args = parser.parse_args()
+
+    with temp_database() as SessionLocal, temp_models_dir(), TestClient(app) as client:
+        headers = login(client)
+        db = SessionLocal()
+        for frame in synthetic.batches(args.rows, fraud_rate=0.03):
+            services.bulk_ingest_transactions(db, frame[["card_number", "amount"]].to_dict("records"))
+        db.close()
+        train(client, headers, "IsolationForest")
+        detect(client, headers, "IsolationForest", argparse.Namespace(chunk_size=10_000))
+
+        with Timer() as sequential:
+            for name in model.AVAILABLE_MODELS:
+                train(client, headers, name)
+        results: Dict[str, Any] = {
+            "rows": args.rows,
+            "cpus": os.cpu_count(),
+            "cv_folds": args.cv_folds,
+            "sequential_retrain_seconds": round(sequential.elapsed, 3),
+            "evaluate_seconds": {},
+        }
+        for workers in args.workers:
+            # The job's spawned process reads EVAL_WORKERS from the environment it inherits.
+            os.environ["EVAL_WORKERS"] = str(workers)
+            with Timer() as t:
+                response = client.post("/model/evaluate", json={"cv_folds": args.cv_folds}, headers=headers)
+                response.raise_for_status()
+                training_jobs.wait(response.json()["job_id"])
+            results["evaluate_seconds"][workers] = round(t.elapsed, 3)
+        results["evaluations"] = client.get("/model/evaluations", headers=headers).json()["results"]
+        best = client.get("/model/evaluations/best", headers=headers)
+        results["best"] = best.json() if best.status_code == 200 else None
+    print(json.dumps(results, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# bench_export.py
+# Time-to-first-byte, total time and peak Python memory of the fraud report
+# export: the original build-everything-then-send CSV vs. the streaming formats.
+#   python -m benchmarks.bench_export --rows 100000
+
+import argparse
+import json
+import time
+import tracemalloc
+from io import StringIO
+
+import pandas as pd
+
+from app import database, export, security, services
+from benchmarks.common import random_transactions, temp_database
+
+
+def legacy_csv():
+    """The original download: every row as a dict, then a DataFrame, then one CSV string."""
+    db = database.SessionLocal()
+    try:
+        data = []
+        for tx in db.query(database.Transaction).filter(database.Transaction.is_fraud == 1).all():
+            data.append({
+                "id": tx.id,
+                "masked_card_number": security.mask_card_number(security.decrypt_data(tx.card_number_encrypted)),
+                "amount": tx.amount,
+                "timestamp": tx.timestamp.isoformat(),
+                "explanation": tx.explanation or "Explanation not available",
+            })
+        stream = StringIO()
+        pd.DataFrame(data).to_csv(stream, index=False)
+        yield stream.getvalue().encode()
+    finally:
+        db.close()
+
+
+def measure(chunks) -> dict:
+    tracemalloc.start()
+    started = time.perf_counter()
+    first_byte, size = None, 0
+    for chunk in chunks:
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        size += len(chunk)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "ttfb_ms": round(first_byte * 1000, 2),
+        "total_seconds": round(elapsed, 3),
+        "peak_mib": round(peak / 2**20, 2),
+        "bytes": size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fraud report export formats.")
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    rows = [dict(tx, is_fraud=1, explanation="Flagged by ML anomaly detection.") for tx in random_transactions(args.rows)]
+    results = {"rows": args.rows, "batch_size": export.EXPORT_BATCH_SIZE}
+    with temp_database() as SessionLocal:
+        db = SessionLocal()
+        services.bulk_ingest_transactions(db, rows)
+        db.close()
+
+        results["legacy_csv"] = measure(legacy_csv())
+        results["csv"] = measure(export.csv_stream())
+        results["csv_gzip"] = measure(export.csv_stream(gzip=True))
+        if export.columnar_available():
+            results["parquet"] = measure(export.columnar_stream("parquet"))
+            results["arrow"] = measure(export.columnar_stream("arrow"))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
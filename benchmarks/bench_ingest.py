@@ -0,0 +1,51 @@
+# bench_ingest.py
+# Rows/sec for the legacy per-row ORM ingest vs. the bulk ingest path.
+#   python -m benchmarks.bench_ingest --rows 200000
+
+import argparse
+import json
+
+from app import database, security, services
+from benchmarks.common import Timer, random_transactions, temp_database
+
+
+def legacy_ingest(db, transactions):
+    """The original /ingest_batch/ loop: one ORM object and one masked echo per row."""
+    masked_response = []
+    for tx in transactions:
+        encrypted_card = security.encrypt_data(tx["card_number"])
+        db.add(database.Transaction(card_number_encrypted=encrypted_card, amount=tx["amount"], is_fraud=-1))
+        masked_response.append({"masked_card": security.mask_card_number(tx["card_number"]), "amount": tx["amount"]})
+    db.commit()
+    return masked_response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark legacy vs. bulk ingest.")
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    transactions = random_transactions(args.rows)
+    results = {"rows": args.rows, "encrypt_workers": security.ENCRYPT_WORKERS}
+
+    with temp_database() as SessionLocal:
+        db = SessionLocal()
+        with Timer() as t:
+            legacy_ingest(db, transactions)
+        db.close()
+        results["legacy_rows_per_sec"] = round(args.rows / t.elapsed, 1)
+
+    with temp_database() as SessionLocal:
+        db = SessionLocal()
+        with Timer() as t:
+            services.bulk_ingest_transactions(db, transactions)
+        db.close()
+        results["bulk_rows_per_sec"] = round(args.rows / t.elapsed, 1)
+
+    security.shutdown_encrypt_pool()
+    results["speedup"] = round(results["bulk_rows_per_sec"] / results["legacy_rows_per_sec"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
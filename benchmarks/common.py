@@ -0,0 +1,67 @@
+# common.py
+# Shared helpers for the benchmark scripts. Run them from the repo root, e.g.
+#   python -m benchmarks.bench_ingest --rows 100000
+
+import os
+import glob
+import random
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from sqlalchemy.orm import sessionmaker
+
+from app import database
+from ml import model
+from ml.registry import ModelRegistry
+
+
+@contextmanager
+def temp_database(**pragmas) -> Iterator[sessionmaker]:
+    """Point the app at a throwaway SQLite file for the duration of a benchmark; `pragmas` override SQLITE_PRAGMAS."""
+    original_engine = database.engine
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = database.make_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", pragmas)
+        database.engine = engine
+        database.SessionLocal.configure(bind=engine)
+        database.create_db()
+        try:
+            yield database.SessionLocal
+        finally:
+            engine.dispose()
+            database.engine = original_engine
+            database.SessionLocal.configure(bind=original_engine)
+
+
+@contextmanager
+def temp_models_dir() -> Iterator[ModelRegistry]:
+    """Train into a throwaway registry (seeded with the legacy pickles) instead of ml/saved_models."""
+    original_dir, original_registry = model.MODELS_DIR, model.registry
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in glob.glob(os.path.join(original_dir, "*.pkl")):
+            shutil.copy(path, tmp)
+        model.MODELS_DIR = tmp
+        model.registry = ModelRegistry(tmp)
+        try:
+            yield model.registry
+        finally:
+            model.MODELS_DIR, model.registry = original_dir, original_registry
+
+
+def random_transactions(n: int, seed: int = 42) -> List[Dict]:
+    rng = random.Random(seed)
+    return [
+        {"card_number": "".join(rng.choices("0123456789", k=16)), "amount": round(rng.lognormvariate(4, 1.2), 2)}
+        for _ in range(n)
+    ]
+
+
+class Timer:
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started
@@ -0,0 +1,100 @@
+# stub_gemini.py
+# A local stand-in for the Gemini generateContent endpoint, for exercising
+# app/explanations.py without network access or an API key.
+#   python -m benchmarks.stub_gemini --port 8099 --latency-ms 200 --error-rate 0.1
+#   GEMINI_API_URL=http://127.0.0.1:8099/generate USE_GEMINI=true GEMINI_API_KEY=stub uvicorn app.main:app
+#
+# Batched prompts ("Reply with only a JSON array of N strings") get a JSON array
+# of N explanations; other prompts get plain text. A fraction of requests can be
+# answered with 429/503 to exercise retries.
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubGemini:
+    def __init__(self, port: int = 0, latency_ms: float = 0, error_rate: float = 0.0, seed: int = 7):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/generate"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _reply(self, prompt: str) -> str:
+        batch = re.search(r"JSON array of (\d+) strings", prompt)
+        if batch:
+            return json.dumps([f"Stub explanation {i + 1}." for i in range(int(batch.group(1)))])
+        return "Stub explanation."
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with stub._lock:
+                    stub.requests += 1
+                    stub._in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub._in_flight)
+                    fail = stub._rng.random() < stub.error_rate
+                    stub.errors += fail
+                try:
+                    time.sleep(stub.latency)
+                    if fail:
+                        self.send_response(stub._rng.choice([429, 503]))
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    prompt = body["contents"][0]["parts"][0]["text"]
+                    data = json.dumps({"candidates": [{"content": {"parts": [{"text": stub._reply(prompt)}]}}]}).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                finally:
+                    with stub._lock:
+                        stub._in_flight -= 1
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a stub Gemini generateContent endpoint.")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    with StubGemini(args.port, args.latency_ms, args.error_rate) as stub:
+        print(f"Stub Gemini listening on {stub.url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
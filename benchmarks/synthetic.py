@@ -0,0 +1,122 @@
+# synthetic.py
+# Seeded synthetic transactions for benchmarks and local testing.
+#
+# Legitimate traffic: `cards` card numbers, picked with a Zipf-like skew
+# (`card_skew` 0 = uniform), log-normal amounts (`amount_mu`, `amount_sigma`).
+# About `fraud_rate` of the rows are then overwritten by injected fraud events:
+#   high_value    one amount above the $10,000 rule threshold
+#   card_testing  a run of tiny amounts on one card
+#   burst         a run of ordinary-to-large amounts on one card (velocity)
+#   amount_spike  one amount 20-50x the typical amount, on an existing card
+# Events are written as consecutive rows, so once ingested they share a
+# timestamp window and show up in the per-card velocity features.
+# Every row carries its ground truth in `label` (0/1) and `pattern`.
+#
+#   python -m benchmarks.synthetic --rows 1000000 --out transactions.csv
+
+import argparse
+import sys
+from typing import Iterator, Sequence
+
+import numpy as np
+import pandas as pd
+
+PATTERNS = ("high_value", "card_testing", "burst", "amount_spike")
+BATCH_ROWS = 100_000
+
+# Rows per event; fraud_rate counts rows, not events.
+_EVENT_ROWS = {"high_value": (1, 1), "card_testing": (5, 15), "burst": (8, 25), "amount_spike": (1, 1)}
+
+
+def card_number(index: int, seed: int) -> str:
+    """A stable 16-digit card number for card `index`; distinct indexes give distinct numbers."""
+    # 982451653 is prime, so this is a permutation of [0, 10**15).
+    return f"4{(index * 982451653 + seed * 7919) % 10**15:015d}"
+
+
+def batches(rows: int, seed: int = 42, cards: int = 10_000, card_skew: float = 1.1,
+            amount_mu: float = 4.0, amount_sigma: float = 1.2, fraud_rate: float = 0.01,
+            patterns: Sequence[str] = PATTERNS, batch_rows: int = BATCH_ROWS) -> Iterator[pd.DataFrame]:
+    """Yields DataFrames (card_number, amount, label, pattern) totalling `rows` rows, in order."""
+    unknown = set(patterns) - set(PATTERNS)
+    if unknown:
+        raise ValueError(f"Unknown fraud patterns: {sorted(unknown)}")
+    rng = np.random.default_rng(seed)
+    # Card popularity ~ 1 / rank**card_skew; the permutation keeps popular cards spread out.
+    weights = 1.0 / np.arange(1, cards + 1) ** card_skew
+    cdf = np.cumsum(weights[rng.permutation(cards)])
+    cdf /= cdf[-1]
+    typical = float(np.exp(amount_mu))
+
+    for start in range(0, rows, batch_rows):
+        n = min(batch_rows, rows - start)
+        card_ids = np.minimum(np.searchsorted(cdf, rng.random(n)), cards - 1)
+        amounts = rng.lognormal(amount_mu, amount_sigma, n)
+        labels = np.zeros(n, dtype=np.int8)
+        pattern = np.full(n, "", dtype=object)
+
+        fraud_rows = rng.binomial(n, fraud_rate) if patterns else 0
+        while fraud_rows > 0:
+            kind = patterns[rng.integers(len(patterns))]
+            low, high = _EVENT_ROWS[kind]
+            size = int(min(rng.integers(low, high + 1), fraud_rows, n))
+            at = int(rng.integers(0, n - size + 1))
+            span = slice(at, at + size)
+            if kind == "high_value":
+                amounts[span] = rng.uniform(10_001, 50_000, size)
+            elif kind == "card_testing":
+                card_ids[span] = rng.integers(cards)
+                amounts[span] = rng.uniform(0.5, 2.0, size)
+            elif kind == "burst":
+                card_ids[span] = rng.integers(cards)
+                amounts[span] = typical * rng.uniform(1.0, 6.0, size)
+            else:
+                amounts[span] = typical * rng.uniform(20, 50, size)
+            labels[span] = 1
+            pattern[span] = kind
+            fraud_rows -= size
+
+        yield pd.DataFrame({
+            "card_number": [card_number(int(i), seed) for i in card_ids],
+            "amount": np.round(amounts, 2),
+            "label": labels,
+            "pattern": pattern,
+        })
+
+
+def csv_chunks(frames: Iterator[pd.DataFrame], columns: Sequence[str] = ("card_number", "amount")) -> Iterator[bytes]:
+    """CSV bytes for the upload endpoint: a header, then one chunk per frame."""
+    header = True
+    for frame in frames:
+        yield frame.to_csv(columns=list(columns), header=header, index=False).encode()
+        header = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write seeded synthetic transactions as CSV.")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cards", type=int, default=10_000)
+    parser.add_argument("--card-skew", type=float, default=1.1)
+    parser.add_argument("--amount-mu", type=float, default=4.0)
+    parser.add_argument("--amount-sigma", type=float, default=1.2)
+    parser.add_argument("--fraud-rate", type=float, default=0.01)
+    parser.add_argument("--patterns", nargs="*", default=list(PATTERNS), choices=PATTERNS)
+    parser.add_argument("--labels", action="store_true", help="Include the label and pattern columns.")
+    parser.add_argument("--out", default="-", help="Output file (default: stdout).")
+    args = parser.parse_args()
+
+    frames = batches(args.rows, args.seed, args.cards, args.card_skew, args.amount_mu, args.amount_sigma,
+                     args.fraud_rate, args.patterns)
+    columns = ("card_number", "amount", "label", "pattern") if args.labels else ("card_number", "amount")
+    out = sys.stdout.buffer if args.out == "-" else open(args.out, "wb")
+    try:
+        for chunk in csv_chunks(frames, columns):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -34,7 +34,7 @@ const uploadInput = document.getElementById('csv-upload'),
       signupBtnHeader = document.getElementById('signup-btn-header');
 
 let uploadedFile = null;
-let progressMonitorInterval = null;
+let progressStream = null;
 
 /* --- Event Listeners --- */
 document.addEventListener('DOMContentLoaded', checkLoginState);
@@ -51,6 +51,8 @@ ingestBtn && ingestBtn.addEventListener('click', handleIngest);
 clearDbBtn && clearDbBtn.addEventListener('click', handleClearDatabase);
 detectBtn && detectBtn.addEventListener('click', handleDetect);
 downloadReportBtn && downloadReportBtn.addEventListener('click', handleDownloadReport);
+document.getElementById('report-more-btn')?.addEventListener('click', () => handleReport(true));
+document.getElementById('log-more-btn')?.addEventListener('click', () => handleViewLog(true));
 logBtn && logBtn.addEventListener('click', handleViewLog);
 retrainBtn && retrainBtn.addEventListener('click', handleRetrain);
 
@@ -102,58 +104,73 @@ function checkLoginState() {
 }
 
 /* --- Ingest Handler --- */
+const UPLOAD_CHUNK_BYTES = 4 * 1024 * 1024;
+const UPLOAD_MAX_RETRIES = 5;
+
 async function handleIngest() {
     if (!uploadedFile) return showStatus('⚠️ Please select a CSV file first.', 'error');
     ingestBtn.disabled = true;
-    showProgress('Ingesting transactions...', '5%');
+    showProgress('Ingesting transactions...', '0%');
 
-    Papa.parse(uploadedFile, {
-        header: true,
-        skipEmptyLines: true,
-        complete: async function (results) {
-            try {
-                const rows = results.data
-                    .map(row => ({
-                        card_number: (row.card_number || row.CardNumber || row.card || "").trim(),
-                        amount: parseFloat(row.amount || row.Amount || row.transaction_amount || row.value || 0)
-                    }))
-                    .filter(r => r.card_number && !Number.isNaN(r.amount)); // filter invalid rows
-
-                if (!rows.length) {
-                    showStatus("⚠️ No valid rows found in CSV.", "error");
-                    hideProgress();
-                    ingestBtn.disabled = false;
-                    return;
-                }
+    try {
+        const created = await fetch(`${API_URL}/ingest_csv/uploads`, {
+            method: 'POST',
+            headers: getAuthHeaders(),
+            body: JSON.stringify({ filename: uploadedFile.name })
+        });
+        if (!created.ok) {
+            const err = await created.json().catch(() => ({}));
+            throw new Error(err.detail || `Server returned ${created.status}`);
+        }
+        let upload = await created.json();
+        let chunkBytes = UPLOAD_CHUNK_BYTES;
+        let retries = 0;
 
-                const response = await fetch(`${API_URL}/ingest_batch/`, {
-                    method: 'POST',
-                    headers: getAuthHeaders(),
-                    body: JSON.stringify({ transactions: rows })
+        while (upload.status !== 'completed') {
+            const end = Math.min(upload.offset + chunkBytes, uploadedFile.size);
+            const final = end >= uploadedFile.size;
+            try {
+                const response = await fetch(`${API_URL}/ingest_csv/uploads/${upload.upload_id}?offset=${upload.offset}&final=${final}`, {
+                    method: 'PUT',
+                    headers: { "Authorization": `Bearer ${getToken()}`, "Content-Type": "text/csv" },
+                    body: uploadedFile.slice(upload.offset, end)
                 });
-
-                if (!response.ok) {
+                if (!response.ok && response.status !== 409) {
                     const err = await response.json().catch(() => ({}));
                     throw new Error(err.detail || `Server returned ${response.status}`);
                 }
-
-                const data = await response.json().catch(() => ({}));
-                hideProgress();
-                ingestBtn.disabled = false;
-                showStatus(`✅ Appended ${rows.length} new transactions to the database.`, 'success');
-
+                const previousOffset = upload.offset;
+                // A 409 means our offset is stale; re-sync from the server's committed offset.
+                upload = response.ok ? await response.json() : await fetchUploadState(upload.upload_id);
+                // A single line longer than the chunk cannot be acknowledged; widen the window.
+                if (upload.offset === previousOffset && !final) chunkBytes *= 2;
+                retries = 0;
             } catch (error) {
-                hideProgress();
-                ingestBtn.disabled = false;
-                showStatus(`❌ Ingest failed: ${error.message}`, 'error');
+                if (++retries > UPLOAD_MAX_RETRIES) throw error;
+                showProgress(`Connection lost, resuming upload (attempt ${retries})...`, progressBar.style.width);
+                await new Promise(r => setTimeout(r, 500 * 2 ** retries));
+                upload = await fetchUploadState(upload.upload_id).catch(() => upload);
+                continue;
             }
-        },
-        error: function(err) {
-            hideProgress();
-            ingestBtn.disabled = false;
-            showStatus(`❌ CSV parse error: ${err.message}`, 'error');
+            const percent = uploadedFile.size > 0 ? Math.round((upload.offset / uploadedFile.size) * 100) : 100;
+            showProgress(`Ingesting transactions... (${upload.rows_ingested} rows)`, `${percent}%`);
         }
-    });
+
+        hideProgress();
+        const skipped = upload.rows_skipped ? ` Skipped ${upload.rows_skipped} invalid rows.` : '';
+        showStatus(`✅ Appended ${upload.rows_ingested} new transactions to the database.${skipped}`, 'success');
+    } catch (error) {
+        hideProgress();
+        showStatus(`❌ Ingest failed: ${error.message}`, 'error');
+    } finally {
+        ingestBtn.disabled = false;
+    }
+}
+
+async function fetchUploadState(uploadId) {
+    const response = await fetch(`${API_URL}/ingest_csv/uploads/${uploadId}`, { headers: getAuthHeaders() });
+    if (!response.ok) throw new Error(`Upload status returned ${response.status}`);
+    return response.json();
 }
 
 /* --- Clear DB --- */
@@ -219,48 +236,78 @@ async function handleDetect() {
     }
 }
 
-function monitorProgress() {
-    if (progressMonitorInterval) clearInterval(progressMonitorInterval);
-
-    progressMonitorInterval = setInterval(async () => {
-        try {
-            const response = await fetch(`${API_URL}/detection/progress`, { headers: getAuthHeaders() });
-            if (!response.ok) throw new Error(`Progress endpoint returned ${response.status}`);
-            const data = await response.json();
-
-            if (data.status === "completed") {
-                clearInterval(progressMonitorInterval);
-                progressMonitorInterval = null;
-                hideProgress();
-                detectBtn.disabled = false;
-                showStatus(`🎉 Detection complete. Fraudulent: ${data.fraudulent}/${data.total}`, 'success');
-            } else if (data.status === "error") {
-                clearInterval(progressMonitorInterval);
-                progressMonitorInterval = null;
-                hideProgress();
-                detectBtn.disabled = false;
-                showStatus("❌ Detection failed. Check server logs.", 'error');
-            } else {
-                const percent = data.total > 0 ? Math.round((data.processed / data.total) * 100) : 0;
-                showProgress(`Analyzing transactions... (${data.processed}/${data.total})`, `${percent}%`);
-            }
-        } catch (error) {
-            if (progressMonitorInterval) {
-                clearInterval(progressMonitorInterval);
-                progressMonitorInterval = null;
-            }
-            hideProgress();
-            detectBtn.disabled = false;
-            showStatus(`❌ Progress monitoring failed: ${error.message}`, 'error');
+async function openProgressStream() {
+    // The stream URL carries a single-use ticket, not the bearer token, so the token stays out of access logs.
+    const response = await fetch(`${API_URL}/detection/progress/ticket`, { method: "POST", headers: getAuthHeaders() });
+    if (!response.ok) throw new Error(`Server returned ${response.status}`);
+    const { ticket } = await response.json();
+    return new EventSource(`${API_URL}/detection/progress/stream?ticket=${encodeURIComponent(ticket)}`);
+}
+
+async function monitorProgress(reconnects = 0) {
+    if (progressStream) progressStream.close();
+
+    // One message per processed chunk, pushed by the server (see /detection/progress/stream).
+    try {
+        progressStream = await openProgressStream();
+    } catch (err) {
+        progressStream = null;
+        hideProgress();
+        detectBtn.disabled = false;
+        showStatus(`❌ Progress monitoring failed: ${err.message}`, 'error');
+        return;
+    }
+    const stopMonitoring = () => {
+        progressStream.close();
+        progressStream = null;
+        hideProgress();
+        detectBtn.disabled = false;
+    };
+
+    progressStream.onmessage = (event) => {
+        reconnects = 0;
+        const data = JSON.parse(event.data);
+
+        if (data.status === "completed") {
+            stopMonitoring();
+            const rate = data.rows_per_sec ? ` in ${data.elapsed_seconds}s (${Math.round(data.rows_per_sec)} rows/s)` : '';
+            showStatus(`🎉 Detection complete. Fraudulent: ${data.fraudulent}/${data.total}${rate}`, 'success');
+        } else if (data.status === "error") {
+            stopMonitoring();
+            showStatus(`❌ Detection failed: ${data.error || 'check server logs.'}`, 'error');
+        } else {
+            const percent = data.total > 0 ? Math.round((data.processed / data.total) * 100) : 0;
+            const details = [];
+            if (data.rows_per_sec) details.push(`${Math.round(data.rows_per_sec)} rows/s`);
+            if (data.eta_seconds !== null && data.eta_seconds !== undefined) details.push(`ETA ${Math.ceil(data.eta_seconds)}s`);
+            if (data.fraud_rate !== null && data.fraud_rate !== undefined) details.push(`fraud ${(data.fraud_rate * 100).toFixed(2)}%`);
+            if (data.workers > 1) details.push(`${data.workers} workers`);
+            const suffix = details.length ? ` · ${details.join(' · ')}` : '';
+            showProgress(`Analyzing transactions... (${data.processed}/${data.total})${suffix}`, `${percent}%`);
         }
-    }, 2000);
+    };
+
+    progressStream.onerror = () => {
+        // A ticket is good for one connection, so reconnect with a fresh one rather than let EventSource retry the URL.
+        if (!progressStream) return;
+        progressStream.close();
+        if (reconnects < 3) {
+            setTimeout(() => monitorProgress(reconnects + 1), 1000);
+        } else {
+            stopMonitoring();
+            showStatus("❌ Progress monitoring failed: connection to the server was lost.", 'error');
+        }
+    };
 }
 
 /* --- Fraud Report Display --- */
-async function handleReport() {
+let reportCursor = null;
+
+async function handleReport(loadMore = false) {
     reportArea.classList.remove('hidden');
     try {
-        const response = await fetch(`${API_URL}/fraud/report`, { headers: getAuthHeaders() });
+        const query = loadMore && reportCursor ? `?cursor=${encodeURIComponent(reportCursor)}` : '';
+        const response = await fetch(`${API_URL}/fraud/report${query}`, { headers: getAuthHeaders() });
         if (!response.ok) throw new Error(`Failed to fetch report: ${response.status}`);
         const data = await response.json();
 
@@ -270,11 +317,14 @@ async function handleReport() {
         document.getElementById('metric-percent').innerHTML = `<h3>${data.summary.fraud_percentage}%</h3><p>Fraud Rate</p>`;
 
         const tbody = document.querySelector('#fraud-table tbody');
-        tbody.innerHTML = "";
+        if (!loadMore) tbody.innerHTML = "";
         data.fraud_cases.forEach(tx => {
             const row = `<tr><td>${tx.id}</td><td>${tx.masked_card_number}</td><td>${tx.amount}</td><td>${tx.timestamp}</td><td>${tx.explanation || 'N/A'}</td></tr>`;
-            tbody.innerHTML += row;
+            tbody.insertAdjacentHTML('beforeend', row);
         });
+        reportCursor = data.next_cursor;
+        const loadMoreBtn = document.getElementById('report-more-btn');
+        if (loadMoreBtn) loadMoreBtn.classList.toggle('hidden', !reportCursor);
         showStatus("📊 Fraud report generated.", 'info');
     } catch (error) {
         showStatus(`❌ Failed to load report: ${error.message}`, 'error');
@@ -324,20 +374,26 @@ async function handleDownloadReport() {
 }
 
 /* --- Audit Log --- */
-async function handleViewLog() {
+let auditCursor = null;
+
+async function handleViewLog(loadMore = false) {
     logArea.classList.remove('hidden');
     try {
-        const response = await fetch(`${API_URL}/audit_log/`, { headers: getAuthHeaders() });
+        const query = loadMore === true && auditCursor ? `?cursor=${encodeURIComponent(auditCursor)}` : '';
+        const response = await fetch(`${API_URL}/audit_log/${query}`, { headers: getAuthHeaders() });
         if (!response.ok) throw new Error(`Failed to fetch logs: ${response.status}`);
-        const logs = await response.json();
+        const page = await response.json();
         const tbody = document.querySelector('#log-table tbody');
-        tbody.innerHTML = "";
-        logs.forEach(log => {
+        if (loadMore !== true) tbody.innerHTML = "";
+        page.entries.forEach(log => {
             const isRetrain = (log.action || "").toLowerCase().includes("retrain");
             const rowClass = isRetrain ? "retrain-row" : "";
             const icon = isRetrain ? "🎯 " : "";
-            tbody.innerHTML += `<tr class="${rowClass}"><td>${log.timestamp}</td><td>${log.username}</td><td>${icon}${log.action}</td></tr>`;
+            tbody.insertAdjacentHTML('beforeend', `<tr class="${rowClass}"><td>${log.timestamp}</td><td>${log.username}</td><td>${icon}${log.action}</td></tr>`);
         });
+        auditCursor = page.next_cursor;
+        const loadMoreBtn = document.getElementById('log-more-btn');
+        if (loadMoreBtn) loadMoreBtn.classList.toggle('hidden', !auditCursor);
     } catch (error) {
         showStatus(`❌ Failed to load audit log: ${error.message}`, 'error');
     }
@@ -361,8 +417,20 @@ async function handleRetrain() {
             throw new Error(err.detail || `Server returned ${response.status}`);
         }
 
-        const data = await response.json();
-        showStatus(`🎉 ${data.message}`, 'success');
+        const { job_id } = await response.json();
+        // Training runs in its own process on the server; poll the job until it finishes.
+        let job;
+        while (true) {
+            await new Promise(r => setTimeout(r, 1000));
+            const jobResponse = await fetch(`${API_URL}/model/jobs/${job_id}`, { headers: getAuthHeaders() });
+            if (!jobResponse.ok) throw new Error(`Server returned ${jobResponse.status}`);
+            job = await jobResponse.json();
+            if (job.status === 'completed' || job.status === 'error') break;
+            const percent = job.progress != null ? `${Math.max(5, Math.round(job.progress * 100))}%` : '5%';
+            showProgress(`Retraining ${model_name}: ${job.phase || job.status} (${job.rows_read.toLocaleString()} rows)`, percent);
+        }
+        if (job.status === 'error') throw new Error(job.error);
+        showStatus(`🎉 Model '${model_name}' retrained (v${job.version}).`, 'success');
         handleViewLog();
     } catch (error) {
         showStatus(`❌ Error during retraining: ${error.message}`, 'error');
@@ -0,0 +1,179 @@
+# compiled.py
+# Array-based inference for the trained models.
+#
+# compile_model() flattens a fitted DecisionTree / RandomForest / IsolationForest
+# into contiguous NumPy node arrays (all trees concatenated) and evaluates a
+# whole batch by walking every (row, tree) pair down one level per step. Leaves
+# point at themselves, so after max_depth steps every walk has reached its leaf
+# without per-node branching. LogisticRegression and SGDClassifier compile to a
+# dot product, with a leading StandardScaler folded into the coefficients.
+#
+# Predictions match the sklearn estimator's predict() on the same inputs (up to
+# float rounding at the decision boundary where a scaler was folded in).
+
+import abc
+from typing import Any, Optional
+
+import numpy as np
+from sklearn.ensemble import IsolationForest, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.tree import DecisionTreeClassifier
+
+ROW_BLOCK = 2048  # rows per traversal block; bounds the (rows x trees) node-index matrix
+
+
+def _average_path_length(n_samples: np.ndarray) -> np.ndarray:
+    """Same as sklearn.ensemble._iforest._average_path_length."""
+    n = np.asarray(n_samples, dtype=np.float64)
+    out = np.zeros_like(n)
+    out[n == 2] = 1.0
+    many = n > 2
+    out[many] = 2.0 * (np.log(n[many] - 1.0) + np.euler_gamma) - 2.0 * (n[many] - 1.0) / n[many]
+    return out
+
+
+class _FlatForest:
+    """All trees' nodes in shared arrays, with global child indices and self-looping leaves.
+
+    children[2 * node + go_right] is the next node, so a level is three gathers
+    and a compare. Thresholds are stored as the largest float32 not above the
+    sklearn float64 threshold, which gives identical decisions for float32 input.
+    """
+
+    def __init__(self, trees, feature_maps=None):
+        features, thresholds, children, roots = [], [], [], []
+        offset, max_depth = 0, 0
+        for i, tree in enumerate(trees):
+            n = tree.node_count
+            is_leaf = tree.children_left == -1
+            own = np.arange(offset, offset + n, dtype=np.int64)
+            feature = np.where(is_leaf, 0, tree.feature)
+            if feature_maps is not None:
+                feature = np.asarray(feature_maps[i])[feature]
+            features.append(feature.astype(np.intp))
+            threshold = tree.threshold.astype(np.float32)
+            too_high = threshold.astype(np.float64) > tree.threshold
+            threshold[too_high] = np.nextafter(threshold[too_high], np.float32(-np.inf))
+            thresholds.append(threshold)
+            pair = np.empty(2 * n, dtype=np.intp)
+            pair[0::2] = np.where(is_leaf, own, tree.children_left + offset)
+            pair[1::2] = np.where(is_leaf, own, tree.children_right + offset)
+            children.append(pair)
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n
+        self.feature = np.ascontiguousarray(np.concatenate(features))
+        self.threshold = np.ascontiguousarray(np.concatenate(thresholds))
+        # Child indices are global, so each tree's pair block is already offset into this array.
+        self.children = np.ascontiguousarray(np.concatenate(children))
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.max_depth = max_depth
+
+    def leaves(self, X: np.ndarray) -> np.ndarray:
+        """Leaf node index for every (row, tree); X is float32 like sklearn's tree input."""
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        row_base = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+        node = np.broadcast_to(self.roots, (n_rows, len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            values = flat.take(row_base + self.feature.take(node))
+            go_right = values > self.threshold.take(node)
+            node = self.children.take(2 * node + go_right)
+        return node
+
+
+class CompiledModel(abc.ABC):
+    dtype = np.float32  # the input dtype sklearn's own predict uses for this model
+
+    def predict(self, X: Any) -> np.ndarray:
+        X = np.ascontiguousarray(np.asarray(X, dtype=self.dtype))
+        if len(X) <= ROW_BLOCK:
+            return self._predict(X)
+        return np.concatenate([self._predict(X[i:i + ROW_BLOCK]) for i in range(0, len(X), ROW_BLOCK)])
+
+    @abc.abstractmethod
+    def _predict(self, X: np.ndarray) -> np.ndarray:
+        """Labels for one block of at most ROW_BLOCK float32 rows."""
+
+
+class CompiledTreeClassifier(CompiledModel):
+    """DecisionTreeClassifier and RandomForestClassifier (mean of per-tree leaf probabilities)."""
+
+    def __init__(self, estimator):
+        trees = [estimator.tree_] if isinstance(estimator, DecisionTreeClassifier) else [e.tree_ for e in estimator.estimators_]
+        self.forest = _FlatForest(trees)
+        proba = np.concatenate([t.value[:, 0, :] for t in trees]).astype(np.float64)
+        normalizer = proba.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        self.leaf_proba = np.ascontiguousarray(proba / normalizer)
+        self.classes = np.asarray(estimator.classes_)
+
+    def _predict(self, X: np.ndarray) -> np.ndarray:
+        proba = self.leaf_proba[self.forest.leaves(X)].mean(axis=1)
+        return self.classes.take(np.argmax(proba, axis=1))
+
+
+class CompiledIsolationForest(CompiledModel):
+    """Per-leaf path length (depth + c(n_leaf) - 1) summed over trees, then sklearn's offset."""
+
+    def __init__(self, estimator: IsolationForest):
+        trees = [e.tree_ for e in estimator.estimators_]
+        subsampled = estimator._max_features != estimator.n_features_in_
+        self.forest = _FlatForest(trees, estimator.estimators_features_ if subsampled else None)
+        self.path_length = np.ascontiguousarray(np.concatenate([
+            t.compute_node_depths() + _average_path_length(t.n_node_samples) - 1.0 for t in trees
+        ]))
+        self.denominator = len(trees) * _average_path_length(np.array([estimator._max_samples]))[0]
+        self.offset = estimator.offset_
+
+    def score_samples(self, X: np.ndarray) -> np.ndarray:
+        depths = self.path_length[self.forest.leaves(X)].sum(axis=1)
+        if self.denominator == 0:
+            return -np.ones(len(X))
+        return -(2 ** (-depths / self.denominator))
+
+    def _predict(self, X: np.ndarray) -> np.ndarray:
+        return np.where(self.score_samples(X) - self.offset < 0, -1, 1)
+
+
+class CompiledLinearClassifier(CompiledModel):
+    def __init__(self, estimator, scaler: Optional[StandardScaler] = None):
+        coef = estimator.coef_.astype(np.float64)
+        intercept = estimator.intercept_.astype(np.float64)
+        if scaler is not None:
+            # w . (x - mean) / scale + b  ==  (w / scale) . x + (b - (w / scale) . mean)
+            if scaler.scale_ is not None:
+                coef = coef / scaler.scale_
+            if scaler.mean_ is not None:
+                intercept = intercept - coef @ scaler.mean_
+        self.coef = np.ascontiguousarray(coef)
+        self.intercept = intercept
+        self.classes = np.asarray(estimator.classes_)
+
+    dtype = np.float64  # sklearn does not cast linear-model input to float32, so neither do we.
+
+    def predict(self, X: Any) -> np.ndarray:
+        # One dot product: there is no traversal matrix to bound, so no ROW_BLOCK split.
+        return self._predict(np.asarray(X, dtype=self.dtype))
+
+    def _predict(self, X: np.ndarray) -> np.ndarray:
+        scores = X @ self.coef.T + self.intercept
+        if scores.shape[1] == 1:
+            return self.classes[(scores[:, 0] > 0).astype(int)]
+        return self.classes.take(np.argmax(scores, axis=1))
+
+
+def compile_model(estimator) -> Optional[CompiledModel]:
+    """Returns an array-based equivalent of a fitted estimator, or None if it is not supported."""
+    if isinstance(estimator, (DecisionTreeClassifier, RandomForestClassifier)) and estimator.n_outputs_ == 1:
+        return CompiledTreeClassifier(estimator)
+    if isinstance(estimator, IsolationForest):
+        return CompiledIsolationForest(estimator)
+    if isinstance(estimator, (LogisticRegression, SGDClassifier)):
+        return CompiledLinearClassifier(estimator)
+    if (isinstance(estimator, Pipeline) and len(estimator.steps) == 2 and isinstance(estimator[0], StandardScaler)
+            and isinstance(estimator[-1], (LogisticRegression, SGDClassifier))):
+        return CompiledLinearClassifier(estimator[-1], scaler=estimator[0])
+    return None
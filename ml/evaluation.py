@@ -0,0 +1,179 @@
+# evaluation.py
+# Every model in AVAILABLE_MODELS trained and scored side by side on the same data.
+#
+# build_matrix() reads the table once, in chunks through training.featurized_chunks,
+# into a stratified sample of the labeled rows (up to TRAIN_SAMPLE_ROWS, as
+# training uses) and writes it to one .npy file. The models are then fitted
+# concurrently in a pool of EVAL_WORKERS processes. Every worker memory-maps
+# that file and fits a fresh clone of its estimator on the same stratified
+# training split. It is scored on the holdout, EVAL_TEST_FRACTION of the rows,
+# and optionally by stratified k-fold cross-validation of the training split.
+# The sample is balanced between the classes, so every row carries the
+# reservoir's weight for its class. Fits and scores both use it, and precision
+# and recall reflect the table's real fraud rate rather than the sample's 50/50.
+#
+# Recorded per model: fit time, inference rows/sec with the sklearn and the
+# compiled predictor, precision/recall/F1 and the saved artifact's size. Fraud is
+# a prediction of 1, as in detection. The labels are the stored ones (rules and
+# earlier detection runs), so the scores measure agreement with those.
+#
+# Each fitted model is saved as a new registry version but not promoted;
+# POST /model/promote puts the chosen one into service.
+
+import os
+import time
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sklearn.base import clone
+from sklearn.metrics import f1_score, precision_score, recall_score
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from sqlalchemy.orm import Session
+
+from app import database
+from ml import compiled, model, training
+
+ALL_MODELS = "all"  # the model_name of an evaluation job in training_jobs
+EVAL_TEST_FRACTION = float(os.getenv("EVAL_TEST_FRACTION", "0.25"))
+EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", "0")) or min(len(model.AVAILABLE_MODELS), os.cpu_count() or 1)
+EVAL_MIN_PRECISION = float(os.getenv("EVAL_MIN_PRECISION", "0.5"))  # defaults for GET /model/evaluations/best
+EVAL_MIN_RECALL = float(os.getenv("EVAL_MIN_RECALL", "0.5"))
+EVAL_PREDICT_REPEATS = 3  # inference throughput is the best of this many passes over the holdout
+SEED = 42
+
+Progress = Callable[..., None]
+OnResult = Callable[[Dict[str, Any]], None]
+
+
+def build_matrix(db: Session, path: str, progress: Progress, cv_folds: int = 0,
+                 chunk_size: int = training.TRAIN_CHUNK_SIZE, sample_rows: int = training.TRAIN_SAMPLE_ROWS) -> Tuple[int, int]:
+    """Writes the sampled labeled rows to `path` as one float array: FEATURES, the row's weight, then the label.
+    Returns (rows, fraud rows)."""
+    table = database.Transaction.__table__
+    total = db.execute(sqlalchemy.select(sqlalchemy.func.count()).select_from(table)).scalar()
+    progress(phase="reading", rows_read=0, rows_total=total)
+    reservoir = training.StratifiedReservoir(sample_rows // 2)
+    rows_read = 0
+    for chunk in training.featurized_chunks(db, chunk_size=chunk_size):
+        rows_read += len(chunk)
+        labeled = chunk[chunk["is_fraud"] != -1]
+        if len(labeled):
+            reservoir.add(labeled[model.FEATURES].to_numpy(dtype=np.float64), labeled["is_fraud"].to_numpy(dtype=int))
+        progress(phase="reading", rows_read=rows_read, rows_total=total)
+
+    X, y = reservoir.sample()
+    fraud = int((y == 1).sum())
+    if len(y) < training.MIN_LABELED_ROWS:
+        raise ValueError(f"Need >={training.MIN_LABELED_ROWS} labeled rows. Run IsolationForest first.")
+    # Each class needs a row on both sides of the holdout split and in every fold.
+    needed = max(2, cv_folds)
+    if min(fraud, len(y) - fraud) < needed:
+        raise ValueError(f"Need at least {needed} labeled rows of each class; detection has to flag some fraud first.")
+    np.save(path, np.column_stack((X, reservoir.weights(y), y)))
+    return len(y), fraud
+
+
+def _split(y: np.ndarray, test_fraction: float) -> Tuple[np.ndarray, np.ndarray]:
+    return train_test_split(np.arange(len(y)), test_size=test_fraction, stratify=y, random_state=SEED)
+
+
+def _fit(model_name: str, X: pd.DataFrame, y: np.ndarray, weights: np.ndarray) -> Tuple[Any, float]:
+    estimator = clone(model.AVAILABLE_MODELS[model_name])
+    started = time.perf_counter()
+    if model_name == "IsolationForest":
+        estimator.fit(X)
+    else:
+        training.fit_weighted(estimator, X, y, weights)
+    return estimator, time.perf_counter() - started
+
+
+def _scores(y_true: np.ndarray, predictions: np.ndarray, weights: np.ndarray) -> Dict[str, float]:
+    flagged = (predictions == 1).astype(int)
+    return {
+        "precision": round(float(precision_score(y_true, flagged, sample_weight=weights, zero_division=0)), 4),
+        "recall": round(float(recall_score(y_true, flagged, sample_weight=weights, zero_division=0)), 4),
+        "f1": round(float(f1_score(y_true, flagged, sample_weight=weights, zero_division=0)), 4),
+    }
+
+
+def _rows_per_sec(predictor, X: pd.DataFrame) -> float:
+    best = min(_timed(predictor.predict, X) for _ in range(EVAL_PREDICT_REPEATS))
+    return round(len(X) / best, 1) if best > 0 else float("inf")
+
+
+def _timed(fn: Callable, *args) -> float:
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def evaluate_model(model_name: str, path: str, test_fraction: float = EVAL_TEST_FRACTION,
+                   cv_folds: int = 0) -> Tuple[Dict[str, Any], Any]:
+    """Fits and scores one model on the matrix at `path`. Runs in a pool worker; returns (result, fitted estimator)."""
+    data = np.load(path, mmap_mode="r")
+    X = pd.DataFrame(np.asarray(data[:, :-2]), columns=model.FEATURES)
+    w = np.asarray(data[:, -2])
+    y = np.asarray(data[:, -1]).astype(int)
+    train_idx, test_idx = _split(y, test_fraction)
+    X_train, y_train, w_train, X_test = X.iloc[train_idx], y[train_idx], w[train_idx], X.iloc[test_idx]
+
+    estimator, fit_seconds = _fit(model_name, X_train, y_train, w_train)
+    fast = compiled.compile_model(estimator)
+    result: Dict[str, Any] = {
+        "model_name": model_name,
+        "train_rows": len(train_idx),
+        "test_rows": len(test_idx),
+        "fit_seconds": round(fit_seconds, 4),
+        "sklearn_rows_per_sec": _rows_per_sec(estimator, X_test),
+        "compiled_rows_per_sec": _rows_per_sec(fast, X_test) if fast is not None else None,
+        **_scores(y[test_idx], estimator.predict(X_test), w[test_idx]),
+    }
+    if cv_folds >= 2:
+        folds = [
+            _scores(y_train[held], _fit(model_name, X_train.iloc[kept], y_train[kept], w_train[kept])[0]
+                    .predict(X_train.iloc[held]), w_train[held])
+            for kept, held in StratifiedKFold(cv_folds, shuffle=True, random_state=SEED).split(X_train, y_train)
+        ]
+        result["cv"] = {"folds": cv_folds, **{k: round(float(np.mean([f[k] for f in folds])), 4) for k in folds[0]}}
+    return result, estimator
+
+
+def _artifact_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def evaluate_all(db: Session, progress: Progress, on_result: OnResult, cv_folds: int = 0,
+                 test_fraction: float = EVAL_TEST_FRACTION, workers: int = EVAL_WORKERS) -> List[Dict[str, Any]]:
+    """Trains and scores every model; `on_result` receives each model's result (or error) as it finishes."""
+    names = list(model.AVAILABLE_MODELS)
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory(prefix="evaluation-") as tmp:
+        path = os.path.join(tmp, "features.npy")
+        rows, fraud = build_matrix(db, path, progress, cv_folds)
+        logging.info(f"📊 Evaluating {len(names)} models on {rows} labeled rows ({fraud} fraud)")
+        progress(phase="fitting")
+        # spawn, as for training jobs; the workers only read the matrix file.
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(names))),
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {pool.submit(evaluate_model, name, path, test_fraction, cv_folds): name for name in names}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    result, estimator = future.result()
+                    scores = {k: result[k] for k in ("precision", "recall", "f1")}
+                    handle = model.registry.save(name, estimator, model.FEATURES, promote=False,
+                                                 rows=result["train_rows"], mode="evaluation", evaluation=scores)
+                    result.update(status="ok", version=handle.version, artifact_bytes=_artifact_bytes(handle.path))
+                except Exception as e:
+                    logging.error(f"❌ Evaluating {name} failed: {e}")
+                    result = {"model_name": name, "status": "error", "error": str(e)}
+                results.append(result)
+                on_result(result)
+                progress(phase=f"fitting ({len(results)}/{len(names)} models)")
+    return results
@@ -0,0 +1,218 @@
+# features.py
+# Per-card velocity features shared by training, batch detection and scoring.
+#
+# For every transaction we compute, over the card's trailing 1h / 24h / 7d
+# windows (current transaction included), the txn count and the amount
+# sum / mean / max, plus the seconds since the card's previous transaction.
+# Each chunk is computed with NumPy over (card history + chunk) sorted by card
+# and time; the history comes from a CardStateStore that keeps only the last
+# 7 days per card, so nothing is re-scanned from the database between chunks.
+
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+from app import database
+
+WINDOWS: Dict[str, int] = {"1h": 3600, "24h": 86400, "7d": 7 * 86400}  # seconds
+HORIZON = max(WINDOWS.values())
+MAX_EVENTS_PER_CARD = 1000  # keeps state compact for very hot cards; older events are dropped first
+
+FEATURE_COLUMNS: List[str] = ["amount"] + [
+    f"{stat}_{window}" for window in WINDOWS for stat in ("txn_count", "amount_sum", "amount_mean", "amount_max")
+] + ["secs_since_prev"]
+
+_MS = 1000
+HistoryLoader = Callable[[List[str], pd.Timestamp], pd.DataFrame]
+
+
+class CardStateStore:
+    """Recent (timestamp, amount) events per card token, pruned to the feature horizon."""
+
+    def __init__(self):
+        self._events: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}  # token -> (epoch ms int64, amount float64)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._events.clear()
+
+    def missing(self, tokens: Iterable[str]) -> List[str]:
+        return [t for t in tokens if t not in self._events]
+
+    def history(self, tokens: Iterable[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns (token, ts_ms, amount) arrays for the stored events of `tokens`."""
+        toks, ts, amounts = [], [], []
+        with self._lock:
+            for token in tokens:
+                events = self._events.get(token)
+                if events is not None and len(events[0]):
+                    toks.append(np.full(len(events[0]), token, dtype=object))
+                    ts.append(events[0])
+                    amounts.append(events[1])
+        if not toks:
+            return np.array([], dtype=object), np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        return np.concatenate(toks), np.concatenate(ts), np.concatenate(amounts)
+
+    def replace(self, tokens: np.ndarray, ts: np.ndarray, amounts: np.ndarray, seeded: Iterable[str] = ()) -> None:
+        """Stores the given card-sorted events, keeping each card's last HORIZON seconds."""
+        with self._lock:
+            for token in seeded:
+                self._events.setdefault(token, (np.array([], dtype=np.int64), np.array([], dtype=np.float64)))
+            if not len(tokens):
+                return
+            bounds = np.flatnonzero(tokens[1:] != tokens[:-1]) + 1
+            starts = np.concatenate(([0], bounds))
+            ends = np.concatenate((bounds, [len(tokens)]))
+            for start, end in zip(starts, ends):
+                card_ts = ts[start:end]
+                keep = max(int(np.searchsorted(card_ts, card_ts[-1] - HORIZON * _MS, side="right")), end - start - MAX_EVENTS_PER_CARD)
+                self._events[tokens[start]] = (card_ts[keep:].copy(), amounts[start:end][keep:].copy())
+
+
+def _window_max(values: np.ndarray, left: np.ndarray) -> np.ndarray:
+    """max(values[left[i]..i]) for every i, via a sparse table (O(n log n), fully vectorized)."""
+    n = len(values)
+    table = [values]
+    span = 1
+    while span * 2 <= n:
+        prev = table[-1]
+        table.append(np.maximum(prev[:-span], prev[span:]))
+        span *= 2
+    right = np.arange(n)
+    length = right - left + 1
+    level = np.floor(np.log2(length)).astype(np.int64)
+    out = np.empty(n, dtype=values.dtype)
+    for k in np.unique(level):
+        idx = np.flatnonzero(level == k)
+        out[idx] = np.maximum(table[k][left[idx]], table[k][right[idx] - (1 << k) + 1])
+    return out
+
+
+def _compute_sorted(codes: np.ndarray, ts: np.ndarray, amounts: np.ndarray) -> Dict[str, np.ndarray]:
+    """Window features for events sorted by (card code, ts)."""
+    n = len(ts)
+    # Shift each card into its own disjoint time range so one searchsorted finds every window start.
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    group = np.cumsum(np.r_[True, codes[1:] != codes[:-1]]) - 1
+    group_min = ts[starts]
+    group_span = np.maximum.reduceat(ts, starts) - group_min + (HORIZON + 1) * _MS
+    base = np.concatenate(([0], np.cumsum(group_span)[:-1]))
+    shifted = ts - group_min[group] + base[group]
+
+    csum = np.concatenate(([0.0], np.cumsum(amounts)))
+    idx = np.arange(n)
+    out: Dict[str, np.ndarray] = {}
+    for window, seconds in WINDOWS.items():
+        left = np.searchsorted(shifted, shifted - seconds * _MS, side="right")
+        count = (idx - left + 1).astype(np.float64)
+        total = csum[idx + 1] - csum[left]
+        out[f"txn_count_{window}"] = count
+        out[f"amount_sum_{window}"] = total
+        out[f"amount_mean_{window}"] = total / count
+        out[f"amount_max_{window}"] = _window_max(amounts, left)
+
+    gap = np.full(n, float(HORIZON))
+    same_card = np.r_[False, codes[1:] == codes[:-1]]
+    gap[same_card] = np.minimum(np.diff(ts)[same_card[1:]] / _MS, HORIZON)
+    out["secs_since_prev"] = gap
+    return out
+
+
+def _to_epoch_ms(timestamps: pd.Series) -> np.ndarray:
+    return pd.to_datetime(timestamps).to_numpy(dtype="datetime64[ms]").astype(np.int64)
+
+
+def compute(df: pd.DataFrame, store: Optional[CardStateStore] = None, loader: Optional[HistoryLoader] = None,
+            update: bool = True) -> pd.DataFrame:
+    """Returns FEATURE_COLUMNS for `df` (needs card_token, timestamp, amount), aligned to df.index.
+
+    With a store, each card's prior events are taken from (and, if `update`,
+    appended to) the store. Cards the store has not seen are seeded once
+    through `loader`. Without a store, only the rows in `df` are used.
+    Rows without a card token are treated as a card's first transaction.
+    """
+    n = len(df)
+    if n == 0:
+        return pd.DataFrame(index=df.index, columns=FEATURE_COLUMNS, dtype=np.float64)
+    amounts = df["amount"].to_numpy(dtype=np.float64)
+    ts = _to_epoch_ms(df["timestamp"]) if "timestamp" in df else np.zeros(n, dtype=np.int64)
+    tokens = df["card_token"].to_numpy(dtype=object) if "card_token" in df else np.full(n, None, dtype=object)
+    has_token = pd.notna(tokens) & (tokens != "")
+
+    # Start from singleton windows, which is what tokenless rows keep.
+    columns: Dict[str, np.ndarray] = {"amount": amounts}
+    for window in WINDOWS:
+        columns[f"txn_count_{window}"] = np.ones(n)
+        columns[f"amount_sum_{window}"] = amounts.copy()
+        columns[f"amount_mean_{window}"] = amounts.copy()
+        columns[f"amount_max_{window}"] = amounts.copy()
+    columns["secs_since_prev"] = np.full(n, float(HORIZON))
+    if not has_token.any():
+        return pd.DataFrame(columns, index=df.index)[FEATURE_COLUMNS]
+
+    new_tokens = tokens[has_token]
+    unique_tokens = pd.unique(new_tokens)
+    hist_tokens = np.array([], dtype=object)
+    hist_ts = np.array([], dtype=np.int64)
+    hist_amounts = np.array([], dtype=np.float64)
+    seeded: List[str] = []
+    if store is not None:
+        if loader is not None:
+            seeded = store.missing(unique_tokens)
+            if seeded:
+                loaded = loader(seeded, pd.Timestamp(ts[has_token].min(), unit="ms"))
+                if len(loaded):
+                    loaded = loaded.sort_values(["card_token", "timestamp"], kind="stable")
+                    store.replace(loaded["card_token"].to_numpy(dtype=object), _to_epoch_ms(loaded["timestamp"]),
+                                  loaded["amount"].to_numpy(dtype=np.float64))
+        hist_tokens, hist_ts, hist_amounts = store.history(unique_tokens)
+
+    all_tokens = np.concatenate((hist_tokens, new_tokens))
+    all_ts = np.concatenate((hist_ts, ts[has_token]))
+    all_amounts = np.concatenate((hist_amounts, amounts[has_token]))
+    is_new = np.r_[np.zeros(len(hist_tokens), dtype=bool), np.ones(len(new_tokens), dtype=bool)]
+    codes, uniques = pd.factorize(all_tokens)
+    order = np.lexsort((is_new, all_ts, codes))  # history before new rows on equal timestamps
+
+    sorted_features = _compute_sorted(codes[order], all_ts[order], all_amounts[order])
+    new_positions = np.flatnonzero(has_token)
+    new_in_sorted = is_new[order]
+    target = new_positions[order[new_in_sorted] - len(hist_tokens)]
+    for name, values in sorted_features.items():
+        columns[name][target] = values[new_in_sorted]
+
+    if store is not None and update:
+        store.replace(uniques[codes[order]], all_ts[order], all_amounts[order], seeded=seeded)
+    return pd.DataFrame(columns, index=df.index)[FEATURE_COLUMNS]
+
+
+def db_history_loader(db: Session, before_id: Optional[int] = None) -> HistoryLoader:
+    """Seeds unseen cards from rows within the horizon, via the card_token index.
+
+    The rows are the already-labeled ones, or with `before_id` every row with a
+    smaller id (a detection shard or training pass that starts mid-table).
+    """
+    table = database.Transaction.__table__
+    scope = table.c.is_fraud != -1 if before_id is None else table.c.id < before_id
+
+    def load(tokens: List[str], before: pd.Timestamp) -> pd.DataFrame:
+        since = (before - pd.Timedelta(seconds=HORIZON)).to_pydatetime()
+        frames = []
+        for i in range(0, len(tokens), 500):
+            stmt = sqlalchemy.select(table.c.card_token, table.c.timestamp, table.c.amount).where(
+                table.c.card_token.in_(tokens[i:i + 500]),
+                scope,
+                table.c.timestamp >= since,
+            )
+            frames.append(pd.read_sql(stmt, db.bind))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["card_token", "timestamp", "amount"])
+
+    return load
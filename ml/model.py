@@ -1,88 +1,131 @@
 # model.py
 
 import os
-import joblib
+import logging
 import pandas as pd
-from typing import Any, List, Optional, Dict
+from typing import Any, Iterator, List, Optional
+from collections.abc import Mapping
+from sklearn.base import clone
 from sqlalchemy.orm import Session
 from sklearn.ensemble import IsolationForest, RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
 from sklearn.tree import DecisionTreeClassifier
 
-from app import database
+from ml import features
+from ml.registry import ModelHandle, ModelRegistry
 
 MODELS_DIR = "ml/saved_models/"
-FEATURES: Optional[List[str]] = None
+# "sklearn" calls the estimator; "compiled" evaluates the flattened arrays from ml/compiled.py.
+PREDICT_BACKEND = os.getenv("PREDICT_BACKEND", "sklearn")
+FEATURES: List[str] = features.FEATURE_COLUMNS
 
 AVAILABLE_MODELS = {
     "IsolationForest": IsolationForest(n_estimators=100, contamination="auto", random_state=42),
     "LogisticRegression": LogisticRegression(solver='liblinear', random_state=42),
     "DecisionTree": DecisionTreeClassifier(max_depth=5, random_state=42),
-    "RandomForest": RandomForestClassifier(n_estimators=50, max_depth=10, random_state=42)
+    "RandomForest": RandomForestClassifier(n_estimators=50, max_depth=10, random_state=42),
+    # Learns with partial_fit, so it can be updated on new labels without a full retrain (see ml/training.py).
+    "SGDClassifier": Pipeline([("scale", StandardScaler()), ("clf", SGDClassifier(loss="log_loss", random_state=42))]),
 }
 
-_models: Dict[str, Any] = {}
+registry = ModelRegistry(MODELS_DIR)
 
-def train_model_from_df(df: pd.DataFrame, model_name: str) -> None:
-    global _models, FEATURES
+class _PromotedModels(Mapping):
+    """Read-only name -> estimator view of the registry's promoted versions, loaded on first use."""
+
+    def __getitem__(self, name: str) -> Any:
+        return registry.get(name).estimator
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and registry.current_version(name) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name in AVAILABLE_MODELS if name in self)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+_models: Mapping = _PromotedModels()
+
+# Per-card history for the velocity features, carried across detection chunks and runs.
+feature_store = features.CardStateStore()
+
+def add_features(df: pd.DataFrame, db: Optional[Session] = None, store: Optional[features.CardStateStore] = None,
+                 update: bool = True, before_id: Optional[int] = None) -> pd.DataFrame:
+    """Returns `df` with the feature columns computed (or recomputed) from its raw columns.
+
+    Pass `db` and `store` to use and extend the per-card history; without them
+    only the rows in `df` are used. Cards new to the store are seeded from the
+    database (see features.db_history_loader for `before_id`).
+    """
+    loader = features.db_history_loader(db, before_id) if db is not None and store is not None else None
+    feats = features.compute(df, store=store, loader=loader, update=update)
+    return df.drop(columns=[c for c in FEATURES if c in df.columns]).join(feats)
+
+def _has_features(df: pd.DataFrame) -> bool:
+    return all(c in df.columns for c in FEATURES)
+
+def train_model_from_df(df: pd.DataFrame, model_name: str) -> ModelHandle:
+    """Trains on raw transactions (card_token, timestamp, amount[, is_fraud]) or an already featurized frame.
+
+    The result is saved as a new registry version and promoted; jobs holding the
+    previous version's handle keep using it.
+    """
     if model_name not in AVAILABLE_MODELS:
         raise ValueError(f"Model '{model_name}' not available.")
-    numeric_df = df.select_dtypes(include=["number"])
-    if numeric_df.empty:
-        raise ValueError("No numeric columns available.")
-    if FEATURES is None:
-        FEATURES = numeric_df.columns.tolist()
-    numeric_df = numeric_df.reindex(columns=FEATURES, fill_value=0)
-    clf = AVAILABLE_MODELS[model_name]
+    if not _has_features(df):
+        df = add_features(df)
+    X = df[FEATURES].astype(float)
+    clf = clone(AVAILABLE_MODELS[model_name])
 
     if model_name == "IsolationForest":
-        clf.fit(numeric_df)
+        clf.fit(X)
     else:
         if 'is_fraud' not in df.columns:
             raise ValueError(f"Supervised model '{model_name}' requires 'is_fraud'.")
-        target = df['is_fraud'].astype(int)
-        features_to_train = [f for f in FEATURES if f != 'is_fraud']
-        clf.fit(numeric_df[features_to_train], target)
+        clf.fit(X, df['is_fraud'].astype(int))
 
-    _models[model_name] = clf
-    os.makedirs(MODELS_DIR, exist_ok=True)
-    joblib.dump((clf, FEATURES), os.path.join(MODELS_DIR, f"{model_name}.pkl"))
-    print(f"✅ Trained {model_name} on {len(df)} rows.")
-
-def train_model(db: Session, model_name: str) -> None:
-    df = pd.read_sql(db.query(database.Transaction).statement, db.bind)
-    if df.empty:
-        raise ValueError("No data in DB to train.")
-    if model_name != "IsolationForest":
-        labeled_df = df[df['is_fraud'] != -1]
-        if len(labeled_df) < 10:
-            raise ValueError(f"Need >=10 labeled rows. Run IsolationForest first.")
-        df_train = labeled_df
-    else:
-        df_train = df
-    df_train = df_train.drop(columns=['id','card_number_encrypted','explanation','timestamp'], errors='ignore')
-    train_model_from_df(df_train, model_name)
+    handle = registry.save(model_name, clf, FEATURES, rows=len(df))
+    logging.info(f"✅ Trained {model_name} v{handle.version} on {len(df)} rows.")
+    return handle
 
 def load_models() -> None:
-    global _models, FEATURES
+    """Reports the promoted version of each model. Artifacts themselves load lazily on first use."""
     os.makedirs(MODELS_DIR, exist_ok=True)
     for name in AVAILABLE_MODELS:
-        path = os.path.join(MODELS_DIR, f"{name}.pkl")
-        if os.path.exists(path):
-            try:
-                model, feats = joblib.load(path)
-                _models[name] = model
-                FEATURES = FEATURES or feats
-                print(f"✅ Loaded {name} from {path}")
-            except Exception as e:
-                print(f"⚠️ Could not load {name}: {e}")
-
-def predict(df: pd.DataFrame, model_name: str) -> pd.Series:
-    if model_name not in _models or FEATURES is None:
+        version = registry.current_version(name)
+        if version is not None:
+            logging.info(f"✅ Found {name} v{version} in {MODELS_DIR}")
+
+def get_handle(model_name: str) -> ModelHandle:
+    """The promoted version of `model_name`. Hold on to it for a whole job to be immune to hot swaps."""
+    try:
+        return registry.get(model_name)
+    except KeyError:
         raise Exception(f"Model '{model_name}' not loaded.")
-    model = _models[model_name]
-    numeric_df = df.select_dtypes(include=["number"]).reindex(columns=FEATURES, fill_value=0.0)
-    if model_name != "IsolationForest":
-        features = [f for f in FEATURES if f != 'is_fraud']
-        numeric_df = numeric_df[features]
-    return pd.Series(model.predict(numeric_df), index=df.index)
+
+def model_inputs(df: pd.DataFrame, model_name: str, handle: Optional[ModelHandle] = None) -> pd.DataFrame:
+    """The float feature frame the model expects, computing features if `df` lacks them."""
+    handle = handle or get_handle(model_name)
+    feats = handle.features
+    if any(f in FEATURES and f not in df.columns for f in feats):
+        df = add_features(df)
+    # Models saved before the feature pipeline were trained on ['amount', 'is_fraud'].
+    if handle.name != "IsolationForest":
+        feats = [f for f in feats if f != 'is_fraud']
+    return df.reindex(columns=feats, fill_value=0.0).astype(float)
+
+def get_predictor(model_name: str, backend: Optional[str] = None, handle: Optional[ModelHandle] = None):
+    """The object whose .predict() scores model_inputs(): the compiled model when selected and available."""
+    handle = handle or get_handle(model_name)
+    if (backend or PREDICT_BACKEND) == "compiled" and handle.compiled is not None:
+        return handle.compiled
+    return handle.estimator
+
+def predict(df: pd.DataFrame, model_name: str, backend: Optional[str] = None,
+            handle: Optional[ModelHandle] = None) -> pd.Series:
+    handle = handle or get_handle(model_name)
+    numeric_df = model_inputs(df, model_name, handle)
+    return pd.Series(get_predictor(model_name, backend, handle).predict(numeric_df), index=df.index)
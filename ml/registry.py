@@ -0,0 +1,205 @@
+# registry.py
+# Versioned model artifacts with lazy, memory-mapped loading.
+#
+#   {models_dir}/{name}/v0003/model.joblib     sklearn estimator
+#   {models_dir}/{name}/v0003/compiled.joblib  ml/compiled.py arrays
+#   {models_dir}/{name}/v0003/meta.json        feature schema, row count, timestamps
+#   {models_dir}/{name}/CURRENT                version number of the promoted artifact
+#
+# A version directory is written under a temporary name and renamed into place,
+# and CURRENT is replaced with os.replace, so readers only ever see a complete
+# artifact and promotion is a single atomic switch. The rename also allocates
+# the version number: it fails if another process (a training or evaluation
+# job) renamed the same vNNNN first, and the save moves on to the next number. Nothing is loaded until a
+# version is first used; arrays are opened with mmap_mode="r" so every worker
+# process maps the same page-cache pages instead of holding its own copy.
+# Callers take a ModelHandle for the duration of a job; a later promotion does
+# not change the handle they already hold.
+#
+# Flat {name}.pkl files from before the registry are served as version 0.
+
+import os
+import json
+import errno
+import shutil
+import tempfile
+import threading
+import datetime
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import joblib
+
+from ml import compiled
+
+LEGACY_VERSION = 0
+
+
+@dataclass(frozen=True, eq=False)
+class ModelHandle:
+    """One immutable model version. The estimator and compiled arrays load on first access."""
+    name: str
+    version: int
+    features: List[str]
+    path: str
+    meta: Dict[str, Any] = field(default_factory=dict)
+    _cache: Dict[str, Any] = field(default_factory=dict, repr=False, compare=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    @property
+    def estimator(self):
+        with self._lock:
+            if "estimator" not in self._cache:
+                if self.version == LEGACY_VERSION:
+                    self._cache["estimator"] = joblib.load(self.path, mmap_mode="r")[0]
+                else:
+                    self._cache["estimator"] = joblib.load(os.path.join(self.path, "model.joblib"), mmap_mode="r")
+            return self._cache["estimator"]
+
+    def load_copy(self):
+        """A private, writable copy of the estimator (the cached one is memory-mapped read-only), e.g. for partial_fit."""
+        if self.version == LEGACY_VERSION:
+            return joblib.load(self.path)[0]
+        return joblib.load(os.path.join(self.path, "model.joblib"))
+
+    @property
+    def compiled(self) -> Optional[compiled.CompiledModel]:
+        path = os.path.join(self.path, "compiled.joblib")
+        if self.version != LEGACY_VERSION and os.path.exists(path):
+            with self._lock:
+                if "compiled" not in self._cache:
+                    self._cache["compiled"] = joblib.load(path, mmap_mode="r")
+                return self._cache["compiled"]
+        estimator = self.estimator
+        with self._lock:
+            if "compiled" not in self._cache:
+                self._cache["compiled"] = compiled.compile_model(estimator)
+            return self._cache["compiled"]
+
+
+class ModelRegistry:
+    def __init__(self, models_dir: str):
+        self.models_dir = models_dir
+        self._lock = threading.Lock()
+        self._handles: Dict[Tuple[str, int], ModelHandle] = {}
+        self._current: Dict[str, Tuple[Tuple[int, int, int], Optional[int]]] = {}  # name -> (CURRENT stat, version)
+
+    # --- Paths ---
+    def _model_dir(self, name: str) -> str:
+        return os.path.join(self.models_dir, name)
+
+    def _version_dir(self, name: str, version: int) -> str:
+        return os.path.join(self._model_dir(name), f"v{version:04d}")
+
+    def _legacy_path(self, name: str) -> str:
+        return os.path.join(self.models_dir, f"{name}.pkl")
+
+    # --- Versions ---
+    def versions(self, name: str) -> List[int]:
+        found = []
+        if os.path.isdir(self._model_dir(name)):
+            for entry in os.listdir(self._model_dir(name)):
+                if entry.startswith("v") and entry[1:].isdigit():
+                    found.append(int(entry[1:]))
+        if os.path.exists(self._legacy_path(name)):
+            found.append(LEGACY_VERSION)
+        return sorted(found)
+
+    def current_version(self, name: str) -> Optional[int]:
+        """The promoted version; re-read only when the CURRENT file changes, so other processes' promotions are seen."""
+        pointer = os.path.join(self._model_dir(name), "CURRENT")
+        try:
+            st = os.stat(pointer)
+        except FileNotFoundError:
+            return LEGACY_VERSION if os.path.exists(self._legacy_path(name)) else None
+        # promote() swaps in a new file, so the inode changes even when the mtime tick does not.
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        cached = self._current.get(name)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        with open(pointer) as f:
+            version = int(f.read().strip())
+        self._current[name] = (signature, version)
+        return version
+
+    def describe(self, name: str) -> List[Dict[str, Any]]:
+        current = self.current_version(name)
+        return [{**self.get(name, v).meta, "version": v, "current": v == current} for v in self.versions(name)]
+
+    # --- Loading ---
+    def get(self, name: str, version: Optional[int] = None) -> ModelHandle:
+        """The handle for `version` (default: the promoted one). Raises KeyError if there is none."""
+        if version is None:
+            version = self.current_version(name)
+            if version is None:
+                raise KeyError(name)
+        key = (name, version)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is None:
+                handle = self._open(name, version)
+                self._handles[key] = handle
+            return handle
+
+    def _open(self, name: str, version: int) -> ModelHandle:
+        if version == LEGACY_VERSION:
+            path = self._legacy_path(name)
+            if not os.path.exists(path):
+                raise KeyError(name)
+            estimator, feats = joblib.load(path)
+            handle = ModelHandle(name, version, list(feats), path, {"legacy": True})
+            handle._cache["estimator"] = estimator
+            return handle
+        path = self._version_dir(name, version)
+        if not os.path.isdir(path):
+            raise KeyError(name)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        return ModelHandle(name, version, meta["features"], path, meta)
+
+    # --- Writing ---
+    def save(self, name: str, estimator, features: List[str], promote: bool = True, **meta) -> ModelHandle:
+        """Writes a new version (estimator, compiled arrays, meta) and, by default, promotes it."""
+        os.makedirs(self._model_dir(name), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self._model_dir(name))
+        try:
+            # Uncompressed dumps, so numpy arrays can be memory-mapped on load.
+            joblib.dump(estimator, os.path.join(staging, "model.joblib"))
+            fast = compiled.compile_model(estimator)
+            if fast is not None:
+                joblib.dump(fast, os.path.join(staging, "compiled.joblib"))
+            with self._lock:
+                version = max(self.versions(name) + [LEGACY_VERSION]) + 1
+                while True:
+                    info = {
+                        "name": name,
+                        "version": version,
+                        "features": list(features),
+                        "created_at": datetime.datetime.utcnow().isoformat(),
+                        **meta,
+                    }
+                    with open(os.path.join(staging, "meta.json"), "w") as f:
+                        json.dump(info, f, indent=2)
+                    try:
+                        os.rename(staging, self._version_dir(name, version))
+                        break
+                    except OSError as e:
+                        # Another process took this number; the lock only covers this one.
+                        if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                            raise
+                        version += 1
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if promote:
+            self.promote(name, version)
+        return self.get(name, version)
+
+    def promote(self, name: str, version: int) -> None:
+        if version not in self.versions(name):
+            raise KeyError(f"{name} v{version}")
+        os.makedirs(self._model_dir(name), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".CURRENT-", dir=self._model_dir(name))
+        with os.fdopen(fd, "w") as f:
+            f.write(str(version))
+        os.replace(tmp, os.path.join(self._model_dir(name), "CURRENT"))
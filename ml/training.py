@@ -0,0 +1,206 @@
+# training.py
+# Out-of-core training: the transactions table is read in keyset-paginated
+# chunks (id order), featurized through a CardStateStore as detection does,
+# and never held in memory whole.
+#
+#   partial_fit estimators (SGDClassifier)  learn chunk by chunk; with
+#       incremental=True they continue from the promoted version on the rows
+#       added since it was trained (its meta "last_id").
+#   everything else                       is fitted on a stratified reservoir
+#       sample: up to TRAIN_SAMPLE_ROWS rows, split evenly between the labels,
+#       so rare fraud rows are all kept while legit rows are sampled uniformly.
+#       Each row is weighted by its class's rows seen / rows kept, so the fit
+#       sees the table's class balance rather than the sample's.
+#
+# app/training_jobs.py runs train() in a separate process; `progress` receives
+# phase and row counts after every chunk.
+
+import os
+import logging
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sklearn.base import clone
+from sklearn.pipeline import Pipeline
+from sklearn.utils.validation import has_fit_parameter
+from sqlalchemy.orm import Session
+
+from app import database
+from ml import features, model
+from ml.registry import ModelHandle
+
+TRAIN_CHUNK_SIZE = int(os.getenv("TRAIN_CHUNK_SIZE", "50000"))
+TRAIN_SAMPLE_ROWS = int(os.getenv("TRAIN_SAMPLE_ROWS", "200000"))
+MIN_LABELED_ROWS = 10
+CLASSES = np.array([0, 1])
+
+Progress = Callable[..., None]
+
+
+class StratifiedReservoir:
+    """A uniform sample of up to `capacity` rows per stratum (Algorithm R), fed chunk by chunk."""
+
+    def __init__(self, capacity: int, seed: int = 42):
+        self.capacity = capacity
+        self._rng = np.random.default_rng(seed)
+        self._rows: Dict[int, np.ndarray] = {}
+        self.seen: Dict[int, int] = {}
+
+    def add(self, X: np.ndarray, strata: np.ndarray) -> None:
+        for stratum in np.unique(strata):
+            self._add(int(stratum), X[strata == stratum])
+
+    def _add(self, stratum: int, rows: np.ndarray) -> None:
+        seen = self.seen.get(stratum, 0)
+        kept = self._rows.get(stratum, np.empty((0, rows.shape[1])))
+        fill = min(self.capacity - len(kept), len(rows))
+        if fill:
+            kept = np.vstack((kept, rows[:fill]))
+        rest = rows[fill:]
+        if len(rest):
+            # Row k of the stream (0-based) replaces a random slot with probability capacity / (k + 1).
+            positions = seen + fill + np.arange(len(rest))
+            slots = self._rng.integers(0, positions + 1)
+            keep = slots < self.capacity
+            kept[slots[keep]] = rest[keep]
+        self._rows[stratum] = kept
+        self.seen[stratum] = seen + len(rows)
+
+    def weights(self, strata: np.ndarray) -> np.ndarray:
+        """Per-row sample_weight undoing the per-stratum sampling rates, scaled to average 1 over the sample."""
+        rate = {s: len(self._rows[s]) / self.seen[s] for s in self._rows}
+        kept, seen = sum(len(r) for r in self._rows.values()), sum(self.seen[s] for s in self._rows)
+        return np.array([1.0 / rate[int(s)] for s in strata]) * (kept / seen)
+
+    def sample(self) -> Tuple[np.ndarray, np.ndarray]:
+        strata = sorted(self._rows)
+        if not strata:
+            return np.empty((0, len(model.FEATURES))), np.empty(0, dtype=int)
+        X = np.vstack([self._rows[s] for s in strata])
+        y = np.concatenate([np.full(len(self._rows[s]), s) for s in strata])
+        return X, y
+
+
+def supports_partial_fit(estimator) -> bool:
+    final = estimator[-1] if isinstance(estimator, Pipeline) else estimator
+    return hasattr(final, "partial_fit")
+
+
+def fit_weighted(estimator, X: pd.DataFrame, y: np.ndarray, sample_weight: np.ndarray) -> None:
+    """fit() with `sample_weight`, routed to every Pipeline step that takes one."""
+    if not isinstance(estimator, Pipeline):
+        estimator.fit(X, y, sample_weight=sample_weight)
+        return
+    params = {f"{name}__sample_weight": sample_weight for name, step in estimator.steps
+              if has_fit_parameter(step, "sample_weight")}
+    estimator.fit(X, y, **params)
+
+
+def _partial_fit(estimator, X: pd.DataFrame, y: np.ndarray, fit_scaler: bool) -> None:
+    """partial_fit on one chunk; a Pipeline's preprocessing steps are updated first, unless frozen."""
+    if not isinstance(estimator, Pipeline):
+        estimator.partial_fit(X, y, classes=CLASSES)
+        return
+    Xt = X
+    for _, step in estimator.steps[:-1]:
+        if fit_scaler:
+            step.partial_fit(Xt)
+        Xt = step.transform(Xt)
+    estimator[-1].partial_fit(Xt, y, classes=CLASSES)
+
+
+def featurized_chunks(db: Session, after_id: int = 0, chunk_size: int = TRAIN_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """(id, is_fraud, FEATURES) for rows with id > after_id, in id order, one chunk at a time."""
+    table = database.Transaction.__table__
+    store = features.CardStateStore()
+    loader = features.db_history_loader(db, before_id=after_id + 1) if after_id else None
+    last_id = after_id
+    while True:
+        df = pd.read_sql(
+            sqlalchemy.select(table.c.id, table.c.card_token, table.c.timestamp, table.c.amount, table.c.is_fraud)
+            .where(table.c.id > last_id).order_by(table.c.id).limit(chunk_size),
+            db.bind,
+        )
+        if df.empty:
+            return
+        last_id = int(df["id"].iloc[-1])
+        feats = features.compute(df, store=store, loader=loader)
+        yield df[["id", "is_fraud"]].join(feats)
+
+
+def train(db: Session, model_name: str, incremental: bool = False, progress: Optional[Progress] = None,
+          chunk_size: int = TRAIN_CHUNK_SIZE, sample_rows: int = TRAIN_SAMPLE_ROWS) -> ModelHandle:
+    """Trains `model_name` from the transactions table and saves it as a new, promoted registry version."""
+    if model_name not in model.AVAILABLE_MODELS:
+        raise ValueError(f"Model '{model_name}' not available.")
+    progress = progress or (lambda **fields: None)
+    supervised = model_name != "IsolationForest"
+    estimator = clone(model.AVAILABLE_MODELS[model_name])
+    streaming = supports_partial_fit(estimator)
+    meta: Dict[str, Any] = {"mode": "incremental" if incremental else "full"}
+    after_id = 0
+    if incremental:
+        if not streaming:
+            raise ValueError(f"Model '{model_name}' has no partial_fit; retrain it in full.")
+        base = model.get_handle(model_name)
+        estimator = base.load_copy()
+        after_id = int(base.meta.get("last_id", 0))
+        meta["base_version"] = base.version
+
+    table = database.Transaction.__table__
+    total = db.execute(sqlalchemy.select(sqlalchemy.func.count()).where(table.c.id > after_id)).scalar()
+    progress(phase="reading", rows_read=0, rows_total=total)
+
+    reservoir = StratifiedReservoir(sample_rows // 2 if supervised else sample_rows)
+    rows_read = rows_used = 0
+    class_counts = {0: 0, 1: 0}
+    # The next incremental update starts after last_id. Detection labels in id order, so unlabeled rows are
+    # (almost always) a suffix; stopping before the first one means they are picked up once labeled.
+    last_id, first_unlabeled = after_id, None
+    for chunk in featurized_chunks(db, after_id, chunk_size):
+        rows_read += len(chunk)
+        last_id = int(chunk["id"].iloc[-1])
+        if supervised:
+            unlabeled = chunk["is_fraud"].to_numpy() == -1
+            if first_unlabeled is None and unlabeled.any():
+                first_unlabeled = int(chunk["id"].to_numpy()[unlabeled][0])
+            chunk = chunk[~unlabeled]
+        if len(chunk):
+            X = chunk[model.FEATURES].astype(float)
+            y = chunk["is_fraud"].to_numpy(dtype=int) if supervised else np.zeros(len(chunk), dtype=int)
+            if supervised:
+                for label, n in zip(*np.unique(y, return_counts=True)):
+                    class_counts[int(label)] = class_counts.get(int(label), 0) + int(n)
+            if streaming:
+                _partial_fit(estimator, X, y, fit_scaler=not incremental)
+            else:
+                reservoir.add(X.to_numpy(), y)
+            rows_used += len(chunk)
+        progress(phase="reading", rows_read=rows_read, rows_total=total)
+
+    if rows_used < (MIN_LABELED_ROWS if supervised else 1):
+        raise ValueError(f"Need >={MIN_LABELED_ROWS} labeled rows. Run IsolationForest first."
+                         if supervised else "No data in DB to train.")
+    if supervised and not incremental and min(class_counts.values()) == 0:
+        raise ValueError("Labeled rows contain only one class; detection has to flag some fraud first.")
+
+    if not streaming:
+        progress(phase="fitting", rows_read=rows_read, rows_total=total)
+        X, y = reservoir.sample()
+        X = pd.DataFrame(X, columns=model.FEATURES)
+        if supervised:
+            fit_weighted(estimator, X, y, reservoir.weights(y))
+            meta["sample_rates"] = {int(c): round(int((y == c).sum()) / reservoir.seen[int(c)], 6) for c in np.unique(y)}
+        else:
+            estimator.fit(X)
+        meta["sampled_rows"] = len(X)
+
+    progress(phase="saving", rows_read=rows_read, rows_total=total)
+    if first_unlabeled is not None:
+        last_id = first_unlabeled - 1
+    handle = model.registry.save(model_name, estimator, model.FEATURES, rows=rows_used, last_id=last_id,
+                                 class_counts=class_counts if supervised else None, **meta)
+    logging.info(f"✅ Trained {model_name} v{handle.version} ({meta['mode']}) on {rows_used} rows.")
+    return handle
@@ -0,0 +1,53 @@
+# conftest.py
+# Shared fixtures: every test gets a throwaway SQLite database and model directory,
+# so transactions.db and ml/saved_models are left alone.
+
+import os
+
+import pytest
+
+from app import audit, database
+from ml import model
+from ml.registry import ModelRegistry
+
+
+@pytest.fixture
+def db_engine(tmp_path):
+    """Points the app at a fresh SQLite file for the test and yields its engine."""
+    original = database.engine
+    engine = database.make_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    database.engine = engine
+    database.SessionLocal.configure(bind=engine)
+    database.create_db()
+    try:
+        yield engine
+    finally:
+        # Audit events still queued would otherwise be written to the real database.
+        audit.writer.flush()
+        engine.dispose()
+        database.engine = original
+        database.SessionLocal.configure(bind=original)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """An empty model registry in a temp directory, installed as ml.model.registry."""
+    path = os.path.join(tmp_path, "models")
+    reg = ModelRegistry(path)
+    monkeypatch.setattr(model, "MODELS_DIR", path)
+    monkeypatch.setattr(model, "registry", reg)
+    return reg
+
+
+@pytest.fixture
+def client(db_engine):
+    """A TestClient for the app, logged in as a fresh user 'alice'."""
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    test_client = TestClient(app)
+    test_client.post("/users/", json={"username": "alice", "password": "pw"})
+    token = test_client.post("/token", data={"username": "alice", "password": "pw"}).json()["access_token"]
+    test_client.headers["Authorization"] = f"Bearer {token}"
+    return test_client
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from app import audit, database
+
+
+class _Broken:
+    def begin(self):
+        raise RuntimeError("database down")
+
+
+def _logged(db):
+    return {row.action for row in db.query(database.AuditLog)}
+
+
+def test_flush_returns_under_steady_traffic(db_engine):
+    # The writer thread always holds a batch that is still filling, so there is never nothing in flight.
+    writer = audit.AuditWriter(flush_rows=10_000, flush_seconds=0.5)
+    writer.start()
+    stop = threading.Event()
+
+    def traffic(n):
+        i = 0
+        while not stop.is_set():
+            writer.record("bot", f"t{n}-{i}")
+            i += 1
+            time.sleep(0.002)
+
+    threads = [threading.Thread(target=traffic, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        time.sleep(0.2)
+        writer.record("alice", "before flush")
+        started = time.perf_counter()
+        writer.flush(timeout=5)
+        elapsed = time.perf_counter() - started
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+        writer.stop()
+    assert elapsed < 1.5  # at most the writer's current batch, not the 5 s timeout
+    assert "before flush" in _logged(database.SessionLocal())
+
+
+def test_dropped_events_do_not_hold_up_flush(db_engine, monkeypatch):
+    writer = audit.AuditWriter(queue_size=2)
+    writer.record("alice", "a")
+    writer.record("alice", "b")
+    batch = [writer._queue.get_nowait(), writer._queue.get_nowait()]
+    writer.record("alice", "c")
+    writer.record("alice", "d")
+    # The write fails and the queue is full again, so a and b are dropped.
+    monkeypatch.setattr(database, "engine", _Broken())
+    writer._write(batch)
+    monkeypatch.undo()
+
+    started = time.perf_counter()
+    writer.flush(timeout=5)
+    assert time.perf_counter() - started < 1.0
+    assert _logged(database.SessionLocal()) == {"c", "d"}
@@ -0,0 +1,34 @@
+import sqlalchemy
+
+from app import auto_detection, counters, database, scoring
+from ml import model
+
+
+def test_rows_labeled_by_a_run_mid_batch_are_not_counted_twice(db_engine, monkeypatch):
+    t = database.Transaction.__table__
+    with db_engine.begin() as conn:
+        conn.execute(t.insert(), [{"id": i, "card_token": "c", "amount": float(i), "is_fraud": -1} for i in range(1, 11)])
+        counters.recount(conn)
+
+    def decide(df, model_name, handle=None, path="score"):
+        # A detection run labels rows 1-3 after the batch read them but before it writes.
+        with db_engine.begin() as conn:
+            conn.execute(t.update().where(t.c.id <= 3).values(is_fraud=1))
+            counters.record(conn, unprocessed=-3, fraudulent=3)
+        is_fraud = (df["id"] % 2 == 0).astype(int)
+        return df.assign(is_fraud=is_fraud, rule=None, explanation=is_fraud.map({0: "legit", 1: "rule"}))
+
+    monkeypatch.setattr(model, "get_handle", lambda name: None)
+    monkeypatch.setattr(model, "add_features", lambda df, **kwargs: df)
+    monkeypatch.setattr(scoring, "decide", decide)
+    detector = auto_detection.AutoDetector(model_name="IsolationForest")
+    detector._label([(list(range(1, 11)), 0.0)])
+
+    with db_engine.begin() as conn:
+        counted = counters.summary(conn)
+        labels = dict(conn.execute(sqlalchemy.select(t.c.id, t.c.is_fraud)).all())
+    assert [labels[i] for i in (1, 2, 3)] == [1, 1, 1]
+    # Rows 4-10 are this batch's: 4, 6, 8 and 10 fraudulent.
+    assert counted == {"total_transactions": 10, "fraudulent": 3 + 4, "legit": 3, "fraud_percentage": 70.0,
+                       "unprocessed": 0}
+    assert (detector.stats["labeled"], detector.stats["skipped"]) == (7, 3)
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.base import clone
+
+from ml import compiled, features, model
+
+
+def _features(n, seed):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "card_token": rng.integers(0, max(n // 20, 1), n).astype(str),
+        "timestamp": pd.Timestamp("2024-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 30 * 86400, n)), unit="s"),
+        "amount": rng.lognormal(4, 1.2, n).round(2),
+    })
+    X = features.compute(df)
+    X["is_fraud"] = ((X["amount"] > X["amount_mean_7d"] * 3) | (X["txn_count_1h"] > 3)).astype(int)
+    return X
+
+
+@pytest.fixture(scope="module")
+def data():
+    # More rows than compiled.ROW_BLOCK, so the blocked path is covered too.
+    return _features(5000, seed=1), _features(3 * compiled.ROW_BLOCK + 17, seed=2)[model.FEATURES]
+
+
+@pytest.mark.parametrize("name", list(model.AVAILABLE_MODELS))
+def test_compiled_predictions_match_sklearn(name, data):
+    train, X = data
+    estimator = clone(model.AVAILABLE_MODELS[name])
+    if name == "IsolationForest":
+        estimator.fit(train[model.FEATURES])
+    else:
+        estimator.fit(train[model.FEATURES], train["is_fraud"])
+    fast = compiled.compile_model(estimator)
+    assert fast is not None
+    np.testing.assert_array_equal(fast.predict(X.to_numpy(dtype=np.float32)), estimator.predict(X))
+
+
+def test_compiled_model_requires_predict():
+    with pytest.raises(TypeError):
+        compiled.CompiledModel()
@@ -0,0 +1,83 @@
+import threading
+import uuid
+
+import pytest
+import sqlalchemy
+
+from app import database, detection_runs
+
+
+def _run(shards=1):
+    """A running run with `shards` pending shards of 10 rows each, inserted directly."""
+    run_id = uuid.uuid4().hex
+    db = database.SessionLocal()
+    try:
+        db.add(database.DetectionRun(id=run_id, model_name="IsolationForest", model_version=1, status="running",
+                                     total=10 * shards, chunk_size=10, workers=1))
+        db.flush()
+        for i in range(shards):
+            db.add(database.DetectionShard(run_id=run_id, lo=10 * i + 1, hi=10 * (i + 1), total=10))
+        db.commit()
+    finally:
+        db.close()
+    return run_id
+
+
+def test_racing_workers_lease_each_shard_once(db_engine):
+    run_id = _run(shards=2)
+    barrier = threading.Barrier(6)
+    claimed = []
+
+    def claim(owner):
+        barrier.wait()
+        claimed.append((owner, detection_runs.claim(run_id, owner)))
+
+    threads = [threading.Thread(target=claim, args=(f"w{i}",)) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    won = [(owner, shard) for owner, shard in claimed if shard is not None]
+    assert len(won) == 2
+    assert len({shard["id"] for _, shard in won}) == 2
+    with db_engine.connect() as conn:
+        owners = dict(conn.execute(sqlalchemy.select(detection_runs._shards.c.id, detection_runs._shards.c.owner)).all())
+    assert owners == {shard["id"]: owner for owner, shard in won}
+
+
+def test_an_expired_lease_is_claimed_again_and_the_old_owner_loses_it(db_engine):
+    run_id = _run()
+    first = detection_runs.claim(run_id, "old", lease_seconds=-1)
+    assert detection_runs.claim(run_id, "new", lease_seconds=60)["id"] == first["id"]
+    assert detection_runs.claim(run_id, "late") is None  # the new lease is live
+    assert detection_runs.heartbeat(first["id"], "old") is False
+    assert detection_runs.heartbeat(first["id"], "new") is True
+
+
+def test_lost_lease_rolls_back_the_chunk(db_engine):
+    run_id = _run()
+    db = database.SessionLocal()
+    try:
+        db.add_all([database.Transaction(id=i, amount=1.0, is_fraud=-1) for i in range(1, 11)])
+        db.commit()
+    finally:
+        db.close()
+    shard = detection_runs.claim(run_id, "old", lease_seconds=-1)
+    detection_runs.claim(run_id, "new")
+
+    db = database.SessionLocal()
+    try:
+        t = database.Transaction.__table__
+        db.execute(t.update().where(t.c.id <= 5).values(is_fraud=0))
+        with pytest.raises(detection_runs.LeaseLost):
+            detection_runs.record_chunk(db, shard["id"], "old", rows=5, fraudulent=0, stages={})
+        db.rollback()  # what Worker._process does on LeaseLost
+    finally:
+        db.close()
+
+    with db_engine.connect() as conn:
+        labels = conn.execute(sqlalchemy.select(database.Transaction.__table__.c.is_fraud)).scalars().all()
+        row = conn.execute(sqlalchemy.select(detection_runs._shards)).mappings().one()
+    assert labels == [-1] * 10
+    assert (row["owner"], row["processed"]) == ("new", 0)
@@ -0,0 +1,66 @@
+import asyncio
+import datetime
+
+import httpx
+
+from app import database, explanations, services
+
+
+def _flag_pending(db, amounts):
+    services.insert_transactions(db, [
+        {"card_number": f"41111111111111{i:02d}", "amount": a, "is_fraud": 1, "explanation": database.EXPLANATION_PENDING}
+        for i, a in enumerate(amounts)
+    ])
+    db.commit()
+
+
+def _round(worker, handler):
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await worker._drain_all(client, asyncio.Semaphore(1))
+    return asyncio.run(run())
+
+
+def _reply(text):
+    return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+
+def test_outage_leaves_rows_pending_and_backs_off(db_engine):
+    db = database.SessionLocal()
+    _flag_pending(db, [100.0, 250.0])
+    worker = explanations.ExplanationWorker(api_url="http://gemini.test", api_key="k", enabled=True,
+                                            batch_size=1, max_retries=0)
+    assert _round(worker, lambda request: httpx.Response(503)) == 0
+    assert worker.pending_count(db) == 2
+    failures = db.query(database.ExplanationFailure).all()
+    assert [f.attempts for f in failures] == [1, 1]
+
+    # Still backing off: no requests are made.
+    requests = worker.stats["requests"]
+    assert _round(worker, lambda request: _reply("unreachable")) == 0
+    assert worker.stats["requests"] == requests and worker.stats["deferred"] == 2
+
+    db.query(database.ExplanationFailure).update({"retry_at": datetime.datetime.utcnow()})
+    db.commit()
+    assert _round(worker, lambda request: _reply("Unusual amount.")) == 2
+    assert worker.pending_count(db) == 0
+    assert db.query(database.ExplanationFailure).count() == 0
+    assert {t.explanation for t in db.query(database.Transaction)} == {"Unusual amount."}
+
+
+def test_cache_insert_tolerates_existing_keys(db_engine):
+    db = database.SessionLocal()
+    _flag_pending(db, [42.0])
+    worker = explanations.ExplanationWorker(api_url="http://gemini.test", api_key="k", enabled=True, batch_size=1)
+
+    def answer(request):
+        # Another process's worker caches the same inputs while this request is in flight.
+        with database.engine.begin() as conn:
+            conn.execute(database.ExplanationCache.__table__.insert().values(
+                key=explanations.cache_key({"amount": 42.0, "hour": db.query(database.Transaction).one().timestamp.hour}),
+                explanation="Cached elsewhere.", created_at=datetime.datetime.utcnow(),
+            ))
+        return _reply("Fresh answer.")
+
+    assert _round(worker, answer) == 1
+    assert db.query(database.Transaction).one().explanation == "Fresh answer."
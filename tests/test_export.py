@@ -0,0 +1,79 @@
+import csv
+import datetime
+import gzip
+import io
+
+import pytest
+
+from app import database, export, services
+
+pa, pq = export.pa, export.pq
+columnar = pytest.mark.skipif(not export.columnar_available(), reason="pyarrow is not installed")
+
+T0 = datetime.datetime(2024, 1, 1)
+
+
+def _insert(n=5):
+    """n fraud cases (with explanations that need quoting) and one legit row; returns the ids newest first."""
+    db = database.SessionLocal()
+    try:
+        ids = services.insert_transactions(db, [
+            {"card_number": f"40000000000000{i:02d}", "amount": 10.5 * i, "is_fraud": 1,
+             "explanation": f'Case {i}, "quoted"\nsecond line', "timestamp": T0 + datetime.timedelta(hours=i)}
+            for i in range(n)
+        ] + [{"card_number": "4000000000000099", "amount": 1.0, "is_fraud": 0, "timestamp": T0}])
+        db.commit()
+    finally:
+        db.close()
+    return list(reversed(ids[:n]))
+
+
+def _check(rows, ids):
+    assert [int(r["id"]) for r in rows] == ids
+    assert [float(r["amount"]) for r in rows] == [10.5 * i for i in reversed(range(len(ids)))]
+    assert rows[0]["explanation"] == f'Case {len(ids) - 1}, "quoted"\nsecond line'
+    assert rows[0]["masked_card_number"].endswith(f"{len(ids) - 1:02d}")
+
+
+def test_csv_round_trips_across_batches(db_engine):
+    ids = _insert()
+    for compressed in (False, True):
+        data = b"".join(export.csv_stream(gzip=compressed, batch_size=2))
+        if compressed:
+            data = gzip.decompress(data)
+        rows = list(csv.DictReader(io.StringIO(data.decode(), newline="")))
+        assert list(rows[0]) == export.COLUMNS
+        _check(rows, ids)
+        assert rows[-1]["timestamp"] == T0.isoformat()
+
+
+@columnar
+def test_parquet_has_a_row_group_per_batch(db_engine):
+    ids = _insert()
+    parquet = pq.ParquetFile(io.BytesIO(b"".join(export.columnar_stream("parquet", batch_size=2))))
+    assert parquet.num_row_groups == 3
+    rows = parquet.read().to_pylist()
+    _check(rows, ids)
+    assert rows[-1]["timestamp"] == T0
+
+
+@columnar
+def test_arrow_stream_round_trips(db_engine):
+    ids = _insert()
+    reader = pa.ipc.open_stream(b"".join(export.columnar_stream("arrow", batch_size=2)))
+    _check(reader.read_all().to_pylist(), ids)
+
+
+def test_download_endpoint(client):
+    assert client.get("/fraud/report/download").status_code == 404
+    ids = _insert(3)
+    response = client.get("/fraud/report/download", params={"gzip": True})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/gzip"
+    assert 'filename=fraud_report_' in response.headers["content-disposition"]
+    _check(list(csv.DictReader(io.StringIO(gzip.decompress(response.content).decode(), newline=""))), ids)
+    response = client.get("/fraud/report/download", params={"format": "parquet"})
+    if export.columnar_available():
+        _check(pq.read_table(io.BytesIO(response.content)).to_pylist(), ids)
+    else:
+        assert response.status_code == 501
@@ -0,0 +1,91 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from app import database
+from ml import features
+
+T0 = datetime.datetime(2024, 1, 1)
+
+
+def _frame(events):
+    """(card, minutes after T0, amount) triples as a raw transaction frame."""
+    return pd.DataFrame({
+        "card_token": [card for card, _, _ in events],
+        "timestamp": [T0 + datetime.timedelta(minutes=m) for _, m, _ in events],
+        "amount": [amount for _, _, amount in events],
+    })
+
+
+EVENTS = [
+    ("a", 0, 10.0),
+    ("b", 10, 100.0),
+    ("a", 30, 20.0),
+    ("a", 120, 5.0),
+    ("b", 60 * 30, 50.0),
+    ("a", 60 * 48, 40.0),
+    ("a", 60 * 24 * 10, 1.0),  # more than 7 days after everything else
+]
+
+
+def test_window_features_match_a_per_card_walk():
+    out = features.compute(_frame(EVENTS))
+    # Card a: 0m 10, 30m 20, 2h 5, 2d 40, 10d 1.
+    assert out.loc[[0, 2, 3, 5, 6], "txn_count_1h"].tolist() == [1, 2, 1, 1, 1]
+    assert out.loc[[0, 2, 3, 5, 6], "txn_count_24h"].tolist() == [1, 2, 3, 1, 1]
+    assert out.loc[[0, 2, 3, 5, 6], "txn_count_7d"].tolist() == [1, 2, 3, 4, 1]
+    assert out.loc[[0, 2, 3, 5, 6], "amount_sum_24h"].tolist() == [10, 30, 35, 40, 1]
+    assert out.loc[[0, 2, 3, 5, 6], "amount_max_7d"].tolist() == [10, 20, 20, 40, 1]
+    assert out.loc[3, "amount_mean_24h"] == 35 / 3
+    assert out.loc[[0, 2, 3, 5], "secs_since_prev"].tolist() == [features.HORIZON, 30 * 60, 90 * 60, 46 * 3600]
+    assert out.loc[6, "secs_since_prev"] == features.HORIZON  # capped
+    # Card b: 10m 100, 30h 50.
+    assert out.loc[[1, 4], "txn_count_24h"].tolist() == [1, 1]
+    assert out.loc[[1, 4], "amount_max_7d"].tolist() == [100, 100]
+    assert out.loc[4, "secs_since_prev"] == (30 * 60 - 10) * 60
+
+
+def test_chunks_through_a_store_match_one_pass():
+    whole = features.compute(_frame(EVENTS))
+    store = features.CardStateStore()
+    parts = [features.compute(_frame(EVENTS[i:i + 2]), store=store) for i in range(0, len(EVENTS), 2)]
+    chunked = pd.concat(parts, ignore_index=True)
+    pd.testing.assert_frame_equal(chunked, whole)
+    assert store.history(["a"])[1].tolist() == [pd.Timestamp(T0 + datetime.timedelta(days=10)).value // 10**6]
+
+
+def test_update_false_leaves_the_store_alone():
+    store = features.CardStateStore()
+    features.compute(_frame(EVENTS[:3]), store=store)
+    before = [a.tolist() for a in store.history(["a", "b"])]
+    features.compute(_frame(EVENTS[3:]), store=store, update=False)
+    assert [a.tolist() for a in store.history(["a", "b"])] == before
+
+
+def test_seeding_before_id_matches_one_pass(db_engine):
+    frame = _frame(EVENTS)
+    with db_engine.begin() as conn:
+        conn.execute(database.Transaction.__table__.insert(), [
+            {"id": i + 1, "card_token": row.card_token, "timestamp": row.timestamp, "amount": row.amount, "is_fraud": -1}
+            for i, row in enumerate(frame.itertuples())
+        ])
+    # A shard starting at id 4 sees ids 1-3 through the loader, whatever their labels.
+    db = database.SessionLocal()
+    try:
+        seeded = features.compute(frame.iloc[3:], store=features.CardStateStore(),
+                                  loader=features.db_history_loader(db, before_id=4))
+        labeled_only = features.compute(frame.iloc[3:], store=features.CardStateStore(),
+                                          loader=features.db_history_loader(db))
+    finally:
+        db.close()
+    pd.testing.assert_frame_equal(seeded, features.compute(frame).iloc[3:])
+    assert labeled_only.loc[3, "txn_count_24h"] == 1  # without before_id only labeled rows seed
+
+
+def test_rows_without_a_card_are_first_transactions():
+    frame = _frame([("a", 0, 10.0), ("a", 5, 20.0)])
+    frame.loc[1, "card_token"] = None
+    out = features.compute(frame)
+    assert out["txn_count_24h"].tolist() == [1, 1]
+    assert np.all(out["secs_since_prev"] == features.HORIZON)
@@ -0,0 +1,15 @@
+import re
+
+
+def _rows_ingested(client) -> float:
+    found = re.search(r"^rows_ingested_total (\S+)$", client.get("/metrics").text, re.M)
+    return float(found.group(1)) if found else 0.0  # not rendered until the first increment
+
+
+def test_plain_ingest_counts_its_rows(client):
+    before = _rows_ingested(client)
+    batch = {"transactions": [{"card_number": "4111111111111111", "amount": 10.0 + i} for i in range(3)]}
+    assert client.post("/ingest_batch/", json=batch).status_code == 200
+    assert _rows_ingested(client) == before + 3
+    assert client.post("/ingest_batch/", params={"bulk": True}, json=batch).status_code == 200
+    assert _rows_ingested(client) == before + 6
@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+
+from sklearn.tree import DecisionTreeClassifier
+
+from ml.registry import ModelRegistry
+
+FEATURES = ["amount"]
+
+
+def _fitted():
+    return DecisionTreeClassifier(max_depth=1).fit([[1.0], [2.0]], [0, 1])
+
+
+def _save_from_process(models_dir, barrier):
+    registry = ModelRegistry(models_dir)
+    estimator = _fitted()
+    barrier.wait()
+    registry.save("DecisionTree", estimator, FEATURES, promote=False)
+
+
+def test_processes_saving_at_once_get_distinct_versions(tmp_path):
+    models_dir = str(tmp_path)
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(4)
+    processes = [context.Process(target=_save_from_process, args=(models_dir, barrier)) for _ in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join(60)
+    assert [p.exitcode for p in processes] == [0, 0, 0, 0]
+    registry = ModelRegistry(models_dir)
+    assert registry.versions("DecisionTree") == [1, 2, 3, 4]
+    assert sorted(h["version"] for h in registry.describe("DecisionTree")) == [1, 2, 3, 4]
+
+
+def test_save_moves_past_a_version_taken_meanwhile(tmp_path, monkeypatch):
+    registry = ModelRegistry(str(tmp_path))
+    registry.save("DecisionTree", _fitted(), FEATURES)
+    # Another process wrote v2 after this one listed the versions.
+    other = ModelRegistry(str(tmp_path))
+    stale = registry.versions
+    monkeypatch.setattr(registry, "versions", lambda name: [1])
+    other.save("DecisionTree", _fitted(), FEATURES, promote=False)
+    handle = registry.save("DecisionTree", _fitted(), FEATURES, promote=False)
+    monkeypatch.setattr(registry, "versions", stale)
+    assert handle.version == 3 and handle.meta["version"] == 3
+    assert registry.versions("DecisionTree") == [1, 2, 3]
+
+
+def test_promotion_in_the_same_mtime_tick_is_seen(tmp_path):
+    registry = ModelRegistry(str(tmp_path))
+    for _ in range(2):
+        registry.save("DecisionTree", _fitted(), FEATURES, promote=False)
+    pointer = os.path.join(str(tmp_path), "DecisionTree", "CURRENT")
+    registry.promote("DecisionTree", 1)
+    assert registry.current_version("DecisionTree") == 1
+    stat = os.stat(pointer)
+    ModelRegistry(str(tmp_path)).promote("DecisionTree", 2)
+    os.utime(pointer, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert registry.current_version("DecisionTree") == 2
@@ -0,0 +1,106 @@
+import datetime
+
+import pandas as pd
+import pytest
+import sqlalchemy
+
+from app import auto_detection, counters, database, detection, services
+from app.progress import ProgressTracker
+from ml import model
+
+T0 = datetime.datetime(2024, 1, 1)
+
+
+def _insert_fraud(db_engine):
+    """25 fraud cases on 5 timestamps (ties broken by id) and 5 legit rows between them."""
+    rows = [{"amount": 1.0, "is_fraud": 1, "timestamp": T0 + datetime.timedelta(hours=i % 5)} for i in range(25)]
+    rows += [{"amount": 1.0, "is_fraud": 0, "timestamp": T0 + datetime.timedelta(hours=i)} for i in range(5)]
+    with db_engine.begin() as conn:
+        conn.execute(database.Transaction.__table__.insert(), rows)
+        counters.recount(conn)
+    t = database.Transaction.__table__
+    with db_engine.connect() as conn:
+        return conn.execute(
+            sqlalchemy.select(t.c.id).where(t.c.is_fraud == 1).order_by(t.c.timestamp.desc(), t.c.id.desc())
+        ).scalars().all()
+
+
+def test_cursor_pages_cover_every_case_once_across_timestamp_ties(db_engine):
+    expected = _insert_fraud(db_engine)
+    db = database.SessionLocal()
+    try:
+        seen, cursor, pages = [], None, 0
+        while True:
+            page = services.get_fraud_report_chunk(db, 1, 4, cursor)
+            seen += [case["id"] for case in page["fraud_cases"]]
+            pages += 1
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        offset = [case["id"] for n in range(1, 8) for case in services.get_fraud_report_chunk(db, n, 4)["fraud_cases"]]
+        summary = page["summary"]
+    finally:
+        db.close()
+    assert seen == expected
+    assert pages == 7
+    assert offset == expected
+    assert (summary["fraudulent"], summary["total_transactions"]) == (25, 30)
+
+
+def test_malformed_cursor_is_a_bad_request(client):
+    with pytest.raises(ValueError):
+        services.decode_cursor("not-a-cursor")
+    assert client.get("/fraud/report", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def _assert_counters_match_the_table(unprocessed=None):
+    t = database.Transaction.__table__
+    with database.engine.connect() as conn:
+        counted = dict(conn.execute(sqlalchemy.select(t.c.is_fraud, sqlalchemy.func.count()).group_by(t.c.is_fraud)).all())
+        summary = counters.summary(conn)
+    assert summary["unprocessed"] == counted.get(-1, 0)
+    assert summary["fraudulent"] == counted.get(1, 0)
+    assert summary["total_transactions"] == sum(counted.values())
+    if unprocessed is not None:
+        assert summary["unprocessed"] == unprocessed
+
+
+def _ingest(client, n, bulk=False):
+    batch = {"transactions": [{"card_number": f"40000000000000{i % 7:02d}", "amount": 10.0 + 37 * (i % 11)}
+                              for i in range(n)]}
+    assert client.post("/ingest_batch/", params={"bulk": bulk}, json=batch).status_code == 200
+
+
+def test_counters_follow_every_writer(client, registry):
+    _ingest(client, 40)
+    _ingest(client, 30, bulk=True)
+    _assert_counters_match_the_table()
+
+    t = database.Transaction.__table__
+    with database.engine.connect() as conn:
+        frame = pd.read_sql(sqlalchemy.select(t.c.card_token, t.c.timestamp, t.c.amount), conn)
+    model.train_model_from_df(frame, "IsolationForest")
+    db = database.SessionLocal()
+    try:
+        detection.DetectionPipeline(db, "IsolationForest", ProgressTracker(detection.STAGES), chunk_size=25,
+                                    workers=1).run()
+    finally:
+        db.close()
+    _assert_counters_match_the_table(unprocessed=0)
+
+    _ingest(client, 20)
+    with database.engine.connect() as conn:
+        new_ids = conn.execute(sqlalchemy.select(t.c.id).where(t.c.is_fraud == -1)).scalars().all()
+    auto_detection.AutoDetector(model_name="IsolationForest")._label([(new_ids, 0.0)])
+    _assert_counters_match_the_table(unprocessed=0)
+
+    # Rows written behind the counters' back are repaired by the backfill.
+    with database.engine.begin() as conn:
+        conn.execute(t.update().where(t.c.id <= 10).values(is_fraud=1))
+    assert client.post("/maintenance/backfill").status_code == 200
+    _assert_counters_match_the_table()
+
+    assert client.post("/transactions/clear").status_code == 200
+    _assert_counters_match_the_table()
+    with database.engine.connect() as conn:
+        assert counters.summary(conn)["total_transactions"] == 0
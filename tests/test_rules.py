@@ -0,0 +1,118 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import rules
+
+
+def _frame():
+    return pd.DataFrame({
+        "amount": [5.0, 50.0, 500.0, 5000.0],
+        "timestamp": pd.to_datetime(["2024-01-01 23:30", "2024-01-01 03:00", "2024-01-01 12:00", "2024-01-01 06:15"]),
+        "txn_count_1h": [1.0, 3.0, 7.0, 1.0],
+        "amount_mean_7d": [5.0, 10.0, 400.0, 100.0],
+    })
+
+
+def _matches(condition):
+    rule_set = rules.RuleSet([{"name": "r", "conditions": [condition]}])
+    return rule_set.rules[0].mask(rule_set._columns(_frame())).tolist()
+
+
+@pytest.mark.parametrize("op, value, expected", [
+    (">", 50, [False, False, True, True]),
+    (">=", 50, [False, True, True, True]),
+    ("<", 50, [True, False, False, False]),
+    ("<=", 50, [True, True, False, False]),
+    ("==", 500, [False, False, True, False]),
+    ("!=", 500, [True, True, False, True]),
+    ("between", [50, 500], [False, True, True, False]),
+    ("in", [5, 5000], [True, False, False, True]),
+])
+def test_operators_on_amount(op, value, expected):
+    assert _matches({"field": "amount", "op": op, "value": value}) == expected
+
+
+def test_between_hours_wraps_past_midnight():
+    assert _matches({"field": "hour", "op": "between", "value": [22, 6]}) == [True, True, False, False]
+    assert _matches({"field": "hour", "op": "between", "value": [6, 6.25]}) == [False, False, False, True]
+
+
+def test_comparison_with_another_field():
+    value = {"field": "amount_mean_7d", "times": 4, "plus": 1}
+    assert _matches({"field": "amount", "op": ">", "value": value}) == [False, True, False, True]
+
+
+def test_conditions_are_anded_and_the_first_matching_rule_decides():
+    rule_set = rules.RuleSet([
+        {"name": "small", "action": "allow", "conditions": [{"field": "amount", "op": "<", "value": 10}]},
+        {"name": "burst", "explanation": "Burst.", "conditions": [
+            {"field": "txn_count_1h", "op": ">=", "value": 3},
+            {"field": "amount", "op": ">", "value": 100},
+        ]},
+        {"name": "big", "conditions": [{"field": "amount", "op": ">", "value": 1}]},
+    ])
+    decisions = rule_set.apply(_frame())
+    assert decisions.rule.tolist() == ["small", "big", "burst", "big"]
+    assert decisions.is_fraud.tolist() == [0, 1, 1, 1]
+    assert decisions.explanation.tolist()[:3] == ["Matched rule 'small'.", "Matched rule 'big'.", "Burst."]
+
+
+@pytest.mark.parametrize("spec, message", [
+    ({"name": "r", "conditions": [{"field": "amount", "op": "~", "value": 1}]}, "unknown operator"),
+    ({"name": "r", "conditions": [{"field": "amount", "op": "between", "value": 5}]}, "Rule 'r'"),
+    ({"name": "r", "conditions": [{"field": "amount", "op": ">", "value": None}]}, "Rule 'r'"),
+    ({"name": "r", "conditions": [{"field": "amount", "op": "in", "value": None}]}, "Rule 'r'"),
+    ({"name": "r", "conditions": [{"field": "amount", "op": "between", "value": [9, 1]}]}, "low <= high"),
+    ({"name": "r", "conditions": [{"field": "zip", "op": ">", "value": 1}]}, "unknown field"),
+    ({"name": "r", "action": "block", "conditions": [{"field": "amount", "op": ">", "value": 1}]}, "action"),
+    ({"name": "r", "conditions": []}, "no conditions"),
+    ({"conditions": [{"field": "amount", "op": ">", "value": 1}]}, "needs a name"),
+])
+def test_invalid_rules_are_rejected(spec, message):
+    with pytest.raises(ValueError, match=message):
+        rules.compile_rule(spec)
+
+
+def _write(path, specs):
+    path.write_text(json.dumps({"rules": specs}))
+    # Make each rewrite visible even when it lands within the filesystem's mtime resolution.
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_disabled_rules_are_validated_but_skipped(tmp_path):
+    path = tmp_path / "rules.json"
+    _write(path, [
+        {"name": "off", "enabled": False, "conditions": [{"field": "amount", "op": ">", "value": 0}]},
+        {"name": "on", "conditions": [{"field": "amount", "op": ">", "value": 1000}]},
+    ])
+    rule_set = rules.RuleSet.load(str(path))
+    assert [r.name for r in rule_set.rules] == ["on"]
+    assert rule_set.apply(_frame()).rule.tolist() == [None, None, None, "on"]
+    with pytest.raises(ValueError):
+        rules.RuleSet([{"name": "off", "enabled": False, "conditions": [{"field": "amount", "op": "~", "value": 0}]}])
+
+
+def test_hot_reload_picks_up_changes_and_keeps_the_last_good_rules(tmp_path):
+    path = tmp_path / "rules.json"
+    _write(path, [{"name": "big", "conditions": [{"field": "amount", "op": ">", "value": 1000}]}])
+    engine = rules.RuleEngine(str(path), check_seconds=0)
+    assert [r.name for r in engine.current().rules] == ["big"]
+
+    _write(path, [{"name": "small", "action": "allow", "conditions": [{"field": "amount", "op": "<", "value": 10}]}])
+    assert [r.name for r in engine.current().rules] == ["small"]
+
+    path.write_text("{not json")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 2_000_000_000))
+    assert [r.name for r in engine.current().rules] == ["small"]
+    assert engine.error is not None
+    with pytest.raises(ValueError):
+        engine.reload()
+
+    os.remove(path)
+    assert engine.current().rules == []
+    assert np.all(pd.isna(engine.current().apply(_frame()).rule))
@@ -0,0 +1,49 @@
+import datetime
+
+import pandas as pd
+import sqlalchemy
+
+from app import database, scoring, security, services
+from ml import features, model
+
+
+def _no_model(monkeypatch):
+    monkeypatch.setattr(model, "predict", lambda df, *args, **kwargs: pd.Series(0, index=df.index))
+
+
+def test_a_card_new_to_the_store_is_seeded_from_the_database(db_engine, monkeypatch):
+    _no_model(monkeypatch)
+    monkeypatch.setattr(model, "feature_store", features.CardStateStore())
+    card = "4000000000000002"
+    now = datetime.datetime.utcnow()
+    db = database.SessionLocal()
+    try:
+        services.insert_transactions(db, [
+            {"card_number": card, "amount": 10.0, "timestamp": now - datetime.timedelta(minutes=30)},
+            {"card_number": card, "amount": 30.0, "timestamp": now - datetime.timedelta(hours=5)},
+        ])
+        db.commit()
+        df = pd.DataFrame({"card_token": [security.card_token(card)], "timestamp": [now], "amount": [20.0]})
+        cold = scoring.score_frame(df, "IsolationForest", db=db).iloc[0]
+    finally:
+        db.close()
+    assert (cold["txn_count_1h"], cold["txn_count_24h"], cold["amount_max_24h"]) == (2, 3, 30.0)
+    assert cold["secs_since_prev"] == 30 * 60
+    assert len(model.feature_store) == 0  # seeded privately; the shared store is detection's
+    alone = scoring.score_frame(df, "IsolationForest").iloc[0]
+    assert alone["txn_count_24h"] == 1
+
+
+def test_persisted_rows_keep_the_scoring_time(db_engine, monkeypatch):
+    _no_model(monkeypatch)
+    monkeypatch.setattr(model, "get_handle", lambda name: None)
+    txs = [{"card_number": "4000000000000002", "amount": 5.0}]
+    decisions = scoring.MicroBatcher._score("IsolationForest", [txs])[0]
+    db = database.SessionLocal()
+    try:
+        services.insert_transactions(db, [{**tx, **d} for tx, d in zip(txs, decisions)])
+        db.commit()
+        stored = db.execute(sqlalchemy.select(database.Transaction.timestamp)).scalar()
+    finally:
+        db.close()
+    assert stored == decisions[0]["timestamp"]
@@ -0,0 +1,64 @@
+from app import database, security
+
+
+def test_parallel_encryption_round_trips_in_spawned_workers(monkeypatch):
+    monkeypatch.setattr(security, "ENCRYPT_WORKERS", 2)
+    monkeypatch.setattr(security, "ENCRYPT_PARALLEL_MIN_ROWS", 10)
+    values = [f"4000{i:012d}" for i in range(50)]
+    try:
+        encrypted = security.encrypt_many(values)
+        assert security._encrypt_pool._mp_context.get_start_method() == "spawn"
+    finally:
+        security.shutdown_encrypt_pool()
+    assert [security.decrypt_data(e) for e in encrypted] == values
+
+
+def test_principal_cache_expires_and_evicts(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(security.time, "monotonic", lambda: clock[0])
+    cache = security.PrincipalCache(ttl=60, max_entries=2)
+    cache.put("t1", "alice")
+    cache.put("t2", "bob", token_exp=security.time.time() + 10)  # the token's exp comes first
+    cache.put("t3", "carol", token_exp=security.time.time() - 1)  # already expired: not cached
+    assert (cache.get("t1"), cache.get("t2"), cache.get("t3")) == ("alice", "bob", None)
+    clock[0] += 11
+    assert (cache.get("t1"), cache.get("t2")) == ("alice", None)
+    cache.put("t4", "dave")
+    cache.put("t5", "erin")  # evicts t1, the least recently used
+    assert (cache.get("t1"), len(cache)) == (None, 2)
+    clock[0] += 60
+    assert cache.get("t4") is None
+
+
+def _user(db):
+    return db.query(database.User).filter(database.User.username == "alice").one()
+
+
+def test_changing_a_user_drops_its_cached_tokens(client):
+    assert client.get("/fraud/report").status_code == 200
+    token = client.headers["Authorization"].split()[1]
+    assert security.principal_cache.get(token) == "alice"
+
+    db = database.SessionLocal()
+    try:
+        _user(db).hashed_password = security.get_password_hash("new")
+        db.commit()
+        assert security.principal_cache.get(token) is None
+        assert client.get("/fraud/report").status_code == 200  # the token itself is still valid
+
+        _user(db).username = "alicia"
+        db.commit()
+        assert client.get("/fraud/report").status_code == 401
+    finally:
+        db.close()
+
+
+def test_deleting_a_user_rejects_its_cached_token(client):
+    assert client.get("/fraud/report").status_code == 200
+    db = database.SessionLocal()
+    try:
+        db.delete(_user(db))
+        db.commit()
+    finally:
+        db.close()
+    assert client.get("/fraud/report").status_code == 401
@@ -0,0 +1,32 @@
+import datetime
+
+from fastapi.testclient import TestClient
+
+from app import database, security
+from app.main import app
+
+
+def test_ticket_is_single_use(db_engine):
+    ticket = security.issue_stream_ticket("alice")
+    assert security.redeem_stream_ticket(ticket) == "alice"
+    assert security.redeem_stream_ticket(ticket) is None
+    assert security.redeem_stream_ticket("made-up") is None
+
+
+def test_expired_ticket_is_refused(db_engine):
+    ticket = security.issue_stream_ticket("alice")
+    table = database.StreamTicket.__table__
+    with database.engine.begin() as conn:
+        conn.execute(table.update().values(expires_at=datetime.datetime.utcnow() - datetime.timedelta(seconds=1)))
+    assert security.redeem_stream_ticket(ticket) is None
+
+
+def test_stream_takes_a_ticket_not_the_bearer_token(db_engine):
+    client = TestClient(app)
+    client.post("/users/", json={"username": "alice", "password": "pw"})
+    token = client.post("/token", data={"username": "alice", "password": "pw"}).json()["access_token"]
+    assert client.get("/detection/progress/stream", params={"ticket": token}).status_code == 401
+    response = client.post("/detection/progress/ticket", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert security.redeem_stream_ticket(response.json()["ticket"]) == "alice"
+    assert client.post("/detection/progress/ticket").status_code == 401
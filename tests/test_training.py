@@ -0,0 +1,108 @@
+import threading
+import uuid
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import precision_score, recall_score
+from sklearn.tree import DecisionTreeClassifier
+
+from app import database, training_jobs
+from ml import evaluation, model, training
+
+
+def test_reservoir_weights_restore_the_class_balance():
+    rng = np.random.default_rng(0)
+    reservoir = training.StratifiedReservoir(capacity=500)
+    for _ in range(10):
+        y = (rng.random(10_000) < 0.01).astype(int)
+        reservoir.add(rng.random((len(y), 3)), y)
+    X, y = reservoir.sample()
+    weights = reservoir.weights(y)
+    seen_fraud = reservoir.seen[1] / (reservoir.seen[0] + reservoir.seen[1])
+    assert abs((y == 1).mean() - 0.5) < 0.01  # the sample itself is balanced
+    assert abs(weights[y == 1].sum() / weights.sum() - seen_fraud) < 1e-9
+    assert abs(weights.mean() - 1.0) < 1e-9
+
+
+def test_weighted_fit_follows_the_table_not_the_sample():
+    # Overlapping classes: with the sample's 50/50 balance a tree flags about half of them,
+    # weighted back to 5% fraud it flags almost none.
+    rng = np.random.default_rng(1)
+    reservoir = training.StratifiedReservoir(capacity=2000)
+    y = (rng.random(40_000) < 0.05).astype(int)
+    X = rng.normal(y[:, None] * 0.3, 1.0, (len(y), 1))
+    reservoir.add(X, y)
+    Xs, ys = reservoir.sample()
+    unweighted = DecisionTreeClassifier(max_depth=2, random_state=0).fit(Xs, ys)
+    weighted = DecisionTreeClassifier(max_depth=2, random_state=0)
+    training.fit_weighted(weighted, pd.DataFrame(Xs), ys, reservoir.weights(ys))
+    test = rng.normal(0, 1.0, (5000, 1))
+    assert unweighted.predict(test).mean() > 0.2
+    assert weighted.predict(pd.DataFrame(test)).mean() < 0.05
+
+
+def _job(model_name):
+    return database.TrainingJob(id=uuid.uuid4().hex, model_name=model_name, username="alice", status="queued")
+
+
+def test_concurrent_claims_for_one_model_start_one_job(db_engine):
+    barrier = threading.Barrier(4)
+    claimed = []
+
+    def claim():
+        db = database.SessionLocal()
+        try:
+            barrier.wait()
+            claimed.append(training_jobs._claim(db, _job("DecisionTree"), ["DecisionTree"]))
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=claim) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(claimed) == [False, False, False, True]
+    db = database.SessionLocal()
+    assert db.query(database.TrainingJob).count() == 1
+
+
+def test_slot_is_freed_when_the_job_finishes(db_engine):
+    db = database.SessionLocal()
+    job = _job("DecisionTree")
+    assert training_jobs._claim(db, job, ["DecisionTree"])
+    assert not training_jobs._claim(db, _job("DecisionTree"), ["DecisionTree"])
+    assert training_jobs._claim(db, _job("RandomForest"), ["RandomForest"])
+    training_jobs._update(job.id, status="completed")
+    assert training_jobs._claim(db, _job("DecisionTree"), ["DecisionTree"])
+
+
+def test_evaluation_and_retraining_exclude_each_other(db_engine, monkeypatch):
+    db = database.SessionLocal()
+    launched = {}
+    monkeypatch.setattr(training_jobs, "_launch", lambda db, name, slots, *args, **kwargs: launched.update(slots=slots))
+    training_jobs.start_evaluation(db, "alice")
+    evaluation_slots = launched["slots"]
+    retrain = _job("DecisionTree")
+    assert training_jobs._claim(db, retrain, ["DecisionTree"])
+    assert not training_jobs._claim(db, _job(evaluation.ALL_MODELS), evaluation_slots)
+    training_jobs._update(retrain.id, status="completed")
+    assert training_jobs._claim(db, _job(evaluation.ALL_MODELS), evaluation_slots)
+    assert not training_jobs._claim(db, _job("RandomForest"), ["RandomForest"])
+
+
+def test_holdout_scores_follow_the_table_not_the_sample(tmp_path):
+    rng = np.random.default_rng(2)
+    y = (rng.random(100_000) < 0.05).astype(int)
+    X = rng.normal(0, 1.0, (len(y), len(model.FEATURES)))
+    X[:, 0] += y * 1.5
+    reservoir = training.StratifiedReservoir(capacity=3000)
+    reservoir.add(X, y)
+    Xs, ys = reservoir.sample()
+    path = str(tmp_path / "features.npy")
+    np.save(path, np.column_stack((Xs, reservoir.weights(ys), ys)))  # as build_matrix writes it
+
+    result, estimator = evaluation.evaluate_model("DecisionTree", path)
+    flagged = estimator.predict(pd.DataFrame(X, columns=model.FEATURES))
+    assert abs(result["precision"] - precision_score(y, flagged)) < 0.1
+    assert abs(result["recall"] - recall_score(y, flagged)) < 0.1